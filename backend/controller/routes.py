@@ -7,6 +7,7 @@ import time
 import logging
 import signal
 import json
+import functools
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
@@ -22,17 +23,33 @@ from backend.database.file_operations import FileOperation
 
 # importing protocols
 from backend.protocol.json_protocol import JsonProtocol
+from backend.protocol.batch import (BATCH, READ_TYPES, parse_batch, check_operations, is_read_only, runs, batch_request,
+                                    encode_operation, batch_response, split_batch_response, is_success, skipped)
 
 # importing replication
 from backend.replication.replication_manager import ReplicationManager
+from backend.replication.stream_codec import COMPRESSION_METHODS
+from backend.replication.mutation_log import RecordingStorage
+from backend.replication.sharding import ShardRouter
 
 # importing socket
 from backend.socket.socket_handler import SocketHandler
+from backend.socket.event_socket_handler import EventSocketHandler
+from backend.socket.request_scheduler import RequestScheduler
+from backend.protocol.handshake import Capabilities, ENCODINGS, COMPRESSIONS
+from backend.protocol.framing import MAX_FRAME_SIZE
+from backend.socket.process_frontend import (FrontendOwner, FrontendChannel, FrontendWorker,
+                                             create_ipc_listener)
 
 # Global variables
 controller = None
 replication_manager = None
+shard_controllers = []  # One controller and replication group per shard, index 0 is controller/replication_manager
+replication_managers = []
 socket_handler = None
+request_scheduler = None
+frontend_owner = None
+frontend_pids = []  # Forked front end processes serving the client port
 running = False
 args = None
 
@@ -40,19 +57,103 @@ class Controller:
     def __init__(self, business_logic: BusinessLogicInterface, json_protocol: SerializationInterface):
         self.business_logic = business_logic
         self.json_protocol = json_protocol
-        self.online_users = {}  # Track online users {username: client_socket}
+        self.online_users = {}  # Track online users {username: ClientHandle}, sendall() only queues
         self.lock = threading.Lock()  # For thread-safe operations
+        self.shard_router = None  # Set when requests are spread over several replication groups
 
     def handle_incoming_message(self, data: bytes, client_socket: socket.socket=None):
         print(f"Received data: {data}")
         print(f"Client socket: {client_socket}")
         
         try:
-            return replication_manager.handle_client_operation(data,client_socket)
+            operations = parse_batch(data)
+            if operations is not None:
+                response = self.handle_batch(operations, client_socket)
+            elif self.shard_router is not None:
+                response = self.shard_router.dispatch(data, client_socket)
+            else:
+                response = replication_manager.handle_client_operation(data,client_socket)
+            if self.shard_router is not None:
+                # Each shard has its own primary; clients are sent to the one holding their session
+                return self.shard_router.add_primary_hint(data, response)
+            # Clients that reached a backup learn where to send their next requests
+            return replication_manager.add_primary_hint(response)
         except Exception as e:
             print(f"Error handling incoming message: {e}")
             return self.json_protocol.serialize_error(f"Error: {str(e)}")
 
+    def handle_batch(self, operations: list, client_socket: socket.socket=None) -> bytes:
+        """
+        Handle the operations of a BATCH request, in order.
+        
+        Consecutive reads are handled as one read-only batch: one pass through
+        the retry loop, one forward to the primary if this is a backup, and
+        one load of each collection. Logins and writes are handled one by one
+        as if sent separately. Reads after a write go to the primary, so they
+        see it. Once a login fails the rest are not run.
+        
+        Args:
+            operations: The batch's requests
+            client_socket: Socket of the client that sent the batch
+            
+        Returns:
+            BATCH response with one response per operation
+        """
+        print(f"Handling batch of {len(operations)} operations")
+        responses = []
+        login_failed = False
+        wrote = False
+        for run in runs(operations):
+            if login_failed:
+                responses.extend(skipped(len(run), "Not run, login failed"))
+                continue
+            if len(run) > 1 and self.shard_router is None:
+                response = replication_manager.handle_client_operation(batch_request(run), client_socket,
+                                                                       local_read=not wrote)
+                responses.extend(split_batch_response(response, len(run)))
+                continue
+            for op in run:
+                data = encode_operation(op)
+                if self.shard_router is not None:
+                    responses.append(self.shard_router.dispatch(data, client_socket))
+                else:
+                    responses.append(replication_manager.handle_client_operation(data, client_socket,
+                                                                                 local_read=not wrote))
+                login_failed = op.get('type') == 'L' and not is_success(responses[-1])
+                wrote = wrote or op.get('type') not in READ_TYPES + ['L']
+        return batch_response(responses)
+
+    
+    def push_notification(self, receiver: str, notification: bytes) -> bool:
+        """
+        Push a live message to a user with a session on this server.
+        
+        Args:
+            receiver: User the message is for
+            notification: Message to push
+            
+        Returns:
+            True if it was queued on the user's connection
+        """
+        # Check if receiver is online
+        print(f"Attempting to acquire lock to check if {receiver} is online")
+        print(f"Current online users: {self.online_users}")
+        with self.lock:
+            print(f"Lock acquired, checking if {receiver} is in online_users")
+            receiver_handle = self.online_users.get(receiver)
+        print(f"Lock released after checking {receiver}")
+        
+        if receiver_handle is None:
+            print(f"Receiver {receiver} not found in online_users")
+            return False
+        try:
+            # Queued on the receiver's connection, a slow receiver never holds up the sender
+            receiver_handle.sendall(notification)
+            print(f"Queued notification for {receiver}")
+            return True
+        except Exception as e:
+            print(f"Error sending notification to {receiver}: {e}")
+            return False
     
     def deserialize_message(self, data: bytes, client_socket: socket.socket=None):
         print(f"Received data: {data}")
@@ -177,24 +278,10 @@ class Controller:
                         }
                     }
                     
-                    # Check if receiver is online
-                    print(f"Attempting to acquire lock to check if {receiver} is online")
-                    print(f"Current online users: {self.online_users}")
-                    with self.lock:
-                        print(f"Lock acquired, checking if {receiver} is in online_users")
-                        if receiver in self.online_users:
-                            try:
-                                # Send notification to receiver
-                                receiver_socket = self.online_users[receiver]
-                                print(f"Found socket for {receiver} in online_users")
-                                notification_data = json.dumps(notification).encode('utf-8')
-                                receiver_socket.sendall(notification_data)
-                                print(f"Sent notification to {receiver}")
-                            except Exception as e:
-                                print(f"Error sending notification to {receiver}: {e}")
-                        else:
-                            print(f"Receiver {receiver} not found in online_users")
-                    print(f"Lock released after checking {receiver}")
+                    notification_data = json.dumps(notification).encode('utf-8')
+                    if not self.push_notification(receiver, notification_data) and self.shard_router is not None:
+                        # The receiver's session may be on the primary of their own shard
+                        self.shard_router.notify(sender, receiver, notification_data)
                     
                     return self.json_protocol.serialize_success("Message sent successfully")
                 else:
@@ -255,6 +342,16 @@ class Controller:
                     return self.json_protocol.serialize_success("Log off time updated")
                 else:
                     return self.json_protocol.serialize_error("Failed to update log off time")
+            elif msg_type == BATCH:  # Reads answered together, see Controller.handle_batch
+                operations = check_operations(payload)
+                if not is_read_only(operations):
+                    return self.json_protocol.serialize_error("Only reads can be combined into one pass")
+                
+                # One load of each collection serves every read of the batch
+                with self.business_logic.read_pass():
+                    responses = [self.deserialize_message(encode_operation(op), client_socket) for op in operations]
+                print(f"Answered batch of {len(operations)} reads in one pass")
+                return batch_response(responses)
             else:
                 return self.json_protocol.serialize_error("Invalid message type")
                 
@@ -265,9 +362,11 @@ class Controller:
             print(f"Traceback: {error_traceback}")
             return self.json_protocol.serialize_error(f"Error: {str(e)}")
 
-def handle_client_request(data, client_socket, is_replication=False):
-    """Handle a client request"""
+def handle_client_request(data, client_socket, is_replication=False, is_local_read=False, shard=0):
+    """Handle a client request for one shard's replication group"""
     global controller, replication_manager
+    shard_controller = shard_controllers[shard] if shard_controllers else controller
+    shard_manager = replication_managers[shard] if replication_managers else replication_manager
     
     try:
         # Log the incoming request
@@ -276,45 +375,36 @@ def handle_client_request(data, client_socket, is_replication=False):
         
         # Check if we have a primary
         print(f"handle_client_request: Checking if we are primary")
-        is_primary = replication_manager.is_primary()
+        is_primary = shard_manager.is_primary()
         print(f"handle_client_request: is_primary result: {is_primary}")
         
-        if not is_primary and not is_replication:
+        if not is_primary and not is_replication and not is_local_read:
             print(f"handle_client_request: We are not primary, forwarding request")
             # We're not the primary, so we need to forward the request to the primary
-            primary = replication_manager.get_primary()
+            primary = shard_manager.get_primary()
             print(f"handle_client_request: get_primary result: {primary}")
             
             if primary:
                 print(f"handle_client_request: Forwarding request to primary: {primary}")
-                # Create a socket to the primary
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect(primary)
-                s.sendall(data)
+                # Pooled connection to the primary, the response arrives whole whatever its size
+                response = shard_manager.forwarding_proxy.forward(primary, data)
                 
-                # Wait for a response
-                response = s.recv(4096)
-                s.close()
-                
-                # Forward the response to the client
-                if client_socket:
-                    client_socket.sendall(response)
+                # The socket handler sends it to the client
                 return response
             else:
                 # No primary, so we can't process the request
                 print("handle_client_request: No primary available to process request")
                 error_message = "No primary available to process request. Please try again later."
-                error_bytes = error_message.encode('utf-8')
-                if client_socket:
-                    client_socket.sendall(error_bytes)
-                    return error_bytes
+                return error_message.encode('utf-8')
             
         # We are the primary, so we can process the request
         if is_replication:
             print("handle_client_request: Processing request for replication")
+        elif is_local_read:
+            print("handle_client_request: Serving read from local replica state")
         else:
             print("handle_client_request: We are primary, processing request")
-        response = controller.deserialize_message(data, client_socket)
+        response = shard_controller.deserialize_message(data, client_socket)
         print(f"handle_client_request: Got response from controller: {response[:100] if response else None}")
         
         return response
@@ -324,70 +414,247 @@ def handle_client_request(data, client_socket, is_replication=False):
         import traceback
         traceback.print_exc()
         error_message = f"Error handling request: {str(e)}"
-        error_bytes = error_message.encode('utf-8')
-        if client_socket:
+        return error_message.encode('utf-8')
+
+def lookup_password_hash(username):
+    """Stored password hash of a user for a front end process; None if the login must go to the primary"""
+    shard = controller.shard_router.shard_for_user(username) if controller.shard_router else 0
+    probe = json.dumps({"type": "L", "payload": [username, ""]}).encode('utf-8')
+    if not replication_managers[shard].can_read_locally(probe):
+        return None
+    user_data = shard_controllers[shard].business_logic.get_user(username)
+    if not user_data:
+        return b''
+    stored_password = user_data[0].get("user_password")
+    return stored_password if isinstance(stored_password, bytes) else None
+
+def create_request_scheduler(handler):
+    """Bounded worker pools for client requests, so overload turns into fast rejections instead of slow responses"""
+    return RequestScheduler(
+        handler,
+        workers={'auth': args.auth_workers, 'write': args.write_workers, 'read': args.read_workers},
+        max_depth=args.max_queue_depth,
+        max_queue_wait=args.max_queue_wait
+    )
+
+def create_socket_handler(scheduler, reuse_port=False):
+    """Socket handler for client connections of the kind chosen with --client-server"""
+    logger = logging.getLogger(__name__)
+    capabilities = Capabilities(encodings=[e for e in args.encodings.split(',') if e],
+                                compressions=[c for c in args.compressions.split(',') if c],
+                                max_frame_size=args.max_frame_size)
+    if args.client_server == 'event':
+        return EventSocketHandler(host='0.0.0.0', port=args.client_port, controller=controller, logger=logger,
+                                  scheduler=scheduler, reuse_port=reuse_port, capabilities=capabilities)
+    return SocketHandler(host='0.0.0.0', port=args.client_port, controller=controller, logger=logger,
+                         reuse_port=reuse_port, scheduler=scheduler, capabilities=capabilities)
+
+def run_frontend_process(number, ipc_path):
+    """Body of a forked front end process: serve clients on the shared port and pass their requests to the owner"""
+    global socket_handler, request_scheduler, running
+    print(f"Front end {number} started with pid {os.getpid()}")
+    
+    def stop(*_):
+        global running
+        running = False
+    
+    channel = FrontendChannel(ipc_path, on_close=stop)
+    channel.connect()
+    request_scheduler = create_request_scheduler(FrontendWorker(channel, JsonProtocol()).handle)
+    request_scheduler.start()
+    socket_handler = create_socket_handler(request_scheduler, reuse_port=True)
+    if not socket_handler.start_server(message_handler=request_scheduler.handle):
+        return
+    
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    running = True
+    while running:
+        time.sleep(0.5)
+    socket_handler.stop_server()
+    request_scheduler.stop()
+    print(f"Front end {number} stopped")
+
+def start_front_ends():
+    """
+    Fork the front end processes that serve the client port.
+    
+    They are forked before this process starts any thread, and share the
+    port with SO_REUSEPORT, so the kernel spreads new connections over them.
+    
+    Returns:
+        Listening socket of the channel they use to reach this process, or None
+        if clients are served from this process
+    """
+    global frontend_pids
+    if args.client_processes <= 1:
+        return None
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'):
+        print("Multiple client processes need fork and SO_REUSEPORT, serving clients from this process")
+        return None
+    
+    ipc_path = os.path.join(args.data_dir, "frontend.sock")
+    listener = create_ipc_listener(ipc_path)
+    for number in range(args.client_processes):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
             try:
-                client_socket.sendall(error_bytes)
+                run_frontend_process(number, ipc_path)
             except Exception as e:
-                print(f"handle_client_request: Error sending error response: {e}")
-        return error_bytes
+                print(f"Front end {number} failed: {e}")
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        frontend_pids.append(pid)
+    print(f"Started {len(frontend_pids)} front end processes for client port {args.client_port}")
+    return listener
 
 def start_server():
-    global controller, replication_manager, socket_handler, running, args
+    global controller, replication_manager, shard_controllers, replication_managers, socket_handler, request_scheduler, frontend_owner, running, args
     parser = argparse.ArgumentParser(description='Start a chat server with replication')
     parser.add_argument('--id', type=str, required=True, help='Unique server ID')
     parser.add_argument('--host', type=str, default='localhost', help='Host to bind to')
     parser.add_argument('--port', type=int, required=True, help='Replication port')
     parser.add_argument('--client-port', type=int, required=True, help='Client port')
     parser.add_argument('--data-dir', type=str, required=True, help='Data directory')
-    parser.add_argument('--replicas', type=str, required=True, help='Comma-separated list of replicas (host:port)')
+    parser.add_argument('--replicas', type=str, required=True, help='Comma-separated list of replicas (host:port) to join the cluster through')
+    parser.add_argument('--read-lease', type=float, default=1.0,
+                        help='Seconds after a primary heartbeat during which a backup serves reads locally (0 forwards all reads)')
+    parser.add_argument('--replication-engine', choices=['thread', 'asyncio'], default='thread',
+                        help='Run replication with a thread per peer connection or on a single asyncio event loop')
+    parser.add_argument('--heartbeat-interval', type=float, default=0.5,
+                        help='Seconds between heartbeats sent by the primary')
+    parser.add_argument('--election-timeout-min', type=float, default=1.5,
+                        help='Minimum seconds without a heartbeat before a backup starts an election')
+    parser.add_argument('--election-timeout-max', type=float, default=3.0,
+                        help='Maximum seconds without a heartbeat before a backup starts an election')
+    parser.add_argument('--replication-compression', choices=COMPRESSION_METHODS, default=COMPRESSION_METHODS[0],
+                        help='Preferred compression for replication streams; backups may negotiate a less preferred one')
+    parser.add_argument('--initial-election-wait', type=float, default=5.0,
+                        help='Seconds to wait for a primary at startup before promoting this server')
+    parser.add_argument('--forward-connections', type=int, default=2,
+                        help='Connections a backup keeps open to the primary for forwarding client requests')
+    parser.add_argument('--apply-workers', type=int, default=4,
+                        help='Replicated entries a backup applies in parallel (1 applies them one at a time)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Independent replication groups, each owning a hash range of usernames; '
+                             'every server of the cluster must use the same value')
+    parser.add_argument('--shard-port-stride', type=int, default=100,
+                        help='Shard N replicates on the --port and --replicas ports plus N times this value')
+    parser.add_argument('--client-server', choices=['thread', 'event'], default='thread',
+                        help='Serve clients with a thread per connection, or multiplex all connections on '
+                             'one event loop')
+    parser.add_argument('--auth-workers', type=int, default=2,
+                        help='Login and registration requests processed at the same time')
+    parser.add_argument('--write-workers', type=int, default=4,
+                        help='Message, delete, view count and log off requests processed at the same time')
+    parser.add_argument('--read-workers', type=int, default=4,
+                        help='Read requests processed at the same time')
+    parser.add_argument('--max-queue-depth', type=int, default=64,
+                        help='Requests of each kind that may wait for a worker before new ones are rejected')
+    parser.add_argument('--max-queue-wait', type=float, default=2.0,
+                        help='Seconds a request may wait for a worker before it is rejected')
+    parser.add_argument('--encodings', default=','.join(ENCODINGS),
+                        help='Comma separated encodings offered to clients in the handshake, preferred first; '
+                             'JSON is always accepted')
+    parser.add_argument('--compressions', default=','.join(COMPRESSIONS),
+                        help='Comma separated compressions offered to clients in the handshake, preferred first; '
+                             'empty to send everything uncompressed')
+    parser.add_argument('--max-frame-size', type=int, default=MAX_FRAME_SIZE,
+                        help='Largest client message in bytes; clients may agree on a smaller one')
+    parser.add_argument('--client-processes', type=int, default=1,
+                        help='Processes serving the client port; with more than one, clients are served by '
+                             'forked front end processes and this process only runs replication and storage')
     
     args = parser.parse_args()
     
     # Create data directory if it doesn't exist
     os.makedirs(args.data_dir, exist_ok=True)
     
-    # Initialize the database
-    db_operations = FileOperation(args.data_dir)
-    print(f"Successfully initialized file-based storage in {args.data_dir}")
-    
-    # Initialize the business logic
-    business_logic = BusinessLogic(db_operations)
+    # Fork the front end processes while this process has no threads yet
+    frontend_listener = start_front_ends()
     
     # Initialize the JSON protocol
     json_protocol = JsonProtocol()
     
-    # Initialize the controller
-    controller = Controller(business_logic, json_protocol)
-    
     # Parse the replicas string
     replicas = []
     for replica in args.replicas.split(','):
         host, port = replica.split(':')
         replicas.append((host, int(port)))
-    
-    # Initialize the replication manager
     local_address = (args.host, args.port)
     if local_address not in replicas:
         replicas.append(local_address)
-    replication_manager = ReplicationManager(
-        server_id=args.id,
-        data_dir=args.data_dir,
-        replica_addresses=replicas,
-        local_address=local_address,
-        client_handler=handle_client_request
-    )
     
-    # Start the replication manager
-    replication_manager.start()
+    shard_controllers = []
+    replication_managers = []
+    for shard in range(args.shards):
+        # A single group keeps its data where it always was
+        shard_dir = args.data_dir if args.shards == 1 else os.path.join(args.data_dir, f"shard-{shard}")
+        offset = shard * args.shard_port_stride
+        
+        # Initialize the database; writes are recorded so backups can apply them without re-running requests
+        db_operations = RecordingStorage(FileOperation(shard_dir))
+        print(f"Successfully initialized file-based storage in {shard_dir}")
+        
+        # Initialize the business logic and the shard's controller
+        business_logic = BusinessLogic(db_operations)
+        shard_controller = Controller(business_logic, json_protocol)
+        if shard_controllers:
+            # Online users are per process, whichever shard they are stored in
+            shard_controller.online_users = shard_controllers[0].online_users
+            shard_controller.lock = shard_controllers[0].lock
+        shard_controllers.append(shard_controller)
+        
+        # Initialize the shard's replication manager
+        replication_managers.append(ReplicationManager(
+            server_id=args.id,
+            data_dir=shard_dir,
+            replica_addresses=[(host, port + offset) for host, port in replicas],
+            local_address=(args.host, args.port + offset),
+            client_handler=functools.partial(handle_client_request, shard=shard),
+            storage=db_operations,
+            read_lease_duration=args.read_lease,
+            engine=args.replication_engine,
+            heartbeat_interval=args.heartbeat_interval,
+            election_timeout_min=args.election_timeout_min,
+            election_timeout_max=args.election_timeout_max,
+            initial_election_wait=args.initial_election_wait,
+            replication_compression=args.replication_compression,
+            forward_pool_size=args.forward_connections,
+            client_address=(args.host, args.client_port),
+            apply_workers=args.apply_workers,
+            notify_handler=shard_controller.push_notification
+        ))
+    controller = shard_controllers[0]
+    replication_manager = replication_managers[0]
+    if args.shards > 1:
+        # Every shard's controller needs it to pass live messages on to other shards
+        shard_router = ShardRouter(replication_managers)
+        for shard_controller in shard_controllers:
+            shard_controller.shard_router = shard_router
     
-    # Initialize the socket handler for client connections
-    client_port = args.client_port
-    logger = logging.getLogger(__name__)
-    socket_handler = SocketHandler(host='0.0.0.0', port=client_port, controller=controller, logger=logger)
+    # Start the replication managers; each group elects its own primary, so they start side by side
+    start_threads = [threading.Thread(target=manager.start) for manager in replication_managers]
+    for thread in start_threads:
+        thread.start()
+    for thread in start_threads:
+        thread.join()
     
-    # Start the socket handler
-    socket_handler.start_server()
+    if frontend_listener is not None:
+        # The front end processes admit and parse client requests; answer what they pass on
+        frontend_owner = FrontendOwner(frontend_listener, controller, lookup_password_hash,
+                                       workers=args.client_processes * (args.write_workers + args.read_workers))
+        frontend_owner.start()
+    else:
+        request_scheduler = create_request_scheduler(controller.handle_incoming_message)
+        request_scheduler.start()
+        
+        # Initialize and start the socket handler for client connections
+        socket_handler = create_socket_handler(request_scheduler)
+        socket_handler.start_server(message_handler=request_scheduler.handle)
     
     # Set up signal handlers
     def signal_handler(sig, frame):
@@ -405,12 +672,29 @@ def start_server():
         shutdown()
 
 def shutdown():
-    global replication_manager, socket_handler
+    global replication_manager, replication_managers, socket_handler, request_scheduler, frontend_owner
     print("\nShutting down server...")
-    if replication_manager:
-        replication_manager.stop()
+    for manager in replication_managers or [replication_manager]:
+        if manager and manager.is_primary():
+            # Let a backup take over right away instead of after an election timeout
+            manager.transfer_leadership()
+    for manager in replication_managers or [replication_manager]:
+        if manager:
+            manager.stop()
+    if controller and controller.shard_router:
+        controller.shard_router.stop()
     if socket_handler:
         socket_handler.stop_server()
+    if request_scheduler:
+        request_scheduler.stop()
+    for pid in frontend_pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except OSError as e:
+            print(f"Error stopping front end process {pid}: {e}")
+    if frontend_owner:
+        frontend_owner.stop()
 
 if __name__ == "__main__":
     start_server()
\ No newline at end of file
@@ -3,6 +3,7 @@ import os
 from datetime import datetime
 import threading
 import base64
+from contextlib import contextmanager
 from backend.interfaces.db_interface import MongoDBInterface
 
 class FileOperation(MongoDBInterface):
@@ -34,6 +35,9 @@ class FileOperation(MongoDBInterface):
             'messages': threading.Lock()
         }
         
+        # Collections loaded during the current read pass, per thread
+        self.local = threading.local()
+        
         print(f"Successfully initialized file-based storage in {self.data_dir}")
 
     def _load_collection(self, collection_name):
@@ -59,6 +63,35 @@ class FileOperation(MongoDBInterface):
             print(f"Error loading collection {collection_name}: {e}")
             return []
 
+    @contextmanager
+    def read_pass(self):
+        """
+        Load each collection at most once for the reads made on this thread while the block runs.
+        
+        Every read loads and parses the whole collection file, so a request
+        made of several reads, like a batch, would otherwise parse the same
+        file several times. Reads inside the block see the collection as it
+        was when first loaded; writes are not affected.
+        """
+        if getattr(self.local, "loaded", None) is not None:
+            # Already in a read pass
+            yield
+            return
+        self.local.loaded = {}
+        try:
+            yield
+        finally:
+            self.local.loaded = None
+
+    def _read_collection(self, collection_name):
+        """Load a collection for a read, reusing it within a read pass"""
+        loaded = getattr(self.local, "loaded", None)
+        if loaded is None:
+            return self._load_collection(collection_name)
+        if collection_name not in loaded:
+            loaded[collection_name] = self._load_collection(collection_name)
+        return loaded[collection_name]
+
     def _save_collection(self, collection_name, data):
         """Save a collection to file"""
         file_path = self.collections.get(collection_name)
@@ -75,6 +108,35 @@ class FileOperation(MongoDBInterface):
             print(f"Error saving collection {collection_name}: {e}")
             return False
     
+    def export_snapshot(self):
+        """Export the raw contents of every collection file for a snapshot"""
+        snapshot = {}
+        for collection_name, file_path in self.collections.items():
+            with self.locks[collection_name]:
+                try:
+                    with open(file_path, 'r') as f:
+                        snapshot[collection_name] = f.read()
+                except Exception as e:
+                    print(f"Error exporting collection {collection_name}: {e}")
+                    snapshot[collection_name] = "[]"
+        return snapshot
+
+    def install_snapshot(self, snapshot):
+        """Replace the collection files with the contents of a snapshot"""
+        for collection_name, contents in snapshot.items():
+            file_path = self.collections.get(collection_name)
+            if not file_path:
+                print(f"Skipping unknown collection {collection_name} in snapshot")
+                continue
+            with self.locks[collection_name]:
+                tmp_path = file_path + ".tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(contents)
+                # Swap the file in atomically so readers never see a partial file
+                os.replace(tmp_path, file_path)
+        print(f"Installed snapshot with collections: {list(snapshot.keys())}")
+        return True
+
     def _json_serial(self, obj):
         """JSON serializer for objects not serializable by default json code"""
         if isinstance(obj, datetime):
@@ -116,10 +178,10 @@ class FileOperation(MongoDBInterface):
             query = {}
             
         with self.locks[collection_name]:
-            data = self._load_collection(collection_name)
+            data = self._read_collection(collection_name)
             
             if not query:  # If query is empty, return all documents
-                return data
+                return list(data)
             
             # Filter documents based on query
             result = []
@@ -250,6 +250,10 @@ class BusinessLogic(BusinessLogicInterface):
         else:
             print(f"Log off time update failed for user: {user_name}")
             return False
+
+    def read_pass(self):
+        """Let the reads made on this thread inside the block load each collection only once"""
+        return self.db_operations.read_pass()
         
 if __name__ == "__main__":
     from backend.database.mongo_operations import MongoOperation
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 
 class BusinessLogicInterface(ABC):
     @abstractmethod
@@ -50,3 +51,7 @@ class BusinessLogicInterface(ABC):
     def update_log_off_time(self, user_name) -> bool:
         """Update the log off time for a specified user."""
         pass
+
+    def read_pass(self):
+        """Context in which several reads of this thread may share one pass over the data; nothing by default."""
+        return nullcontext()
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 
 class MongoDBInterface(ABC):
     @abstractmethod
@@ -20,3 +21,7 @@ class MongoDBInterface(ABC):
     def delete(self, collection_name, query):
         """Delete a document from a specified collection based on a query."""
         pass
+
+    def read_pass(self):
+        """Context in which the reads of this thread may share loaded data; nothing by default."""
+        return nullcontext()
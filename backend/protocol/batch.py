@@ -0,0 +1,171 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+BATCH = "BATCH"
+# Operations one batch may carry, so a single request cannot occupy a worker indefinitely
+MAX_BATCH_OPERATIONS = 32
+# Operations that only read state; a run of them shares one pass through replication and storage
+READ_TYPES = ['G', 'GM', 'GS']
+AUTH_TYPES = ['R', 'L']
+
+
+def batch_request(operations: List[dict]) -> bytes:
+    """
+    Combine operations into one request.
+
+    Args:
+        operations: Requests, each a dict with "type" and "payload"
+
+    Returns:
+        The BATCH request
+    """
+    return json.dumps({"type": BATCH, "payload": list(operations)}).encode('utf-8')
+
+
+def parse_batch(data: bytes) -> Optional[List[dict]]:
+    """
+    Get the operations of a BATCH request.
+
+    Args:
+        data: Request bytes, JSON
+
+    Returns:
+        The operations, or None if the request is not a batch
+
+    Raises:
+        ValueError: If the request is a batch but its operations are malformed or too many
+    """
+    if b'"BATCH"' not in data[:64]:
+        return None
+    try:
+        request = json.loads(data.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if not isinstance(request, dict) or request.get('type') != BATCH:
+        return None
+    return check_operations(request.get('payload'))
+
+
+def check_operations(operations) -> List[dict]:
+    """
+    Check the payload of a BATCH request.
+
+    Raises:
+        ValueError: If it is not a list of operations, or longer than MAX_BATCH_OPERATIONS
+    """
+    if not isinstance(operations, list) or not all(isinstance(op, dict) and op.get('type') for op in operations):
+        raise ValueError("Batch payload must be a list of requests")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"Batch of {len(operations)} requests exceeds the maximum of {MAX_BATCH_OPERATIONS}")
+    if any(op.get('type') == BATCH for op in operations):
+        raise ValueError("Batches cannot be nested")
+    return operations
+
+
+def operation_types(operations) -> List[str]:
+    """Types of the operations of a batch payload, ignoring anything malformed"""
+    if not isinstance(operations, list):
+        return []
+    return [op.get('type') for op in operations if isinstance(op, dict)]
+
+
+def is_read_only(operations: List[dict]) -> bool:
+    """Check whether every operation of a batch only reads state"""
+    return all(op_type in READ_TYPES for op_type in operation_types(operations))
+
+
+def runs(operations: List[dict]) -> List[List[dict]]:
+    """
+    Split a batch into the runs it is executed in.
+
+    Consecutive reads form one run, executed together; every other
+    operation is a run of its own, so writes and logins keep their own
+    locking, replication and retries.
+
+    Returns:
+        The runs, in request order
+    """
+    result = []
+    for op in operations:
+        if op.get('type') in READ_TYPES and result and result[-1][0].get('type') in READ_TYPES:
+            result[-1].append(op)
+        else:
+            result.append([op])
+    return result
+
+
+def encode_operation(operation: dict) -> bytes:
+    """One operation of a batch as a request of its own"""
+    return json.dumps(operation).encode('utf-8')
+
+
+def is_success(response: Optional[bytes]) -> bool:
+    """Check whether a response reports success"""
+    try:
+        decoded = json.loads(response.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+        return False
+    return isinstance(decoded, dict) and decoded.get('type') == 'S'
+
+
+def skipped(count: int, reason: str) -> List[bytes]:
+    """Error responses for operations that were not run"""
+    return [json.dumps({"type": "E", "payload": reason}).encode('utf-8')] * count
+
+
+def batch_response(responses: List[Optional[bytes]]) -> bytes:
+    """
+    Combine the responses of a batch's operations into one response.
+
+    Responses are spliced in as they are instead of being decoded again;
+    the plain text some error paths answer with becomes an error object.
+
+    Args:
+        responses: Response of each operation, in request order
+
+    Returns:
+        {"type": "BATCH", "payload": [response, ...]}
+    """
+    parts = []
+    for response in responses:
+        stripped = (response or b'').strip()
+        if stripped[:1] in (b'{', b'['):
+            parts.append(stripped)
+        else:
+            text = stripped.decode('utf-8', errors='replace') or "No response"
+            parts.append(json.dumps({"type": "E", "payload": text}).encode('utf-8'))
+    return b'{"type": "BATCH", "payload": [' + b', '.join(parts) + b']}'
+
+
+def split_batch_response(response: Optional[bytes], count: int) -> List[bytes]:
+    """
+    Get the responses of the operations of a batch back from its response.
+
+    Args:
+        response: Response to a BATCH request
+        count: Number of operations in the batch
+
+    Returns:
+        One response per operation; if the batch as a whole failed, e.g.
+        because no primary was available, its error is every operation's response
+    """
+    return unpack_batch_response(response, count)[0]
+
+
+def unpack_batch_response(response: Optional[bytes], count: int) -> Tuple[List[bytes], Dict]:
+    """
+    Like split_batch_response, but also return the fields the batch response carries besides its payload.
+
+    Returns:
+        The responses of the operations, and the other fields, e.g. the
+        "primary" hint of a backup; none if the batch as a whole failed
+    """
+    try:
+        decoded = json.loads(response.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+        return [response] * count, {}
+    payload = decoded.get('payload') if isinstance(decoded, dict) and decoded.get('type') == BATCH else None
+    if not isinstance(payload, list) or len(payload) != count:
+        return [response] * count, {}
+    fields = {key: value for key, value in decoded.items() if key not in ('type', 'payload')}
+    return [json.dumps(item).encode('utf-8') for item in payload], fields
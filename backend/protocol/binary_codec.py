@@ -0,0 +1,329 @@
+import json
+import struct
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+# First byte of every binary message; JSON messages start with '{' or '['
+MAGIC = 0xB7
+HAS_ID = 0x01  # Header flag: a request id follows the flags
+
+# Value tags
+NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, DICT, MESSAGE = range(9)
+
+# Message types and keys sent as one byte; anything else is spelled out after OTHER.
+# Only append to these lists, the position is the wire code.
+MESSAGE_TYPES = ['S', 'E', 'M', 'B', 'BM', 'U', 'V', 'R', 'L', 'G', 'GS', 'GM', 'D', 'W', 'O', 'HELLO', 'BATCH']
+KEYS = ['type', 'payload', 'sender', 'recipient', 'receiver', 'message', 'timestamp', '_id', 'username',
+        'new_count', 'log_off_time', 'view_count', 'primary', 'retry_after', 'id', 'encoding', 'encodings']
+OTHER = 0xFF
+
+_TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+_KEY_CODES = {name: code for code, name in enumerate(KEYS)}
+_DOUBLE = struct.Struct('>d')
+_HEADER = struct.Struct('>BB')
+
+
+def is_binary(data: bytes) -> bool:
+    """Check whether a message is binary encoded rather than JSON"""
+    return bool(data) and data[0] == MAGIC
+
+
+def encode(message: Any, request_id: Any = None) -> bytes:
+    """
+    Encode a message.
+
+    A message is a struct-packed header (magic byte, flags), the request id
+    if there is one, and the message value. Strings and collections carry
+    varint lengths, a dict with a "type" is written as a type byte followed
+    by its other fields, and well known keys take one byte instead of their name.
+
+    Args:
+        message: JSON compatible value, usually a dict with "type" and "payload"
+        request_id: Id of the request; taken from the message's "id" field if
+            not given, or that of its first message if it is an array
+
+    Returns:
+        Encoded message
+    """
+    if request_id is None and isinstance(message, dict) and 'id' in message:
+        request_id = message['id']
+        message = {key: value for key, value in message.items() if key != 'id'}
+    elif request_id is None and isinstance(message, list) and message and isinstance(message[0], dict) \
+            and 'id' in message[0]:
+        request_id = message[0]['id']
+        message = [{key: value for key, value in message[0].items() if key != 'id'}] + message[1:]
+    out = bytearray(_HEADER.pack(MAGIC, HAS_ID if request_id is not None else 0))
+    if request_id is not None:
+        _write_value(out, request_id)
+    _write_value(out, message)
+    return bytes(out)
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decode a message.
+
+    Args:
+        data: Encoded message
+
+    Returns:
+        The message value, with its request id as "id" if it had one
+
+    Raises:
+        ValueError: If the data is not a well formed binary message
+    """
+    request_id, message, _ = _decode(data)
+    if request_id is not None and isinstance(message, dict):
+        message = {"id": request_id, **message}
+    elif request_id is not None and isinstance(message, list) and message and isinstance(message[0], dict):
+        message = [{"id": request_id, **message[0]}] + message[1:]
+    return message
+
+
+def peek_request_id(data: bytes) -> Any:
+    """Get a message's request id without decoding the message; None if it has none"""
+    if not is_binary(data) or len(data) < 2 or not data[1] & HAS_ID:
+        return None
+    try:
+        return _read_value(data, 2)[0]
+    except (IndexError, ValueError, UnicodeDecodeError):
+        return None
+
+
+def with_request_id(data: bytes, request_id: Any) -> bytes:
+    """Add a request id to an encoded message that has none, without re-encoding the message"""
+    if not is_binary(data) or data[1] & HAS_ID:
+        raise ValueError("Not a binary message without a request id")
+    out = bytearray(_HEADER.pack(MAGIC, data[1] | HAS_ID))
+    _write_value(out, request_id)
+    return bytes(out) + data[2:]
+
+
+def peek_first_field(data: bytes) -> Tuple[Optional[str], Any]:
+    """
+    Get the first field after the type of an encoded message without decoding the rest.
+
+    Fields spliced in front of a response, like a backup's primary hint, come
+    first; for an array of messages, those of its first message.
+
+    Returns:
+        Key and value of the field, or (None, None)
+    """
+    if not is_binary(data):
+        return None, None
+    try:
+        position = 2
+        if data[1] & HAS_ID:
+            position = _read_value(data, position)[1]
+        if data[position] == LIST:
+            position = _read_varint(data, position + 1)[1]
+        if data[position] != MESSAGE or data[position + 1] == OTHER:
+            return None, None
+        count, position = _read_varint(data, position + 2)
+        if not count or data[position] >= len(KEYS):
+            return None, None
+        return KEYS[data[position]], _read_value(data, position + 1)[0]
+    except (IndexError, ValueError, UnicodeDecodeError):
+        return None, None
+
+
+def to_json(data: bytes) -> bytes:
+    """Re-encode a binary message as JSON"""
+    return json.dumps(decode(data)).encode('utf-8')
+
+
+def from_json(data: bytes) -> bytes:
+    """
+    Re-encode a JSON message as binary.
+
+    Args:
+        data: JSON message, or the plain text some error paths answer with
+
+    Returns:
+        The binary message; plain text becomes an error message, empty data stays empty
+    """
+    if not data:
+        return b''
+    try:
+        message = json.loads(data.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        message = {"type": "E", "payload": data.decode('utf-8', errors='replace')}
+    return encode(message)
+
+
+def _decode(data: bytes) -> Tuple[Any, Any, int]:
+    if not is_binary(data) or len(data) < 2:
+        raise ValueError("Not a binary message")
+    try:
+        position = 2
+        request_id = None
+        if data[1] & HAS_ID:
+            request_id, position = _read_value(data, position)
+        message, position = _read_value(data, position)
+    except IndexError:
+        raise ValueError("Truncated binary message")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Invalid string in binary message: {e}")
+    if position != len(data):
+        raise ValueError(f"{len(data) - position} bytes after the end of the binary message")
+    return request_id, message, position
+
+
+def _write_varint(out: bytearray, number: int):
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _write_str(out: bytearray, text: str):
+    data = text.encode('utf-8')
+    if len(data) < 0x80:
+        out.append(len(data))
+    else:
+        _write_varint(out, len(data))
+    out += data
+
+
+def _write_fields(out: bytearray, fields: dict, skip: Optional[str] = None):
+    _write_varint(out, len(fields) - (1 if skip is not None else 0))
+    for key, value in fields.items():
+        if key == skip:
+            continue
+        code = _KEY_CODES.get(key)
+        if code is None:
+            out.append(OTHER)
+            _write_str(out, str(key))
+        else:
+            out.append(code)
+        _write_value(out, value)
+
+
+def _write_value(out: bytearray, value: Any):
+    kind = type(value)
+    if kind is str:
+        # Most values are short strings
+        data = value.encode('utf-8')
+        if len(data) < 0x80:
+            out += bytes((STR, len(data)))
+        else:
+            out.append(STR)
+            _write_varint(out, len(data))
+        out += data
+    elif value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, str):
+        out.append(STR)
+        _write_str(out, value)
+    elif isinstance(value, int):
+        out.append(INT)
+        _write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)  # Zigzag
+    elif isinstance(value, dict):
+        message_type = value.get('type')
+        if isinstance(message_type, str):
+            out.append(MESSAGE)
+            code = _TYPE_CODES.get(message_type)
+            if code is None:
+                out.append(OTHER)
+                _write_str(out, message_type)
+            else:
+                out.append(code)
+            _write_fields(out, value, skip='type')
+        else:
+            out.append(DICT)
+            _write_fields(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, datetime):
+        out.append(STR)
+        _write_str(out, value.isoformat())
+    else:
+        raise TypeError(f"Type {type(value)} not serializable")
+
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _read_str(data: bytes, position: int) -> Tuple[str, int]:
+    length = data[position]
+    if length < 0x80:
+        position += 1
+    else:
+        length, position = _read_varint(data, position)
+    end = position + length
+    if end > len(data):
+        raise IndexError(end)
+    return data[position:end].decode('utf-8'), end
+
+
+def _read_fields(data: bytes, position: int, fields: dict) -> Tuple[dict, int]:
+    count, position = _read_varint(data, position)
+    for _ in range(count):
+        code = data[position]
+        position += 1
+        if code == OTHER:
+            key, position = _read_str(data, position)
+        elif code < len(KEYS):
+            key = KEYS[code]
+        else:
+            raise ValueError(f"Unknown key code {code}")
+        fields[key], position = _read_value(data, position)
+    return fields, position
+
+
+def _read_value(data: bytes, position: int) -> Tuple[Any, int]:
+    tag = data[position]
+    position += 1
+    if tag == STR:
+        return _read_str(data, position)
+    if tag == MESSAGE:
+        code = data[position]
+        position += 1
+        if code == OTHER:
+            message_type, position = _read_str(data, position)
+        elif code < len(MESSAGE_TYPES):
+            message_type = MESSAGE_TYPES[code]
+        else:
+            raise ValueError(f"Unknown message type code {code}")
+        return _read_fields(data, position, {"type": message_type})
+    if tag == INT:
+        number, position = _read_varint(data, position)
+        return (number >> 1 if not number & 1 else -((number + 1) >> 1)), position
+    if tag == LIST:
+        count, position = _read_varint(data, position)
+        items = []
+        for _ in range(count):
+            item, position = _read_value(data, position)
+            items.append(item)
+        return items, position
+    if tag == DICT:
+        return _read_fields(data, position, {})
+    if tag == NONE:
+        return None, position
+    if tag == TRUE:
+        return True, position
+    if tag == FALSE:
+        return False, position
+    if tag == FLOAT:
+        if position + 8 > len(data):
+            raise IndexError(position)
+        return _DOUBLE.unpack_from(data, position)[0], position + 8
+    raise ValueError(f"Unknown value tag {tag}")
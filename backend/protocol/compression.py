@@ -0,0 +1,88 @@
+import zlib
+from typing import Optional
+
+ZLIB = "zlib"
+# First byte of a compressed message; never the first byte of UTF-8 text, JSON or a binary message
+COMPRESSED = 0xFE
+# Messages shorter than this are sent as they are; compressing them saves little and costs a flush
+COMPRESSION_THRESHOLD = 1024
+
+
+class StreamCompressor:
+    """
+    Compresses the messages one side of a connection sends.
+
+    All messages share one zlib stream, flushed after each message, so a
+    message can refer back to the ones before it: a message history sent
+    again after a few new messages costs little more than the new ones.
+    Messages must therefore be compressed in exactly the order they are
+    written, and the receiving StreamDecompressor must see every compressed
+    message. The zlib context is only created for the first message over the
+    threshold, so connections that never send one cost nothing.
+    """
+
+    def __init__(self, threshold: int = COMPRESSION_THRESHOLD, level: int = 6):
+        """
+        Initialize the compressor.
+
+        Args:
+            threshold: Smallest message that is compressed
+            level: zlib compression level
+        """
+        self.threshold = threshold
+        self.level = level
+        self.context = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, message: Optional[bytes]) -> bytes:
+        """
+        Compress a message if it is large enough.
+
+        Args:
+            message: Message bytes, in any encoding
+
+        Returns:
+            The message unchanged, or COMPRESSED followed by its compressed bytes
+        """
+        if not message or len(message) < self.threshold:
+            return message or b''
+        if self.context is None:
+            self.context = zlib.compressobj(self.level)
+        compressed = bytes([COMPRESSED]) + self.context.compress(message) + self.context.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_in += len(message)
+        self.bytes_out += len(compressed)
+        return compressed
+
+
+class StreamDecompressor:
+    """Decompresses the messages of a StreamCompressor, in the order they were compressed."""
+
+    def __init__(self):
+        self.context = None
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        """
+        Decompress a message if it is compressed.
+
+        Args:
+            data: Message as received
+            max_size: Largest message the receiver accepts once decompressed
+
+        Returns:
+            The original message
+
+        Raises:
+            ValueError: If the data is corrupt or decompresses to more than max_size bytes
+        """
+        if not data or data[0] != COMPRESSED:
+            return data
+        if self.context is None:
+            self.context = zlib.decompressobj()
+        try:
+            message = self.context.decompress(data[1:], max_size)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed message: {e}")
+        if self.context.unconsumed_tail:
+            raise ValueError(f"Compressed message exceeds the maximum size of {max_size} bytes")
+        return message
@@ -0,0 +1,46 @@
+import json
+from typing import Any, Optional
+
+
+def add_field(message: Optional[bytes], key: str, value: Any) -> Optional[bytes]:
+    """
+    Add a field to a JSON message without re-encoding it.
+
+    Responses can be large, so the field is spliced in after the opening
+    brace instead of decoding and encoding the whole message. Several error
+    paths answer with an array of messages; the field then goes into its
+    first message, which is where clients look for it.
+
+    Args:
+        message: JSON message bytes
+        key: Name of the field
+        value: JSON compatible value of the field
+
+    Returns:
+        The message with the field first, or None if it is neither a JSON
+        object nor an array starting with one
+    """
+    if not message:
+        return None
+    start = _skip_space(message, 0)
+    if message[start:start + 1] == b'[':
+        start = _skip_space(message, start + 1)
+    if message[start:start + 1] != b'{':
+        return None
+    rest = message[start + 1:]
+    separator = b', ' if rest.lstrip()[:1] != b'}' else b''
+    field = json.dumps(key).encode('utf-8') + b': ' + json.dumps(value).encode('utf-8')
+    return message[:start + 1] + field + separator + rest
+
+
+def first_message(decoded: Any) -> Any:
+    """The message that carries the fields of a decoded response: the response itself, or the first of an array"""
+    if isinstance(decoded, list) and decoded:
+        return decoded[0]
+    return decoded
+
+
+def _skip_space(data: bytes, position: int) -> int:
+    while position < len(data) and data[position:position + 1].isspace():
+        position += 1
+    return position
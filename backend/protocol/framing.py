@@ -0,0 +1,138 @@
+import socket
+import struct
+from typing import List, Optional
+
+# Every message is sent as a 4-byte big-endian length followed by that many bytes
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Prefix a message with its length.
+
+    Args:
+        payload: Message bytes
+
+    Returns:
+        The frame to send
+    """
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def is_framed(data: bytes) -> bool:
+    """
+    Tell a peer that frames its messages from an older one that sends bare JSON.
+
+    A frame header of a message within MAX_FRAME_SIZE starts with a byte of at
+    most MAX_FRAME_SIZE >> 24, while JSON starts with '{', '[' or whitespace.
+
+    Args:
+        data: First bytes received on a connection
+
+    Returns:
+        True if the connection carries frames
+    """
+    return bool(data) and data[0] <= MAX_FRAME_SIZE >> 24
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    """
+    Send one length-prefixed frame.
+
+    Args:
+        sock: Connected socket
+        payload: Frame contents
+    """
+    sock.sendall(encode_frame(payload))
+
+
+def recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    """
+    Read exactly size bytes.
+
+    Args:
+        sock: Connected socket
+        size: Number of bytes to read
+
+    Returns:
+        The bytes, or None if the connection closed first
+    """
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 65536))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """
+    Read one length-prefixed frame.
+
+    Args:
+        sock: Connected socket
+
+    Returns:
+        Frame contents, or None if the connection closed
+    """
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the maximum of {MAX_FRAME_SIZE}")
+    return recv_exactly(sock, size)
+
+
+class FrameDecoder:
+    """
+    Splits a byte stream into frames, whatever the sizes of the reads.
+
+    Bytes are fed in as they arrive; a read may hold part of a frame, or
+    several frames at once. Incomplete frames are kept until the rest arrives.
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        """
+        Initialize the decoder.
+
+        Args:
+            max_frame_size: Largest frame accepted
+        """
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Add received bytes.
+
+        Args:
+            data: Bytes read from the connection
+
+        Returns:
+            The frames completed by these bytes, in order
+
+        Raises:
+            ValueError: If a frame is larger than max_frame_size
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if size > self.max_frame_size:
+                raise ValueError(f"Frame of {size} bytes exceeds the maximum of {self.max_frame_size}")
+            end = offset + FRAME_HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[offset + FRAME_HEADER.size:end]))
+            offset = end
+        del self.buffer[:offset]
+        return frames
+
+    @property
+    def pending(self) -> int:
+        """Number of bytes of an incomplete frame held back."""
+        return len(self.buffer)
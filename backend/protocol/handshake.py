@@ -0,0 +1,200 @@
+import json
+from typing import List, Optional
+
+from backend.protocol import binary_codec
+from backend.protocol.compression import COMPRESSED, ZLIB, StreamCompressor, StreamDecompressor
+from backend.protocol.framing import MAX_FRAME_SIZE
+from backend.protocol.request_ids import request_id_of
+
+HELLO = "HELLO"
+# Raised whenever the meaning of messages changes; clients without a handshake count as version 0
+PROTOCOL_VERSION = 1
+MIN_PROTOCOL_VERSION = 0
+# Encodings and compressions the code supports, preferred first
+ENCODINGS = ["binary", "json"]
+COMPRESSIONS = [ZLIB]
+
+
+def hello_request(encodings: List[str], compressions: List[str] = (), max_frame_size: int = MAX_FRAME_SIZE,
+                  version: int = PROTOCOL_VERSION) -> bytes:
+    """
+    The first message a client sends on a new connection.
+
+    It is always JSON, so servers that know no handshake answer it with an
+    error, and the client goes on as before, in JSON.
+
+    Args:
+        encodings: Encodings the client speaks, preferred first
+        compressions: Compressions the client supports, preferred first
+        max_frame_size: Largest frame the client accepts
+        version: Protocol version of the client
+    """
+    return json.dumps({"type": HELLO, "payload": {
+        "version": version,
+        "encodings": list(encodings),
+        "compressions": list(compressions),
+        "max_frame_size": max_frame_size,
+    }}).encode('utf-8')
+
+
+def is_hello(data: bytes) -> bool:
+    """Check whether a request is a handshake; only requests that mention HELLO early on are decoded"""
+    if b'"HELLO"' not in data[:32] or binary_codec.is_binary(data):
+        return False
+    try:
+        request = json.loads(data.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+    return isinstance(request, dict) and request.get('type') == HELLO
+
+
+class Capabilities:
+    """
+    What a server offers in handshakes.
+
+    Configured per server, so a new encoding or compression can be switched
+    on for part of the cluster first; clients take whatever the server they
+    reach offers and fall back to JSON otherwise.
+    """
+
+    def __init__(self, encodings: Optional[List[str]] = None, compressions: Optional[List[str]] = None,
+                 max_frame_size: int = MAX_FRAME_SIZE):
+        """
+        Initialize the capabilities.
+
+        Args:
+            encodings: Encodings to offer, by default all in ENCODINGS; JSON is always accepted
+            compressions: Compressions to offer, by default all in COMPRESSIONS
+            max_frame_size: Largest frame the server accepts
+        """
+        self.encodings = [e for e in (ENCODINGS if encodings is None else encodings) if e in ENCODINGS]
+        if "json" not in self.encodings:
+            self.encodings.append("json")
+        self.compressions = [c for c in (COMPRESSIONS if compressions is None else compressions) if c in COMPRESSIONS]
+        self.max_frame_size = min(max_frame_size, MAX_FRAME_SIZE)
+
+
+class ConnectionOptions:
+    """
+    What a client connection agreed on in its handshake.
+
+    Requests are passed on to request handling as JSON whatever their
+    encoding, since replication, forwarding and sharding all work on JSON;
+    responses and pushed messages are re-encoded on the way out. Until a
+    client says hello it gets exactly what clients got before handshakes existed.
+
+    With compression agreed, large messages in either direction are
+    compressed on a stream that lasts as long as the connection. encode may
+    run on any thread, but compress has to run in the order messages are
+    written to the socket, and decode_request in the order requests are read.
+    """
+
+    def __init__(self, capabilities: Optional[Capabilities] = None):
+        self.capabilities = capabilities or Capabilities()
+        self.version = 0
+        self.encoding = "json"
+        self.compression = None
+        self.max_frame_size = self.capabilities.max_frame_size
+        self.compressor = None
+        self.decompressor = None
+        self.started = False  # Whether the connection's first request has been read
+
+    def take_hello(self, data: bytes) -> Optional[bytes]:
+        """
+        Answer the connection's hello, if its first request is one.
+
+        Called for every request of a framed connection, in the order they
+        are read and before decode_request. A hello later on is refused:
+        requests read after it may already have been decoded with the
+        options it would change.
+
+        Args:
+            data: Request as received
+
+        Returns:
+            The HELLO response, or None if the request is not a hello and is to be decoded
+
+        Raises:
+            ValueError: If a hello is not the first request of the connection
+        """
+        first, self.started = not self.started, True
+        if not is_hello(data):
+            return None
+        if not first:
+            raise ValueError("HELLO is only accepted as the first request of a connection")
+        return self.answer_hello(data)
+
+    def answer_hello(self, data: bytes) -> bytes:
+        """
+        Pick the options for the connection from a client's hello.
+
+        Each option is the client's most preferred one this server offers;
+        frames are limited to the smaller of the two maximum sizes.
+
+        Args:
+            data: The HELLO request
+
+        Returns:
+            The HELLO response, in JSON, naming the chosen options, or an error
+            if the client's version is no longer supported
+        """
+        try:
+            offer = json.loads(data.decode('utf-8')).get('payload') or {}
+            version = int(offer.get('version', 1))
+            encodings = list(offer.get('encodings') or [])
+            compressions = list(offer.get('compressions') or [])
+            max_frame_size = int(offer.get('max_frame_size') or MAX_FRAME_SIZE)
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError, TypeError, ValueError):
+            return json.dumps({"type": "E", "payload": "Malformed hello"}).encode('utf-8')
+        if version < MIN_PROTOCOL_VERSION:
+            return json.dumps({"type": "E", "payload": f"Protocol version {version} is no longer supported, "
+                                                       f"the oldest supported is {MIN_PROTOCOL_VERSION}"}).encode('utf-8')
+
+        self.version = min(version, PROTOCOL_VERSION)
+        self.encoding = next((e for e in encodings if e in self.capabilities.encodings), "json")
+        self.compression = next((c for c in compressions if c in self.capabilities.compressions), None)
+        self.max_frame_size = max(1024, min(max_frame_size, self.capabilities.max_frame_size))
+        if self.compression == ZLIB:
+            self.compressor = StreamCompressor()
+            self.decompressor = StreamDecompressor()
+        return json.dumps({"type": HELLO, "payload": {
+            "version": self.version,
+            "encoding": self.encoding,
+            "compression": self.compression,
+            "max_frame_size": self.max_frame_size,
+        }}).encode('utf-8')
+
+    def decode_request(self, data: bytes) -> bytes:
+        """
+        A request as JSON for request handling.
+
+        Raises:
+            ValueError: If the request is malformed, or compressed without compression agreed
+        """
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data, self.max_frame_size)
+        elif data[:1] == bytes([COMPRESSED]):
+            raise ValueError("Compressed request without compression agreed")
+        return binary_codec.to_json(data) if binary_codec.is_binary(data) else data
+
+    def compress(self, message: bytes) -> bytes:
+        """An encoded message as it goes on the wire, compressed if agreed and large enough"""
+        return self.compressor.compress(message) if self.compressor is not None else message
+
+    def encode(self, message: Optional[bytes]) -> bytes:
+        """
+        A response or pushed message, given as JSON, in the connection's encoding.
+
+        A message larger than the client accepts is replaced by an error, so
+        the client is told instead of dropping the connection.
+        """
+        encoded = binary_codec.from_json(message) if self.encoding == "binary" else message or b''
+        if len(encoded) <= self.max_frame_size:
+            return encoded
+        print(f"Message of {len(encoded)} bytes exceeds the client's maximum frame size of {self.max_frame_size}")
+        error = {"type": "E", "payload": f"Response of {len(encoded)} bytes exceeds the maximum frame size "
+                                         f"of {self.max_frame_size}"}
+        request_id = request_id_of(message)
+        if request_id is not None:
+            error = {"id": request_id, **error}
+        return binary_codec.encode(error) if self.encoding == "binary" else json.dumps(error).encode('utf-8')
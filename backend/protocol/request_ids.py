@@ -0,0 +1,45 @@
+import json
+from typing import Optional
+
+from backend.protocol.fields import add_field, first_message
+
+
+def request_id_of(data: bytes):
+    """
+    Get the id a client gave a request.
+
+    Clients that keep several requests in flight put an "id" in each one;
+    its response carries the same id and may overtake earlier responses.
+    A response that is an array of messages carries it in the first one.
+
+    Args:
+        data: Request or response bytes
+
+    Returns:
+        The id, or None for a request without one, which is answered in order
+    """
+    if b'"id"' not in data:
+        return None
+    try:
+        request = first_message(json.loads(data.decode('utf-8')))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return request.get('id') if isinstance(request, dict) else None
+
+
+def tag_response(response: Optional[bytes], request_id) -> bytes:
+    """
+    Add a request's id to its response.
+
+    Args:
+        response: Response bytes, a JSON object or array or, from older code paths, plain text
+        request_id: Id of the request
+
+    Returns:
+        The response with an "id" field
+    """
+    tagged = add_field(response, "id", request_id)
+    if tagged is None:
+        text = response.decode('utf-8', errors='replace') if response else "No response"
+        return json.dumps({"id": request_id, "type": "E", "payload": text}).encode('utf-8')
+    return tagged
@@ -0,0 +1,142 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+class ApplyScheduler:
+    """
+    Applies a run of replicated log entries on several threads.
+
+    Every entry names the keys it touches (a user, a conversation). An entry
+    waits for the earlier entries that share one of its keys and runs
+    alongside everything else; an entry without keys conflicts with all
+    entries around it. Entries are handed to on_applied strictly in log
+    order, as soon as every entry before them is done, so the log never
+    has a hole even though the state changes finish out of order.
+
+    When an entry fails, entries already running still finish, and may
+    have changed the state without being logged; they are applied again
+    when the failed entry is retried. Only entries whose apply_function is
+    safe to repeat may therefore be given keys.
+    """
+
+    def __init__(self, apply_function: Callable[[Dict], None],
+                 key_function: Callable[[Dict], Optional[List[str]]], max_workers: int = 4):
+        """
+        Initialize the scheduler.
+
+        Args:
+            apply_function: Applies one entry to the state machine
+            key_function: Returns the keys an entry touches, or None if it may touch anything
+            max_workers: Number of entries applied at the same time
+        """
+        self.apply_function = apply_function
+        self.key_function = key_function
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="apply")
+
+    def run(self, entries: List[Dict], on_applied: Callable[[Dict], None]) -> bool:
+        """
+        Apply entries and wait until they are done.
+
+        Args:
+            entries: Consecutive log entries in index order
+            on_applied: Called for each applied entry, in index order
+
+        Returns:
+            True if every entry was applied; after a failure no further entries
+            are started and on_applied stops at the failed entry, even for
+            later entries that were applied
+        """
+        if self.max_workers == 1 or len(entries) <= 1:
+            for entry in entries:
+                try:
+                    self.apply_function(entry)
+                except Exception as e:
+                    print(f"Error applying entry {entry.get('index')}: {e}")
+                    return False
+                on_applied(entry)
+            return True
+
+        dependencies = self._dependencies(entries)
+        dependents = [[] for _ in entries]
+        waiting_on = []
+        for position, depends_on in enumerate(dependencies):
+            waiting_on.append(len(depends_on))
+            for earlier in depends_on:
+                dependents[earlier].append(position)
+
+        state = {"done": [False] * len(entries), "next": 0, "running": 0, "failed": False}
+        condition = threading.Condition()
+
+        def start(position):
+            state["running"] += 1
+            self.executor.submit(work, position)
+
+        def work(position):
+            try:
+                self.apply_function(entries[position])
+                succeeded = True
+            except Exception as e:
+                print(f"Error applying entry {entries[position].get('index')}: {e}")
+                succeeded = False
+            with condition:
+                state["running"] -= 1
+                if not succeeded:
+                    state["failed"] = True
+                else:
+                    state["done"][position] = True
+                    # Hand over the entries that now follow without a gap
+                    while state["next"] < len(entries) and state["done"][state["next"]]:
+                        on_applied(entries[state["next"]])
+                        state["next"] += 1
+                    if not state["failed"]:
+                        for later in dependents[position]:
+                            waiting_on[later] -= 1
+                            if waiting_on[later] == 0:
+                                start(later)
+                condition.notify_all()
+
+        with condition:
+            for position in range(len(entries)):
+                if waiting_on[position] == 0:
+                    start(position)
+            while state["running"] > 0:
+                condition.wait()
+            return state["next"] == len(entries)
+
+    def _dependencies(self, entries: List[Dict]) -> List[List[int]]:
+        """
+        Work out which earlier entries each entry has to wait for.
+
+        Args:
+            entries: Entries in index order
+
+        Returns:
+            For each entry, the positions of the entries it waits for
+        """
+        dependencies = []
+        last_for_key = {}
+        barrier = None  # Last entry without keys, everything after it waits for it
+        since_barrier = []
+        for position, entry in enumerate(entries):
+            keys = self.key_function(entry)
+            if keys is None:
+                depends_on = list(since_barrier) if since_barrier else ([barrier] if barrier is not None else [])
+                barrier = position
+                since_barrier = []
+                last_for_key = {}
+            else:
+                depends_on = {last_for_key[key] for key in keys if key in last_for_key}
+                if barrier is not None:
+                    depends_on.add(barrier)
+                depends_on = sorted(depends_on)
+                for key in keys:
+                    last_for_key[key] = position
+                since_barrier.append(position)
+            dependencies.append(depends_on)
+        return dependencies
+
+    def stop(self):
+        """Stop the worker threads."""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from backend.protocol.framing import FRAME_HEADER, MAX_FRAME_SIZE
+
+
+class AsyncReplicationEngine:
+    """
+    Runs the replication side of a ReplicationManager on one asyncio event loop.
+
+    The listener, heartbeat timer, election timer and all peer connections
+    share a single loop thread instead of a thread per inbound connection.
+    Quick protocol messages (heartbeats, votes) are handled directly on the
+    loop; anything that touches storage (REPLICATE, forwarded client
+    requests, catch-up streams) runs on a small fixed pool of worker threads.
+    """
+
+    def __init__(self, manager, max_workers: int = 4):
+        """
+        Initialize the engine.
+
+        Args:
+            manager: ReplicationManager whose protocol handlers the engine drives
+            max_workers: Number of worker threads for storage-bound messages
+        """
+        self.manager = manager
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.timer_tasks = []
+        self.heartbeat_wakeup = None  # asyncio.Event, created on the loop
+        self.election_wakeup = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix=f"replication-{manager.server_id}")
+        self.started = threading.Event()
+        self.start_error = None
+
+    def start(self):
+        """Start the event loop thread and the replication listener."""
+        self.thread = threading.Thread(target=self._run, name=f"replication-loop-{self.manager.server_id}")
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait()
+        if self.start_error:
+            raise self.start_error
+        print(f"Started asyncio replication listener on {self.manager.local_address}")
+
+    def start_timers(self):
+        """Start the heartbeat and election timers on the loop."""
+        future = asyncio.run_coroutine_threadsafe(self._start_timers(), self.loop)
+        future.result()
+
+    def wake_heartbeat(self):
+        """Send the next heartbeat right away. Safe to call from any thread."""
+        if self.loop and self.heartbeat_wakeup:
+            self.loop.call_soon_threadsafe(self.heartbeat_wakeup.set)
+
+    def wake_election(self):
+        """Check the election timeout right away. Safe to call from any thread."""
+        if self.loop and self.election_wakeup:
+            self.loop.call_soon_threadsafe(self.election_wakeup.set)
+
+    def stop(self):
+        """Stop the listener, timers and event loop."""
+        if self.loop and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        self.executor.shutdown(wait=False)
+
+    def _run(self):
+        """Event loop thread body."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        host, port = self.manager.local_address
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, host, port, reuse_address=True, backlog=100)
+            )
+        except Exception as e:
+            print(f"Error starting asyncio replication listener: {e}")
+            self.start_error = e
+            self.started.set()
+            return
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _start_timers(self):
+        self.heartbeat_wakeup = asyncio.Event()
+        self.election_wakeup = asyncio.Event()
+        self.timer_tasks = [
+            asyncio.ensure_future(self._heartbeat_timer()),
+            asyncio.ensure_future(self._election_timer())
+        ]
+
+    async def _shutdown(self):
+        for task in self.timer_tasks:
+            task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.loop.stop()
+
+    def _peers(self):
+        """Replication addresses of every other server."""
+        return [replica for replica in self.manager.replica_addresses
+                if replica != self.manager.local_address]
+
+    async def _read_message(self, reader: asyncio.StreamReader, timeout: float = 5) -> bytes:
+        """
+        Read one complete JSON message from a stream.
+
+        Args:
+            reader: Stream to read from
+            timeout: Seconds to wait for each chunk
+
+        Returns:
+            Raw message bytes, or empty bytes if the stream closed first
+        """
+        data = b''
+        while True:
+            chunk = await asyncio.wait_for(reader.read(65536), timeout)
+            if not chunk:
+                return data
+            data += chunk
+            try:
+                json.loads(data.decode('utf-8'))
+                return data
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle one inbound peer connection."""
+        try:
+            data = await self._read_message(reader)
+            if not data:
+                return
+            message = json.loads(data.decode('utf-8'))
+            message_type = message.get("type", "")
+
+            if message_type == "CATCH_UP":
+                await self._stream_catch_up(message, writer)
+                return
+
+            if message_type == "REPLICATE_STREAM":
+                await self._serve_replication_stream(message, reader, writer)
+                return
+
+            if message_type == "FORWARD_STREAM":
+                await self._serve_forward_stream(message, reader, writer)
+                return
+
+            if message_type in ["HEARTBEAT", "PRE_VOTE", "REQUEST_VOTE", "VOTE_RESPONSE", "TIMEOUT_NOW",
+                                "REPLICATION_STATS"]:
+                # Only touch in-memory state under short locks, safe to run on the loop
+                response = self.manager._dispatch_replication_message(message, data)
+            else:
+                response = await self.loop.run_in_executor(
+                    self.executor, self.manager._dispatch_replication_message, message, data
+                )
+
+            if response:
+                writer.write(response)
+                await writer.drain()
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from replication connection: {e}")
+        except Exception as e:
+            print(f"Error handling replication connection: {e}")
+        finally:
+            writer.close()
+
+    async def _stream_catch_up(self, message: dict, writer: asyncio.StreamWriter):
+        """Stream a catch-up response, producing each message on a worker thread."""
+        stream = self.manager._catch_up_messages(message)
+        while True:
+            reply = await self.loop.run_in_executor(self.executor, next, stream, None)
+            if reply is None:
+                break
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def _serve_replication_stream(self, message: dict, reader: asyncio.StreamReader,
+                                        writer: asyncio.StreamWriter):
+        """Apply batches from a replication stream, decoding and applying each on a worker thread."""
+        codec, response = self.manager._accept_replication_stream(message)
+        writer.write(response)
+        await writer.drain()
+        while self.manager.running:
+            payload = await self._read_frame(reader)
+            if payload is None:
+                break
+            ack = await self.loop.run_in_executor(self.executor, self.manager._apply_replication_batch, codec, payload)
+            writer.write(FRAME_HEADER.pack(len(ack)) + ack)
+            await writer.drain()
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """Read one length-prefixed frame, or None if the stream closed."""
+        try:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            (size,) = FRAME_HEADER.unpack(header)
+            if size > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {size} bytes exceeds the maximum of {MAX_FRAME_SIZE}")
+            return await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def _serve_forward_stream(self, message: dict, reader: asyncio.StreamReader,
+                                    writer: asyncio.StreamWriter):
+        """
+        Execute requests from a backup's forwarding stream on worker threads, answering each when it is done.
+
+        Like the threaded version, the stream is not read further while
+        MAX_FORWARD_IN_FLIGHT of its requests are running or waiting.
+        """
+        response = self.manager._accept_forward_stream(message)
+        writer.write(FRAME_HEADER.pack(len(response)) + response)
+        await writer.drain()
+        in_flight = set()
+
+        async def run(frame: bytes):
+            answer = await self.loop.run_in_executor(self.executor, self.manager._handle_forwarded_request, frame)
+            writer.write(FRAME_HEADER.pack(len(answer)) + answer)
+            await writer.drain()
+
+        while self.manager.running:
+            if len(in_flight) >= self.manager.MAX_FORWARD_IN_FLIGHT:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            frame = await self._read_frame(reader)
+            if frame is None:
+                break
+            task = self.loop.create_task(run(frame))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def _send(self, address: Tuple[str, int], message: dict, expect_response: bool = False,
+                    timeout: float = 1) -> Optional[dict]:
+        """
+        Send a message to a peer over a short-lived connection.
+
+        Args:
+            address: Peer replication address
+            message: Message to send
+            expect_response: Whether to wait for a JSON reply
+            timeout: Seconds to wait for connecting and for the reply
+
+        Returns:
+            The decoded reply, or None
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+        try:
+            writer.write(json.dumps(message).encode('utf-8'))
+            await writer.drain()
+            if expect_response:
+                data = await self._read_message(reader, timeout)
+                if data:
+                    return json.loads(data.decode('utf-8'))
+            return None
+        finally:
+            writer.close()
+
+    async def _heartbeat_timer(self):
+        """Send heartbeats to all peers while this server is the primary."""
+        while self.manager.running:
+            # Heartbeats are queued on the peers' replication streams, this only decides who needs one
+            self.manager._heartbeat_tick()
+            await self._wait(self.heartbeat_wakeup, self.manager.heartbeat_interval)
+
+    async def _election_timer(self):
+        """Start an election when the primary stops sending heartbeats."""
+        while self.manager.running:
+            timeout = self.manager._random_election_timeout()
+            await self._wait(self.election_wakeup, min(timeout, self.manager.heartbeat_interval))
+            if self.manager._check_election_timeout(timeout):
+                await self._run_election()
+
+    async def _wait(self, event: asyncio.Event, timeout: float):
+        """Sleep until the timeout expires or the event is set, then clear the event."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _run_election(self):
+        """Run a pre-vote round, then request votes from all peers concurrently."""
+        pre_vote_request = self.manager._prepare_pre_vote()
+        if pre_vote_request is None:
+            return
+        peers = self._peers()
+        vote_timeout = self.manager.election_timeout_min / 2
+        results = await asyncio.gather(*(self._send(peer, pre_vote_request, expect_response=True,
+                                                    timeout=vote_timeout) for peer in peers),
+                                       return_exceptions=True)
+        responses = [result for result in results if isinstance(result, dict)]
+        if not self.manager._pre_vote_succeeded(responses):
+            return
+
+        vote_request = self.manager._prepare_election()
+        if vote_request is None:
+            return
+        results = await asyncio.gather(*(self._send(peer, vote_request, expect_response=True,
+                                                    timeout=vote_timeout) for peer in peers),
+                                       return_exceptions=True)
+        for peer, result in zip(peers, results):
+            if isinstance(result, Exception):
+                print(f"Error requesting vote from {peer}: {result}")
+            elif result:
+                print(f"Received vote response from {peer}: {result}")
+                self.manager._handle_vote_response(result)
@@ -0,0 +1,267 @@
+import json
+import itertools
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend.protocol.framing import send_frame, recv_frame
+
+
+# Every frame on a forwarding stream starts with the ID of the request it belongs to
+REQUEST_ID = struct.Struct("!Q")
+
+
+class ForwardingStreamUnsupported(Exception):
+    """The primary closed the connection instead of accepting a forwarding stream."""
+
+
+class ForwardingConnection:
+    """
+    One persistent FORWARD_STREAM connection from a backup to the primary.
+
+    Requests are written as length-prefixed frames tagged with a request ID,
+    so any number of them can be in flight at once. The primary executes them
+    concurrently and answers in whatever order they finish; a reader thread
+    hands each response to the request waiting for its ID.
+    """
+
+    def __init__(self, address: Tuple[str, int], server_id: str):
+        """
+        Initialize the connection.
+
+        Args:
+            address: Replication address of the primary
+            server_id: ID of this server, for the primary's log
+        """
+        self.address = tuple(address)
+        self.server_id = server_id
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Dict] = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.closed = False
+
+    def open(self, timeout: float):
+        """
+        Connect and open the forwarding stream.
+
+        Args:
+            timeout: Seconds to wait for connecting and for the primary's answer
+
+        Raises:
+            ForwardingStreamUnsupported: If the primary does not know FORWARD_STREAM
+        """
+        sock = socket.create_connection(self.address, timeout=timeout)
+        try:
+            hello = {"type": "FORWARD_STREAM", "server_id": self.server_id}
+            sock.sendall(json.dumps(hello).encode('utf-8'))
+            response = recv_frame(sock)
+        except Exception:
+            sock.close()
+            raise
+        if response is None:
+            sock.close()
+            raise ForwardingStreamUnsupported(f"{self.address} does not accept forwarding streams")
+
+        sock.settimeout(None)  # Idle connections stay open, requests time out on their own
+        self.sock = sock
+        reader = threading.Thread(target=self._read_responses,
+                                  name=f"forward-reader-{self.address[0]}:{self.address[1]}")
+        reader.daemon = True
+        reader.start()
+        print(f"Opened forwarding stream to primary at {self.address}")
+
+    def in_flight(self) -> int:
+        """Return the number of requests waiting for a response."""
+        with self.pending_lock:
+            return len(self.pending)
+
+    def request(self, data: bytes, timeout: float) -> bytes:
+        """
+        Forward one client request and wait for its response.
+
+        Args:
+            data: Client request bytes
+            timeout: Seconds to wait for the response
+
+        Returns:
+            The primary's response, complete regardless of size
+        """
+        request_id = next(self.request_ids)
+        slot = {"event": threading.Event(), "response": None}
+        with self.pending_lock:
+            if self.closed:
+                raise ConnectionError("forwarding stream closed")
+            self.pending[request_id] = slot
+        try:
+            try:
+                with self.send_lock:
+                    send_frame(self.sock, REQUEST_ID.pack(request_id) + data)
+            except Exception:
+                self.close()
+                raise
+            # A slow request only gives up itself, the others on the connection keep waiting
+            if not slot["event"].wait(timeout):
+                raise TimeoutError(f"no response from primary within {timeout}s")
+            if slot["response"] is None:
+                raise ConnectionError("forwarding stream closed before the response arrived")
+            return slot["response"]
+        finally:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+
+    def close(self):
+        """Close the connection and fail every request still waiting on it."""
+        with self.pending_lock:
+            if self.closed:
+                return
+            self.closed = True
+            slots = list(self.pending.values())
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+        for slot in slots:
+            slot["event"].set()
+
+    def _read_responses(self):
+        """Reader thread body: match responses to waiting requests until the stream ends."""
+        try:
+            while True:
+                frame = recv_frame(self.sock)
+                if frame is None:
+                    break
+                (request_id,) = REQUEST_ID.unpack_from(frame)
+                with self.pending_lock:
+                    slot = self.pending.get(request_id)
+                if slot is not None:
+                    slot["response"] = frame[REQUEST_ID.size:]
+                    slot["event"].set()
+        except Exception as e:
+            if not self.closed:
+                print(f"Error reading from forwarding stream to {self.address}: {e}")
+        finally:
+            self.close()
+
+
+class ForwardingProxy:
+    """
+    Forwards client requests from a backup to the primary over pooled connections.
+
+    Connections are opened lazily up to pool_size and reused across requests;
+    each carries many requests at once, and a new request goes to the least
+    busy one. When the primary changes, the old pool is closed. A primary that
+    does not support forwarding streams is sent one request per connection,
+    reading the response until the primary closes it.
+    """
+
+    # Seconds before a primary without stream support is asked again
+    LEGACY_RETRY_INTERVAL = 30
+
+    def __init__(self, server_id: str, pool_size: int = 2, timeout: float = 5):
+        """
+        Initialize the proxy.
+
+        Args:
+            server_id: ID of this server
+            pool_size: Most connections kept open to the primary
+            timeout: Seconds to wait for connecting and for each response
+        """
+        self.server_id = server_id
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.address: Optional[Tuple[str, int]] = None
+        self.connections: List[ForwardingConnection] = []
+        self.lock = threading.Lock()
+        self.legacy_until = 0
+
+    def forward(self, address: Tuple[str, int], data: bytes) -> bytes:
+        """
+        Forward a client request to the primary.
+
+        Args:
+            address: Replication address of the primary
+            data: Client request bytes
+
+        Returns:
+            The primary's response
+
+        Raises:
+            Exception: If the primary could not be reached or did not answer in time
+        """
+        address = tuple(address)
+        if time.time() < self.legacy_until:
+            return self._forward_once(address, data)
+        try:
+            connection = self._connection(address)
+        except ForwardingStreamUnsupported as e:
+            print(f"ForwardingProxy: {e}, forwarding one request per connection")
+            self.legacy_until = time.time() + self.LEGACY_RETRY_INTERVAL
+            return self._forward_once(address, data)
+        return connection.request(data, self.timeout)
+
+    def close(self):
+        """Close all pooled connections."""
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+            self.address = None
+        for connection in connections:
+            connection.close()
+
+    def _connection(self, address: Tuple[str, int]) -> ForwardingConnection:
+        """
+        Pick a pooled connection to the primary, opening one if needed.
+
+        Args:
+            address: Replication address of the primary
+
+        Returns:
+            An open connection
+        """
+        with self.lock:
+            if address != self.address:
+                # New primary, connections to the old one are of no use
+                for connection in self.connections:
+                    connection.close()
+                self.connections = []
+                self.address = address
+            self.connections = [connection for connection in self.connections if not connection.closed]
+
+            idle = [connection for connection in self.connections if connection.in_flight() == 0]
+            if idle or len(self.connections) >= self.pool_size:
+                return min(self.connections, key=lambda connection: connection.in_flight())
+
+            connection = ForwardingConnection(address, self.server_id)
+            connection.open(self.timeout)
+            self.connections.append(connection)
+            return connection
+
+    def _forward_once(self, address: Tuple[str, int], data: bytes) -> bytes:
+        """
+        Forward a request over a connection of its own.
+
+        Args:
+            address: Replication address of the primary
+            data: Client request bytes
+
+        Returns:
+            Everything the primary sent before closing the connection
+        """
+        with socket.create_connection(address, timeout=self.timeout) as sock:
+            sock.sendall(data)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks)
@@ -0,0 +1,210 @@
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class ClusterMembership:
+    """
+    Registry of the servers in the replication cluster.
+
+    Maps server IDs to replication addresses. Servers learn each other's IDs
+    when they exchange JOIN messages; seed addresses given on the command line
+    whose owner has not answered yet are kept as pending and still count as
+    voters, so a server cannot win an election just because its peers are
+    slow to start.
+
+    Membership changes made at runtime go through a joint configuration: while
+    old_members is set, a decision needs a majority of the old members and a
+    majority of the new members.
+    """
+
+    def __init__(self, server_id: str, local_address: Tuple[str, int], seed_addresses: List[Tuple[str, int]]):
+        """
+        Initialize the registry.
+
+        Args:
+            server_id: ID of this server
+            local_address: Replication address of this server
+            seed_addresses: Replication addresses of the other servers, IDs unknown
+        """
+        self.server_id = server_id
+        self.local_address = tuple(local_address)
+        self.lock = threading.Lock()
+
+        self.members: Dict[str, Tuple[str, int]] = {server_id: self.local_address}
+        self.old_members: Optional[Dict[str, Tuple[str, int]]] = None
+        self.pending_seeds: List[Tuple[str, int]] = []
+        # Until a configuration is applied, the members are whoever answered of the seeds
+        self.bootstrapping = True
+        for address in seed_addresses:
+            address = tuple(address)
+            if address != self.local_address and address not in self.pending_seeds:
+                self.pending_seeds.append(address)
+
+    @staticmethod
+    def _decode_members(members: Optional[Dict]) -> Optional[Dict[str, Tuple[str, int]]]:
+        """Turn JSON [host, port] lists back into address tuples."""
+        if members is None:
+            return None
+        return {server_id: (address[0], int(address[1])) for server_id, address in members.items()}
+
+    def addresses(self) -> List[Tuple[str, int]]:
+        """Return the addresses of all known servers, including this one."""
+        with self.lock:
+            result = list(self.members.values())
+            for address in list((self.old_members or {}).values()) + self.pending_seeds:
+                if address not in result:
+                    result.append(address)
+            return result
+
+    def peer_addresses(self) -> List[Tuple[str, int]]:
+        """Return the addresses of all known servers except this one."""
+        return [address for address in self.addresses() if address != self.local_address]
+
+    def address_of(self, server_id: str) -> Optional[Tuple[str, int]]:
+        """
+        Look up the replication address of a server.
+
+        Args:
+            server_id: Server ID
+
+        Returns:
+            (host, port) tuple, or None if the server is unknown
+        """
+        with self.lock:
+            if server_id in self.members:
+                return self.members[server_id]
+            return (self.old_members or {}).get(server_id)
+
+    def server_id_of(self, address: Tuple[str, int]) -> Optional[str]:
+        """
+        Look up the server ID registered for an address.
+
+        Args:
+            address: (host, port) tuple
+
+        Returns:
+            Server ID, or None if nobody registered that address yet
+        """
+        address = tuple(address)
+        with self.lock:
+            for members in [self.members, self.old_members or {}]:
+                for server_id, member_address in members.items():
+                    if member_address == address:
+                        return server_id
+        return None
+
+    def is_member(self, server_id: str) -> bool:
+        """Check whether a server belongs to the current (new) configuration."""
+        with self.lock:
+            return server_id in self.members
+
+    def is_changing(self) -> bool:
+        """Check whether a joint configuration is in effect."""
+        with self.lock:
+            return self.old_members is not None
+
+    def register(self, server_id: str, address: Tuple[str, int]):
+        """
+        Record the ID of a server that answered at its address.
+
+        Used while the cluster is being formed, before there is a primary to
+        commit a configuration.
+
+        Args:
+            server_id: Server ID
+            address: Replication address of that server
+        """
+        address = tuple(address)
+        with self.lock:
+            if address in self.pending_seeds:
+                self.pending_seeds.remove(address)
+            if self.members.get(server_id) != address:
+                print(f"Registered member {server_id} at {address}")
+                self.members[server_id] = address
+
+    def remove(self, server_id: str) -> bool:
+        """
+        Drop a server from this server's view without a configuration change.
+
+        Args:
+            server_id: Server ID
+
+        Returns:
+            True if the server was known
+        """
+        with self.lock:
+            removed = self.members.pop(server_id, None)
+            if self.old_members is not None:
+                removed = self.old_members.pop(server_id, None) or removed
+            return removed is not None
+
+    def has_quorum(self, voters: Set[str]) -> bool:
+        """
+        Check whether a set of servers forms a majority.
+
+        Args:
+            voters: IDs of the servers that agreed, including this one if it did
+
+        Returns:
+            True if the voters are a majority of the configuration, and of both
+            configurations while a change is in progress; pending seeds only
+            count towards the configuration the cluster bootstraps with
+        """
+        with self.lock:
+            configurations = [(self.members, len(self.pending_seeds) if self.bootstrapping else 0)]
+            if self.old_members is not None:
+                configurations.append((self.old_members, 0))
+            for members, pending in configurations:
+                total = len(members) + pending
+                agreed = len(voters & set(members))
+                if agreed <= total / 2:
+                    return False
+            return True
+
+    def to_config(self) -> Dict:
+        """Return the configuration in the JSON form used in log entries and snapshots."""
+        with self.lock:
+            return {
+                "members": {server_id: list(address) for server_id, address in self.members.items()},
+                "old_members": ({server_id: list(address) for server_id, address in self.old_members.items()}
+                                if self.old_members is not None else None)
+            }
+
+    def joint_config(self, new_members: Dict[str, Tuple[str, int]]) -> Dict:
+        """
+        Build the joint configuration for moving from the current members to new ones.
+
+        Args:
+            new_members: Complete new member map
+
+        Returns:
+            Configuration with both the old and the new members
+        """
+        with self.lock:
+            return {
+                "members": {server_id: list(address) for server_id, address in new_members.items()},
+                "old_members": {server_id: list(address) for server_id, address in self.members.items()}
+            }
+
+    def current_members(self) -> Dict[str, Tuple[str, int]]:
+        """Return a copy of the current (new) member map."""
+        with self.lock:
+            return dict(self.members)
+
+    def apply_config(self, config: Dict):
+        """
+        Switch to a configuration taken from the log, a snapshot or the primary.
+
+        Args:
+            config: Configuration as produced by to_config or joint_config
+        """
+        members = self._decode_members(config.get("members")) or {}
+        old_members = self._decode_members(config.get("old_members"))
+        with self.lock:
+            self.members = members
+            self.old_members = old_members
+            # A configuration from the primary is authoritative, unanswered seeds are not members
+            self.pending_seeds = []
+            self.bootstrapping = False
+            print(f"Applied cluster configuration: members={sorted(members)}"
+                  + (f", joint with {sorted(old_members)}" if old_members is not None else ""))
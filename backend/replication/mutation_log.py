@@ -0,0 +1,186 @@
+import base64
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from backend.interfaces.db_interface import MongoDBInterface
+
+
+def encode_value(value):
+    """
+    Turn a stored value into plain JSON the same way FileOperation writes it to disk.
+
+    Args:
+        value: Document, query or field value
+
+    Returns:
+        JSON-serializable value; bytes are tagged so they can be restored
+    """
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return {"__type__": "bytes", "data": base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def decode_value(value):
+    """
+    Restore a value encoded by encode_value.
+
+    Args:
+        value: Value from a mutation entry
+
+    Returns:
+        The value as it was handed to storage, with bytes restored
+    """
+    if isinstance(value, dict):
+        if value.get("__type__") == "bytes":
+            return base64.b64decode(value.get("data", ""))
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def build_mutation_operation(mutations: List[Dict]) -> str:
+    """
+    Build the log entry operation for the storage writes of one client request.
+
+    Args:
+        mutations: Writes recorded by RecordingStorage
+
+    Returns:
+        Operation to store in the replication log
+    """
+    return json.dumps({"type": "MUTATIONS", "mutations": mutations})
+
+
+def mutations_from_operation(operation_data: str) -> Optional[List[Dict]]:
+    """
+    Decode a mutation entry.
+
+    Args:
+        operation_data: Operation stored in a log entry
+
+    Returns:
+        The recorded writes, or None if the entry holds something else
+    """
+    if '"MUTATIONS"' not in operation_data:
+        return None
+    try:
+        operation = json.loads(operation_data)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(operation, dict) or operation.get("type") != "MUTATIONS":
+        return None
+    return operation.get("mutations", [])
+
+
+def apply_mutations(storage: MongoDBInterface, mutations: List[Dict]):
+    """
+    Apply recorded writes to storage, without running any business logic.
+
+    Applying the same writes again leaves storage unchanged: inserts of a
+    document whose _id is already stored are skipped, and updates and
+    deletes end up the same either way. An entry can be applied twice when
+    it was applied in parallel with an earlier one that failed, and is
+    applied again once that earlier one is retried.
+
+    Args:
+        storage: Storage backend of this replica
+        mutations: Writes recorded on the primary, in the order it made them
+    """
+    for mutation in mutations:
+        operation = mutation.get("op")
+        collection = mutation.get("collection")
+        if operation == "insert":
+            document = decode_value(mutation["document"])
+            if "_id" in document and storage.read(collection, {"_id": document["_id"]}):
+                print(f"Skipping insert of {document['_id']} into {collection}, already applied")
+                continue
+            storage.insert(collection, document)
+        elif operation == "update":
+            storage.update(collection, decode_value(mutation["query"]), decode_value(mutation["values"]))
+        elif operation == "delete":
+            storage.delete(collection, decode_value(mutation["query"]))
+        else:
+            print(f"Skipping unknown mutation {operation} on {collection}")
+
+
+class RecordingStorage(MongoDBInterface):
+    """
+    Storage wrapper that records the writes a client request makes.
+
+    The primary runs each write request inside record_mutations() and logs
+    the writes it made, fully resolved: the hashed password, the assigned
+    timestamp and _id are all in the recorded documents. Backups replay them
+    with apply_mutations instead of running the request again, so they skip
+    bcrypt and the rest of the controller and end up with the same data.
+    Recording is per thread, so concurrent requests each get their own list.
+    """
+
+    def __init__(self, storage: MongoDBInterface):
+        """
+        Initialize the wrapper.
+
+        Args:
+            storage: Storage backend that actually holds the data
+        """
+        self.storage = storage
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        # Snapshots, data_dir and anything else not about individual writes
+        return getattr(self.storage, name)
+
+    @contextmanager
+    def record_mutations(self):
+        """
+        Record the writes made on this thread while the block runs.
+
+        Yields:
+            List that receives one entry per insert, update or delete
+        """
+        mutations = []
+        self.local.mutations = mutations
+        try:
+            yield mutations
+        finally:
+            self.local.mutations = None
+
+    def _record(self, mutation: Dict):
+        mutations = getattr(self.local, "mutations", None)
+        if mutations is not None:
+            mutations.append(mutation)
+
+    def insert(self, collection_name, document):
+        result = self.storage.insert(collection_name, document)
+        if result:
+            # Recorded after the insert so the assigned _id is included
+            self._record({"op": "insert", "collection": collection_name, "document": encode_value(document)})
+        return result
+
+    def read(self, collection_name, query=None):
+        return self.storage.read(collection_name, query)
+
+    def read_pass(self):
+        return self.storage.read_pass()
+
+    def update(self, collection_name, query, update_values):
+        result = self.storage.update(collection_name, query, update_values)
+        if result:
+            self._record({"op": "update", "collection": collection_name,
+                          "query": encode_value(query), "values": encode_value(update_values)})
+        return result
+
+    def delete(self, collection_name, query):
+        result = self.storage.delete(collection_name, query)
+        if result:
+            self._record({"op": "delete", "collection": collection_name, "query": encode_value(query)})
+        return result
@@ -0,0 +1,247 @@
+import json
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+from backend.protocol.framing import send_frame, recv_frame
+from backend.replication.stream_codec import ReplicationStreamCodec
+
+
+class PeerReplicator:
+    """
+    Ships log entries from the primary to one backup over a persistent stream.
+
+    Entries are queued by the request path and sent by this replicator's own
+    thread, so a slow or unreachable backup never holds up client requests.
+    Whatever queued up while the previous batch was in flight goes out as the
+    next batch. Every batch carries the primary's term, commit index and read
+    lease, and a heartbeat is simply an empty batch. The compression method
+    is negotiated when the stream is opened; a backup that does not know
+    REPLICATE_STREAM gets one REPLICATE message per entry and standalone
+    heartbeats instead.
+    """
+
+    # Most entries sent in a single batch
+    MAX_BATCH_ENTRIES = 100
+    # Seconds before a backup without stream support is asked again
+    LEGACY_RETRY_INTERVAL = 30
+    # Seconds over which the send rate is averaged
+    RATE_WINDOW = 10
+
+    def __init__(self, manager, address: Tuple[str, int], compression_methods: List[str]):
+        """
+        Initialize the replicator.
+
+        Args:
+            manager: ReplicationManager of the primary
+            address: Replication address of the backup
+            compression_methods: Methods to offer, most preferred first
+        """
+        self.manager = manager
+        self.address = tuple(address)
+        self.compression_methods = compression_methods
+        self.queue = queue.Queue()
+        self.running = False
+        self.thread = None
+
+        self.sock = None
+        self.codec = None
+        self.legacy_until = 0
+
+        # Totals for the log output: bytes before and after compression
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+
+        # When this backup last heard from us, and how far its log is known to be
+        self.last_sent_at = 0
+        self.last_shipped_index = manager.replication_log.last_index
+        self.match_index = 0
+
+        # Health: when the backup last acknowledged, and last had everything shipped to it
+        self.last_ack_at = 0
+        self.caught_up_at = time.time()
+        self.errors = 0
+        self.last_error = None
+        self.sent_history = deque()  # (time, bytes) of batches sent within RATE_WINDOW
+
+    def start(self):
+        """Start the sender thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"replicator-{self.address[0]}:{self.address[1]}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the sender thread and close the stream."""
+        self.running = False
+        self._close()
+
+    def enqueue(self, entry: Dict):
+        """
+        Queue a log entry for this backup.
+
+        Args:
+            entry: Log entry with index, term and operation
+        """
+        self.queue.put(entry)
+
+    def send_heartbeat(self):
+        """Ask for a heartbeat; it is dropped if entries are waiting, since they carry the same information."""
+        self.queue.put(None)
+
+    def _run(self):
+        """Sender thread body."""
+        while self.running:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            items = [item]
+            while len(items) < self.MAX_BATCH_ENTRIES:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._ship([entry for entry in items if entry is not None])
+
+    def _ship(self, batch: List[Dict]):
+        """
+        Send a batch, or a heartbeat if it is empty, and wait for the backup's acknowledgment.
+
+        A batch that cannot be delivered is dropped; the backup notices the
+        gap from the primary's heartbeats and catches up from the log.
+
+        Args:
+            batch: Log entries in index order
+        """
+        leader_state = self.manager._leader_state()
+        if leader_state is None:
+            # No longer the primary, the new one replicates from here on
+            return
+        term = leader_state.pop("term")
+        try:
+            if time.time() < self.legacy_until or not self._ensure_stream():
+                for entry in batch:
+                    self.manager._send_replicate(self.address, entry)
+                if not batch:
+                    self.manager._send_heartbeat(self.address, self.manager._build_heartbeat())
+                self.last_sent_at = time.time()
+                return
+
+            if batch:
+                self.last_shipped_index = batch[-1]["index"]
+                # Lets the backup check that its log matches ours up to the batch
+                leader_state["prev_log_term"] = self.manager.replication_log.term_at(batch[0]["index"] - 1)
+            leader_state["last_log_index"] = self.last_shipped_index
+            payload, raw_size = self.codec.encode_batch(term, self.manager.server_id, batch, leader_state)
+            sent_at = time.time()
+            send_frame(self.sock, payload)
+            ack_data = recv_frame(self.sock)
+            if ack_data is None:
+                raise ConnectionError("replication stream closed by backup")
+            ack = json.loads(ack_data.decode('utf-8'))
+            self.last_sent_at = self.last_ack_at = time.time()
+            # A backup whose log diverged from ours does not hold our entries, however long its log is
+            ack_index = ack.get("last_log_index", self.match_index)
+            if "last_log_term" not in ack or self.manager.replication_log.term_at(ack_index) == ack["last_log_term"]:
+                self.match_index = ack_index
+            if self.match_index >= self.last_shipped_index:
+                self.caught_up_at = sent_at
+            self.manager._update_commit_index()
+
+            self.bytes_raw += raw_size
+            self.bytes_sent += len(payload)
+            self.sent_history.append((sent_at, len(payload)))
+            while self.sent_history and self.sent_history[0][0] < sent_at - self.RATE_WINDOW:
+                self.sent_history.popleft()
+            if batch:
+                print(f"Replicated entries {batch[0]['index']}-{batch[-1]['index']} to {self.address}: "
+                      f"{raw_size} -> {len(payload)} bytes ({self.codec.method}), success={ack.get('success')}")
+        except Exception as e:
+            print(f"Error replicating to {self.address}: {e}")
+            self.errors += 1
+            self.last_error = f"{time.strftime('%H:%M:%S')} {e}"
+            self._close()
+
+    def stats(self, last_index: int) -> Dict:
+        """
+        Report how well this backup is keeping up.
+
+        A backup without replication streams does not acknowledge, so its
+        progress fields are None.
+
+        Args:
+            last_index: Last index in the primary's log
+
+        Returns:
+            Acknowledged index, lag in entries and seconds, queue depth,
+            send rate and error count
+        """
+        now = time.time()
+        legacy = now < self.legacy_until
+        recent = [size for sent_at, size in list(self.sent_history) if sent_at >= now - self.RATE_WINDOW]
+        behind = self.match_index < last_index
+        return {
+            "address": list(self.address),
+            "mode": "legacy" if legacy else ("stream" if self.sock is not None else "disconnected"),
+            "acked_index": None if legacy else self.match_index,
+            "lag_entries": None if legacy else max(0, last_index - self.match_index),
+            # How long ago the backup last had everything that had been shipped to it
+            "lag_seconds": None if legacy else (round(now - self.caught_up_at, 3) if behind else 0.0),
+            "last_ack_age": round(now - self.last_ack_at, 3) if self.last_ack_at else None,
+            "queue_depth": self.queue.qsize(),
+            "bytes_per_second": round(sum(recent) / self.RATE_WINDOW, 1),
+            "bytes_sent": self.bytes_sent,
+            "errors": self.errors,
+            "last_error": self.last_error
+        }
+
+    def _ensure_stream(self) -> bool:
+        """
+        Open the replication stream and negotiate compression, if not open yet.
+
+        Returns:
+            True if a stream is open, False if the backup does not support streams
+        """
+        if self.sock is not None:
+            return True
+
+        sock = socket.create_connection(self.address, timeout=2)
+        try:
+            hello = {
+                "type": "REPLICATE_STREAM",
+                "server_id": self.manager.server_id,
+                "term": self.manager.current_term,
+                "compression": self.compression_methods
+            }
+            sock.sendall(json.dumps(hello).encode('utf-8'))
+            response_data = self.manager._recv_json(sock, timeout=2)
+        except Exception:
+            sock.close()
+            raise
+
+        if not response_data:
+            sock.close()
+            print(f"Backup {self.address} does not support replication streams, sending single entries")
+            self.legacy_until = time.time() + self.LEGACY_RETRY_INTERVAL
+            return False
+
+        response = json.loads(response_data.decode('utf-8'))
+        self.codec = ReplicationStreamCodec(response.get("compression", "none"))
+        sock.settimeout(5)
+        self.sock = sock
+        print(f"Opened replication stream to {self.address} using {self.codec.method}")
+        return True
+
+    def _close(self):
+        """Close the stream; the next batch opens a new one."""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+        self.sock = None
+        self.codec = None
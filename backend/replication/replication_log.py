@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+class ReplicationLog:
+    """
+    Indexed log of replicated operations.
+
+    Every write applied by the primary gets a monotonically increasing index
+    and the term it was created in. Only the most recent entries are kept in
+    memory; older entries are compacted away and lagging replicas have to be
+    brought up to date with a snapshot instead. The index and term of the last
+    entry are persisted in the data directory so a restarted replica can report
+    how far it got.
+    """
+
+    STATE_FILE = "replication_state.json"
+
+    def __init__(self, data_dir: str, max_entries: int = 1000):
+        """
+        Initialize the replication log.
+
+        Args:
+            data_dir: Directory where the log metadata is persisted
+            max_entries: Number of entries kept before older ones are compacted
+        """
+        self.data_dir = data_dir
+        self.max_entries = max_entries
+        self.state_path = os.path.join(data_dir, self.STATE_FILE)
+        self.lock = threading.Lock()
+
+        self.entries: List[Dict] = []
+        self.last_index = 0
+        self.last_term = 0
+
+        self._load_state()
+        # Entries from before a restart are gone, so everything up to the
+        # persisted index counts as compacted
+        self.start_index = self.last_index + 1
+
+    def _load_state(self):
+        """Load the persisted last index and term, if any."""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            self.last_index = int(state.get("last_log_index", 0))
+            self.last_term = int(state.get("last_log_term", 0))
+            print(f"Loaded replication log state: index={self.last_index}, term={self.last_term}")
+        except Exception as e:
+            print(f"Error loading replication log state from {self.state_path}: {e}")
+
+    def _save_state(self):
+        """Persist the last index and term. Must be called with the lock held."""
+        state = {
+            "last_log_index": self.last_index,
+            "last_log_term": self.last_term
+        }
+        tmp_path = self.state_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            print(f"Error saving replication log state to {self.state_path}: {e}")
+
+    def _compact(self):
+        """Drop the oldest entries once the log grows past max_entries."""
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            del self.entries[:overflow]
+            self.start_index += overflow
+
+    def append(self, term: int, operation: str) -> Dict:
+        """
+        Append a new operation on the primary.
+
+        Args:
+            term: Term the operation was accepted in
+            operation: Operation data
+
+        Returns:
+            The new log entry
+        """
+        with self.lock:
+            entry = {
+                "index": self.last_index + 1,
+                "term": term,
+                "operation": operation
+            }
+            self.entries.append(entry)
+            self.last_index = entry["index"]
+            self.last_term = term
+            self._compact()
+            self._save_state()
+            return entry
+
+    def append_entry(self, entry: Dict) -> bool:
+        """
+        Append an entry received from the primary.
+
+        Args:
+            entry: Log entry with index, term and operation
+
+        Returns:
+            True if the entry directly follows the last one and was appended
+        """
+        with self.lock:
+            if entry.get("index") != self.last_index + 1:
+                return False
+            self.entries.append(entry)
+            self.last_index = entry["index"]
+            self.last_term = entry.get("term", 0)
+            self._compact()
+            self._save_state()
+            return True
+
+    def entries_from(self, index: int) -> Optional[List[Dict]]:
+        """
+        Get all entries starting at the given index.
+
+        Args:
+            index: First index wanted
+
+        Returns:
+            List of entries, or None if some of them were already compacted
+        """
+        with self.lock:
+            if index < self.start_index:
+                return None
+            offset = index - self.start_index
+            return list(self.entries[offset:])
+
+    def term_at(self, index: int) -> Optional[int]:
+        """
+        Get the term of the entry at the given index.
+
+        Args:
+            index: Log index
+
+        Returns:
+            The term, 0 for index 0, or None if the entry is not in memory
+        """
+        with self.lock:
+            if index == 0:
+                return 0
+            if index == self.last_index:
+                return self.last_term
+            if index < self.start_index or index > self.last_index:
+                return None
+            return self.entries[index - self.start_index].get("term", 0)
+
+    def reset_to_snapshot(self, last_included_index: int, last_included_term: int):
+        """
+        Discard the log after a snapshot has been installed.
+
+        Args:
+            last_included_index: Index of the last entry covered by the snapshot
+            last_included_term: Term of that entry
+        """
+        with self.lock:
+            self.entries = []
+            self.last_index = last_included_index
+            self.last_term = last_included_term
+            self.start_index = last_included_index + 1
+            self._save_state()
+
+    def get_last(self):
+        """Return (last_index, last_term) as a consistent pair."""
+        with self.lock:
+            return self.last_index, self.last_term
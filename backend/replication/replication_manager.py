@@ -5,40 +5,129 @@ import json
 import os
 import sys
 import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from enum import Enum
-from typing import List, Dict, Callable, Optional, Tuple
+from typing import List, Dict, Callable, Optional, Tuple, NamedTuple
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+from backend.replication.replication_log import ReplicationLog
+from backend.replication.membership import ClusterMembership
+from backend.replication.async_engine import AsyncReplicationEngine
+from backend.replication.peer_replicator import PeerReplicator
+from backend.replication.forwarding_proxy import ForwardingProxy, REQUEST_ID
+from backend.replication.apply_scheduler import ApplyScheduler
+from backend.replication.mutation_log import (RecordingStorage, build_mutation_operation,
+                                               mutations_from_operation, apply_mutations)
+from backend.protocol.framing import send_frame, recv_frame
+from backend.protocol.fields import add_field
+from backend.replication.stream_codec import ReplicationStreamCodec, COMPRESSION_METHODS
+
 class ServerRole(Enum):
     PRIMARY = "PRIMARY"
     BACKUP = "BACKUP"
     CANDIDATE = "CANDIDATE"
 
+class RoleSnapshot(NamedTuple):
+    """Immutable view of a server's role, taken under state_lock."""
+    role: ServerRole
+    term: int
+    primary_id: Optional[str]
+
 class ReplicationManager:
     """
     Manages replication between multiple server instances for fault tolerance.
     Implements a primary-backup replication scheme with leader election.
     """
     
+    # Entries sent per message while catching up a lagging replica
+    CATCH_UP_BATCH_SIZE = 100
+    # Size of each snapshot chunk sent to a replica whose entries were compacted
+    SNAPSHOT_CHUNK_SIZE = 32 * 1024
+    # Operations that only read state and can be served by an up-to-date backup
+    # (a BATCH reaching the replication manager only ever holds reads, see Controller.handle_batch).
+    # A login goes to the primary: it registers the session that live messages are pushed to,
+    # and only the primary pushes them.
+    READ_OPERATION_TYPES = ['G', 'GM', 'GS', 'BATCH']
+    # Forwarded requests executed at the same time, over all forwarding streams
+    FORWARD_WORKERS = 16
+    # Requests of one forwarding stream running or waiting for a worker; the stream is not read further meanwhile
+    MAX_FORWARD_IN_FLIGHT = 32
+    # Client operations a backup may forward to the primary's replication port
+    CLIENT_OPERATION_TYPES = ['R', 'L', 'G', 'GM', 'GS', 'M', 'D', 'U', 'W', 'O', 'BATCH']
+
     def __init__(self, server_id: str, data_dir: str, replica_addresses: List[Tuple[str, int]], 
-                 local_address: Tuple[str, int], client_handler: Callable):
+                 local_address: Tuple[str, int], client_handler: Callable, storage=None,
+                 max_log_entries: int = 1000, read_lease_duration: float = 1.0,
+                 engine: str = "thread", heartbeat_interval: float = 0.5,
+                 election_timeout_min: float = 1.5, election_timeout_max: float = 3.0,
+                 initial_election_wait: float = 5.0, replication_compression: str = "zlib-dict-v2",
+                 forward_pool_size: int = 2, client_address: Optional[Tuple[str, int]] = None,
+                 apply_workers: int = 4, notify_handler: Optional[Callable[[str, bytes], bool]] = None):
         """
         Initialize the replication manager.
         
         Args:
             server_id: Unique identifier for this server
             data_dir: Directory where this server's data files are stored
-            replica_addresses: List of (host, port) tuples for all replicas in the system
+            replica_addresses: (host, port) tuples of servers to join the cluster through;
+                their server IDs are learned when they answer our JOIN
             local_address: (host, port) tuple for this server's replication endpoint
             client_handler: Function to handle client requests
+            storage: Storage backend used to export and install snapshots; when it is a
+                RecordingStorage, writes are logged as the storage changes they made
+                and backups apply those instead of re-running the request
+            max_log_entries: Number of log entries kept before compaction
+            read_lease_duration: Seconds after a primary heartbeat during which a backup
+                that has applied the primary's log may serve reads locally
+            engine: "thread" for a thread per peer connection, or "asyncio" to run
+                listener, timers and peer connections on one event loop
+            heartbeat_interval: Seconds between heartbeats sent by the primary
+            election_timeout_min: Lower bound of the randomized election timeout, in seconds
+            election_timeout_max: Upper bound of the randomized election timeout, in seconds
+            initial_election_wait: Seconds to wait for an election at startup before
+                becoming primary on our own
+            replication_compression: Most preferred compression for replication streams;
+                less preferred methods in COMPRESSION_METHODS are offered as fallbacks
+            forward_pool_size: Connections a backup keeps open to the primary for
+                forwarding client requests
+            client_address: (host, port) clients connect to on this server, sent to
+                clients of the backups while this server is the primary
+            apply_workers: Replicated entries a backup applies at the same time; entries
+                for the same user or conversation are still applied in log order
+            notify_handler: Pushes a live message to a user with a session on this server,
+                returning whether it was queued; used while this server is the primary
+                for notifications that other servers pass on with notify_primary
         """
         self.server_id = server_id
         self.data_dir = data_dir
-        self.replica_addresses = replica_addresses
         self.local_address = local_address
+        # Server ID to address registry, filled in as servers join
+        self.membership = ClusterMembership(server_id, local_address, replica_addresses)
+        self.membership_change_lock = threading.Lock()  # One configuration change at a time
+        self.removed_from_cluster = False  # Set when a configuration change removed this server
         self.client_handler = client_handler
+        self.notify_handler = notify_handler
+        self.storage = storage
+        self.engine = engine
+        self.async_engine = None
+        
+        # Election and heartbeat timing
+        self.heartbeat_interval = heartbeat_interval
+        self.election_timeout_min = election_timeout_min
+        self.election_timeout_max = election_timeout_max
+        self.initial_election_wait = initial_election_wait
+        self.heartbeat_wakeup = threading.Event()  # Set to send a heartbeat right away
+        self.election_wakeup = threading.Event()  # Set to check for an election right away
+        
+        # Failover instrumentation: (timestamp, event, detail) of the most recent failovers
+        self.failover_timeline = deque(maxlen=100)
+        self.failover_started_at = None
+        self.suspected_primary = None  # Primary a forward to failed, reported in pre-votes
+        self.election_started_at = 0
         
         # Server state
         self.role = ServerRole.CANDIDATE
@@ -56,49 +145,105 @@ class ReplicationManager:
         self.state_lock = threading.Lock()
         self.vote_lock = threading.Lock()
         
+        # Per-user locks so writes to the same user keep their order without a global lock
+        self.key_locks = {}
+        self.key_locks_lock = threading.Lock()
+        
+        # Writes in progress, so a snapshot can wait for a consistent cut
+        self.write_condition = threading.Condition()
+        self.active_writes = 0
+        self.snapshot_in_progress = False
+        
         # Threads
         self.heartbeat_thread = None
         self.election_thread = None
         self.replication_listener_thread = None
         self.running = False
         
-        # Operation log for replication
-        self.operation_log = []
-        self.log_lock = threading.Lock()
-        
         # Create data directory if it doesn't exist
         os.makedirs(self.data_dir, exist_ok=True)
         
+        # Indexed operation log for replication and catch-up
+        self.replication_log = ReplicationLog(self.data_dir, max_log_entries)
+        self.apply_lock = threading.Lock()  # Serializes applying entries on backups
+        self.apply_scheduler = ApplyScheduler(self._apply_operation, self._apply_keys, apply_workers)
+        self.catch_up_lock = threading.Lock()
+        self.catching_up = False
+        
+        # Follower reads: last log index the primary reported, and how long its lease lasts
+        self.read_lease_duration = read_lease_duration
+        self.leader_last_index = 0
+        self.read_lease_expires_at = 0  # Renewed by every message from the primary
+        # Highest index stored by a majority; computed on the primary, learned from it on backups
+        self.commit_index = 0
+        
+        # Persistent, compressed replication streams to each backup
+        self.compression_methods = COMPRESSION_METHODS[COMPRESSION_METHODS.index(replication_compression):]
+        self.peer_replicators = {}
+        self.peer_replicators_lock = threading.Lock()
+        
+        # Pooled, multiplexed connections for forwarding client requests to the primary
+        self.forwarding_proxy = ForwardingProxy(server_id, forward_pool_size)
+        self.forward_executor = ThreadPoolExecutor(max_workers=self.FORWARD_WORKERS, thread_name_prefix="forwarded")
+        
+        # Client-facing addresses: ours, and the one the primary last advertised as (primary_id, address)
+        self.client_address = tuple(client_address) if client_address else None
+        self.primary_client_address = (None, None)
+        
+        # Cleared while this primary hands leadership to a backup; writes wait for it
+        self.leadership_transfer_done = threading.Event()
+        self.leadership_transfer_done.set()
+        self.held_writes = 0  # Writes waiting for the transfer, guarded by write_condition
+        
+    @property
+    def replica_addresses(self) -> List[Tuple[str, int]]:
+        """Replication addresses of every known server, including this one."""
+        return self.membership.addresses()
+    
     def start(self):
         """Start the replication manager and all its threads."""
         print(f"Starting replication manager for server {self.server_id}")
         self.running = True
         
         # Start replication listener
-        self.replication_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.replication_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.replication_socket.bind(self.local_address)
-        self.replication_socket.listen(10)
-        
-        print(f"Started replication listener on {self.local_address}")
+        if self.engine == "asyncio":
+            self.async_engine = AsyncReplicationEngine(self)
+            self.async_engine.start()
+        else:
+            self.replication_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.replication_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.replication_socket.bind(self.local_address)
+            self.replication_socket.listen(10)
+            
+            print(f"Started replication listener on {self.local_address}")
+            
+            self.replication_listener_thread = threading.Thread(target=self._replication_listener)
+            self.replication_listener_thread.daemon = True
+            self.replication_listener_thread.start()
         
-        self.replication_listener_thread = threading.Thread(target=self._replication_listener)
-        self.replication_listener_thread.daemon = True
-        self.replication_listener_thread.start()
+        # Learn the IDs of the other servers, and the primary if there already is one
+        self._join_cluster()
         
         # Start an election immediately
         print(f"Starting initial election for server {self.server_id}")
         self._start_election()
         
-        # Wait for election to complete (up to 5 seconds)
-        election_timeout = 5
+        # Wait for election to complete, retrying split votes after a randomized timeout
         start_time = time.time()
-        while time.time() - start_time < election_timeout:
+        retry_timeout = self._random_election_timeout()
+        while time.time() - start_time < self.initial_election_wait:
             with self.state_lock:
                 if self.role == ServerRole.PRIMARY or self.primary_id is not None:
                     print(f"Election completed. Role: {self.role}, Primary: {self.primary_id}")
                     break
-            time.sleep(0.1)
+                retry = time.time() - self.election_started_at > retry_timeout
+                if retry:
+                    self.role = ServerRole.BACKUP
+            if retry:
+                print(f"Initial election undecided, retrying")
+                self._start_election()
+                retry_timeout = self._random_election_timeout()
+            time.sleep(0.05)
         
         # If no primary was elected, become primary
         with self.state_lock:
@@ -111,6 +256,11 @@ class ReplicationManager:
         
         print(f"Server {self.server_id} final role: {self.role}, primary_id: {self.primary_id}")
         
+        if self.async_engine:
+            # Heartbeat and election timers run on the engine's event loop
+            self.async_engine.start_timers()
+            return
+        
         # Start heartbeat thread
         self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop)
         self.heartbeat_thread.daemon = True
@@ -124,16 +274,28 @@ class ReplicationManager:
     def stop(self):
         """Stop the replication manager and all its threads."""
         self.running = False
+        self._stop_peer_replicators()
+        self.forwarding_proxy.close()
+        self.forward_executor.shutdown(wait=False)
+        self.apply_scheduler.stop()
+        if self.async_engine:
+            self.async_engine.stop()
         if self.replication_socket:
             self.replication_socket.close()
     
-    def handle_client_operation(self, data: bytes, client_socket: socket.socket=None) -> bytes:
+    def handle_client_operation(self, data: bytes, client_socket: socket.socket=None, local_read: bool=True) -> bytes:
         """
         Handle a client operation, possibly forwarding to the primary.
         
+        The role is only read under state_lock as a RoleSnapshot; the request
+        itself runs without it, so requests from different users proceed
+        concurrently and heartbeat/election handling never waits behind them.
+        
         Args:
-            operation_type: Type of operation (read or write)
             data: Operation data
+            client_socket: Socket of the client that sent the operation
+            local_read: Whether a backup may answer a read from its own state;
+                False when the read must see a write the client just made
             
         Returns:
             Response bytes to send back to the client
@@ -141,140 +303,75 @@ class ReplicationManager:
         print(f"ReplicationManager: Handling data: {data}")
         print(f"ReplicationManager: Current server state - Role: {self.role}, Primary ID: {self.primary_id}, Term: {self.current_term}")
         
+        # Reads don't need the primary when our state is recent enough
+        if local_read and self._can_serve_read_locally(data):
+            print(f"ReplicationManager: Serving read locally on BACKUP {self.server_id}")
+            return self.client_handler(data, client_socket, is_local_read=True)
+        
         # Try multiple times in case we're in an election
         max_retries = 3
         retry_delay = 0.5  # seconds
         
         for attempt in range(max_retries):
             print(f"ReplicationManager: Attempt {attempt + 1}/{max_retries}")
-            print(f"ReplicationManager: Lock status before acquiring - Is locked: {self.state_lock.locked()}")
-            if self.state_lock.locked():
-                print("ReplicationManager: WARNING - Lock is currently held by another thread!")
-                # Let's try to identify which thread might be holding it
-                import threading
-                current_thread = threading.current_thread()
-                print(f"ReplicationManager: Current thread: {current_thread.name}")
-                print(f"ReplicationManager: All active threads:")
-                for thread in threading.enumerate():
-                    print(f"  - {thread.name}")
+            snapshot = self._role_snapshot()
             
-            try:
-                with self.state_lock:
-                    print(f"ReplicationManager: Successfully acquired lock")
-                    
-                    # If this server is the primary, process the operation
-                    if self.role == ServerRole.PRIMARY:
-                        print(f"ReplicationManager: This server ({self.server_id}) is PRIMARY, processing locally")
-                        # Process the operation locally
-                        try:
-                            # Extract the message type for logging
-                            try:
-                                msg_type = data.decode('utf-8')[2:3]  # Usually the message type is at position 2
-                                print(f"ReplicationManager: Processing operation of type '{msg_type}'")
-                            except:
-                                print("ReplicationManager: Could not extract message type")
-                            
-                            print("ReplicationManager: About to call client_handler")
-                            print(f"ReplicationManager: client_handler type: {type(self.client_handler)}")
-                            response = self.client_handler(data, client_socket)
-                            print(f"ReplicationManager: client_handler returned response type: {type(response)}")
-                            
-                            # For write operations, replicate to backups
-                            if self._is_write_operation(data):
-                                print("ReplicationManager: This is a write operation, replicating to backups")
-                                self._replicate_operation(data)
-                            
-                            print(f"ReplicationManager: Operation processed successfully, response length: {len(response) if response else 0}")
-                            if response:
-                                print(f"ReplicationManager: Response content: {response[:100]}")
-                            
-                            # Ensure we have a valid response
-                            if not response:
-                                print("ReplicationManager: No response from client_handler, creating default success response")
-                                success_response = {"type": "S", "payload": "Operation processed successfully"}
-                                response = json.dumps([success_response]).encode('utf-8')
-                            
-                            return response
-                        except Exception as e:
-                            print(f"ReplicationManager: Error processing operation: {e}")
-                            print("ReplicationManager: Full error traceback:")
-                            import traceback
-                            traceback.print_exc()
-                            error_response = {"type": "E", "payload": f"Error processing request: {str(e)}"}
-                            return json.dumps([error_response]).encode('utf-8')
-                    
-                    # If this server knows who the primary is, forward the request
-                    elif self.primary_id is not None:
-                        print(f"ReplicationManager: This server is BACKUP, forwarding to PRIMARY ({self.primary_id})")
-                        # Find all potential primary addresses
-                        potential_primary_addresses = []
-                        print(f"ReplicationManager: Replica addresses: {self.replica_addresses}")
-                        for replica in self.replica_addresses:
-                            print(f"ReplicationManager: Checking replica address: {replica}")
-                            server_id = self._get_server_id_from_address(replica)
-                            print(f"ReplicationManager: Server ID: {server_id}, primary_id: {self.primary_id}")
-                            if server_id == self.primary_id:
-                                potential_primary_addresses.append(replica)
+            # If this server is the primary, process the operation
+            if snapshot.role == ServerRole.PRIMARY:
+                if not self.leadership_transfer_done.is_set() and self._is_write_operation(data):
+                    return self._hold_write_during_transfer(data, client_socket)
+                print(f"ReplicationManager: This server ({self.server_id}) is PRIMARY for term {snapshot.term}, processing locally")
+                return self._execute_as_primary(data, client_socket, snapshot)
+            
+            # If this server knows who the primary is, forward the request
+            elif snapshot.primary_id is not None:
+                print(f"ReplicationManager: This server is BACKUP, forwarding to PRIMARY ({snapshot.primary_id})")
+                # Find the primary's address in the membership registry
+                potential_primary_addresses = []
+                print(f"ReplicationManager: Replica addresses: {self.replica_addresses}")
+                primary_address = self.membership.address_of(snapshot.primary_id)
+                if primary_address is not None:
+                    potential_primary_addresses.append(primary_address)
+                
+                print(f"ReplicationManager: Found {len(potential_primary_addresses)} potential primary addresses: {potential_primary_addresses}")
+                
+                last_error = None
+                for primary_address in potential_primary_addresses:
+                    # Forward the request to the primary
+                    try:
+                        print(f"ReplicationManager: Attempting to forward request to primary at {primary_address}")
+                        response = self.forwarding_proxy.forward(primary_address, data)
+                        print(f"ReplicationManager: Received response from primary, length: {len(response)}")
                         
-                        print(f"ReplicationManager: Found {len(potential_primary_addresses)} potential primary addresses: {potential_primary_addresses}")
+                        # Ensure we have a valid response
+                        if not response or len(response) == 0:
+                            print("ReplicationManager: Empty response from primary, creating default success response")
+                            success_response = {"type": "S", "payload": "Operation forwarded to primary"}
+                            response = json.dumps([success_response]).encode('utf-8')
                         
-                        if potential_primary_addresses:
-                            # Try each potential primary address
-                            connection_successful = False
-                            last_error = None
-                            
-                            for primary_address in potential_primary_addresses:
-                                # Forward the request to the primary
-                                try:
-                                    print(f"ReplicationManager: Attempting to forward request to primary at {primary_address}")
-                                    client_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                                    client_sock.settimeout(5)  # 5 second timeout
-                                    client_sock.connect(primary_address)
-                                    client_sock.sendall(data)
-                                    response = client_sock.recv(4096)
-                                    client_sock.close()
-                                    print(f"ReplicationManager: Received response from primary, length: {len(response)}")
-                                    
-                                    # Ensure we have a valid response
-                                    if not response or len(response) == 0:
-                                        print("ReplicationManager: Empty response from primary, creating default success response")
-                                        success_response = {"type": "S", "payload": "Operation forwarded to primary"}
-                                        response = json.dumps([success_response]).encode('utf-8')
-                                    
-                                    connection_successful = True
-                                    return response
-                                except Exception as e:
-                                    last_error = e
-                                    print(f"ReplicationManager: Error forwarding to primary at {primary_address}: {e}")
-                                    # Continue to the next potential primary address
-                            
-                            # If we tried all potential primary addresses and none worked
-                            if not connection_successful:
-                                print(f"ReplicationManager: All connection attempts to primary failed. Last error: {last_error}")
-                                # Primary might be down, clear primary_id and start a new election
-                                self.primary_id = None
-                                self._start_election()
-                                
-                                if attempt < max_retries - 1:
-                                    print(f"Retrying after all connection attempts failed (attempt {attempt + 1}/{max_retries})")
-                                    # Break out of the with block to release the lock
-                                    break
-                                # Return error to client on last attempt
-                                error_response = {"type": "E", "payload": "Primary server unavailable, trying to elect new primary"}
-                                return json.dumps([error_response]).encode('utf-8')
-            except Exception as e:
-                print(f"ReplicationManager: Error acquiring lock: {e}")
+                        return response
+                    except Exception as e:
+                        last_error = e
+                        print(f"ReplicationManager: Error forwarding to primary at {primary_address}: {e}")
+                        # Continue to the next potential primary address
+                
+                # If we tried all potential primary addresses and none worked
+                print(f"ReplicationManager: All connection attempts to primary failed. Last error: {last_error}")
+                # Primary might be down, start a new election right away instead of waiting for the timeout
+                self._trigger_election(snapshot.primary_id, f"forward to primary failed: {last_error}")
+                
                 if attempt < max_retries - 1:
-                    print(f"Retrying after lock error (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(retry_delay)
+                    print(f"Retrying after all connection attempts failed (attempt {attempt + 1}/{max_retries})")
+                    self._wait_for_primary(self.election_timeout_max)
                     continue
-                error_response = {"type": "E", "payload": f"Internal server error: {str(e)}"}
+                # Return error to client on last attempt
+                error_response = {"type": "E", "payload": "Primary server unavailable, trying to elect new primary"}
                 return json.dumps([error_response]).encode('utf-8')
             
             # If we don't know who the primary is, wait briefly and retry
             if attempt < max_retries - 1:
                 print(f"No primary available, waiting and retrying (attempt {attempt + 1}/{max_retries})")
-                time.sleep(retry_delay)
+                self._wait_for_primary(retry_delay)
                 continue
         
         # If we get here, we've exhausted all retries
@@ -282,6 +379,227 @@ class ReplicationManager:
         error_response = {"type": "E", "payload": "No primary server available"}
         return json.dumps([error_response]).encode('utf-8')
     
+    def _hold_write_during_transfer(self, data: bytes, client_socket: socket.socket) -> bytes:
+        """
+        Wait for a leadership transfer to end, then handle a write with whoever is primary.
+        
+        Args:
+            data: Operation data
+            client_socket: Socket of the client that sent the operation
+            
+        Returns:
+            Response bytes to send back to the client
+        """
+        print(f"ReplicationManager: Leadership transfer in progress, holding write")
+        with self.write_condition:
+            self.held_writes += 1
+        try:
+            if not self.leadership_transfer_done.wait(self.election_timeout_max):
+                error_response = {"type": "E", "payload": "Primary is handing over leadership, please retry"}
+                return json.dumps([error_response]).encode('utf-8')
+            return self.handle_client_operation(data, client_socket)
+        finally:
+            with self.write_condition:
+                self.held_writes -= 1
+                self.write_condition.notify_all()
+    
+    def _wait_for_primary(self, timeout: float):
+        """
+        Wait until a primary is known, or the timeout expires.
+        
+        Args:
+            timeout: Maximum seconds to wait
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.role == ServerRole.PRIMARY or self.primary_id is not None:
+                return
+            time.sleep(0.02)
+    
+    def _role_snapshot(self) -> RoleSnapshot:
+        """Read role, term and primary together under state_lock."""
+        with self.state_lock:
+            return RoleSnapshot(self.role, self.current_term, self.primary_id)
+    
+    def _execute_as_primary(self, data: bytes, client_socket: socket.socket, snapshot: RoleSnapshot) -> bytes:
+        """
+        Execute an operation on the primary and replicate it if it is a write.
+        
+        Writes hold the locks of the users they touch while executing, so
+        operations on the same user keep their order. A write is only started
+        if this server is still the primary of the snapshot's term, and a
+        primary stepping down waits for the writes it started; a write that
+        changed storage is therefore always logged and replicated.
+        
+        Args:
+            data: Operation data
+            client_socket: Socket of the client that sent the operation
+            snapshot: Role snapshot the decision to execute locally was based on
+            
+        Returns:
+            Response bytes to send back to the client
+        """
+        is_write = self._is_write_operation(data)
+        key_locks = self._acquire_key_locks(self._operation_keys(data)) if is_write else []
+        if is_write and not self._begin_write(snapshot.term):
+            # Leadership changed since the snapshot; nothing has been changed yet
+            self._release_key_locks(key_locks)
+            print(f"ReplicationManager: No longer primary for term {snapshot.term}, not executing write")
+            error_response = {"type": "E", "payload": "Primary changed while processing request, please retry"}
+            return json.dumps([error_response]).encode('utf-8')
+        try:
+            if is_write and not self.leadership_transfer_done.is_set():
+                # Started just as a leadership transfer began; running it now could be lost
+                error_response = {"type": "E", "payload": "Primary is handing over leadership, please retry"}
+                return json.dumps([error_response]).encode('utf-8')
+            print("ReplicationManager: About to call client_handler")
+            recording = (self.storage.record_mutations() if is_write and isinstance(self.storage, RecordingStorage)
+                         else nullcontext())
+            with recording as mutations:
+                response = self.client_handler(data, client_socket)
+            print(f"ReplicationManager: client_handler returned response type: {type(response)}")
+            
+            entry = None
+            if is_write:
+                # Storage has changed, so the write is logged in the term it was started in even if
+                # stepping down stopped waiting for it; a retry would apply it twice
+                if self.role != ServerRole.PRIMARY or self.current_term != snapshot.term:
+                    print(f"ReplicationManager: Leadership changed during request (term {snapshot.term} -> {self.current_term}), logging it anyway")
+                entry = self._append_to_log(data, snapshot.term, mutations)
+        except Exception as e:
+            print(f"ReplicationManager: Error processing operation: {e}")
+            print("ReplicationManager: Full error traceback:")
+            import traceback
+            traceback.print_exc()
+            error_response = {"type": "E", "payload": f"Error processing request: {str(e)}"}
+            return json.dumps([error_response]).encode('utf-8')
+        finally:
+            if is_write:
+                self._end_write()
+            self._release_key_locks(key_locks)
+        
+        # Network calls to the backups happen without any lock held
+        if entry is not None:
+            print("ReplicationManager: This is a write operation, replicating to backups")
+            self._replicate_operation(entry)
+        
+        print(f"ReplicationManager: Operation processed successfully, response length: {len(response) if response else 0}")
+        
+        # Ensure we have a valid response
+        if not response:
+            print("ReplicationManager: No response from client_handler, creating default success response")
+            success_response = {"type": "S", "payload": "Operation processed successfully"}
+            response = json.dumps([success_response]).encode('utf-8')
+        
+        return response
+    
+    def _operation_keys(self, data: bytes) -> List[str]:
+        """
+        Get the keys (users) an operation touches.
+        
+        Args:
+            data: Operation data
+            
+        Returns:
+            List of keys of the form "user:<username>"
+        """
+        try:
+            json_data = json.loads(data.decode('utf-8'))
+        except:
+            return []
+        msg_type = json_data.get('type', '')
+        payload = json_data.get('payload')
+        
+        users = []
+        if isinstance(payload, list) and payload:
+            if msg_type in ['R', 'L', 'GS', 'O', 'U', 'W']:
+                users = [payload[0]]
+        elif isinstance(payload, dict):
+            if msg_type == 'M':
+                users = [payload.get('sender'), payload.get('recipient')]
+            elif msg_type == 'D':
+                users = [payload.get('sender'), payload.get('receiver')]
+            else:
+                users = [payload.get('username')]
+        return sorted({f"user:{user}" for user in users if user})
+    
+    def _acquire_key_locks(self, keys: List[str]) -> List[threading.Lock]:
+        """
+        Acquire the locks for the given keys in sorted order.
+        
+        Args:
+            keys: Sorted list of keys
+            
+        Returns:
+            The acquired locks, to be passed to _release_key_locks
+        """
+        with self.key_locks_lock:
+            locks = [self.key_locks.setdefault(key, threading.Lock()) for key in keys]
+        for lock in locks:
+            lock.acquire()
+        return locks
+    
+    def _release_key_locks(self, locks: List[threading.Lock]):
+        """Release locks acquired with _acquire_key_locks."""
+        for lock in reversed(locks):
+            lock.release()
+    
+    def _begin_write(self, term: Optional[int] = None) -> bool:
+        """
+        Register a write in progress, waiting while a snapshot is being taken.
+        
+        Args:
+            term: Term the write belongs to; if given, the write is only
+                registered while this server is still the primary of that term
+            
+        Returns:
+            True if the write was registered and must be ended with _end_write
+        """
+        with self.write_condition:
+            while self.snapshot_in_progress:
+                self.write_condition.wait()
+            # Checked under write_condition, so _step_down either sees this write or we see its role change
+            if term is not None and (self.role != ServerRole.PRIMARY or self.current_term != term):
+                return False
+            self.active_writes += 1
+            return True
+    
+    def _end_write(self):
+        """Unregister a write in progress."""
+        with self.write_condition:
+            self.active_writes -= 1
+            self.write_condition.notify_all()
+    
+    def _step_down(self):
+        """
+        Stop being the primary, letting writes already started finish first.
+        
+        Writes that passed the check in _begin_write have changed, or are
+        changing, storage; waiting for them means they are logged in our
+        term before another primary can be followed. Called with state_lock
+        or vote_lock held, which running writes never take.
+        """
+        with self.write_condition:
+            self.role = ServerRole.BACKUP
+            deadline = time.time() + self.election_timeout_max
+            while self.active_writes > 0 and time.time() < deadline:
+                self.write_condition.wait(deadline - time.time())
+    
+    def _pause_writes(self):
+        """Block new writes and wait for running ones, so state and log position match."""
+        with self.write_condition:
+            while self.snapshot_in_progress:
+                self.write_condition.wait()
+            self.snapshot_in_progress = True
+            while self.active_writes > 0:
+                self.write_condition.wait()
+    
+    def _resume_writes(self):
+        """Let writes continue after _pause_writes."""
+        with self.write_condition:
+            self.snapshot_in_progress = False
+            self.write_condition.notify_all()
+    
     def _is_write_operation(self, data: bytes) -> bool:
         """
         Determine if an operation is a write operation that needs to be replicated.
@@ -303,40 +621,198 @@ class ReplicationManager:
         except:
             return False
     
-    def _replicate_operation(self, data: bytes):
+    def _is_read_operation(self, data: bytes) -> bool:
         """
-        Replicate an operation to all backup servers.
+        Determine if an operation only reads state.
         
         Args:
-            data: Operation data to replicate
+            data: Operation data
+            
+        Returns:
+            True if this is a read-only operation, False otherwise
+        """
+        try:
+            json_data = json.loads(data.decode('utf-8'))
+            return json_data.get('type', '') in self.READ_OPERATION_TYPES
+        except:
+            return False
+    
+    def _can_serve_read_locally(self, data: bytes) -> bool:
         """
-        # Add to operation log
-        with self.log_lock:
-            self.operation_log.append(data)
+        Check whether this backup may answer a read without the primary.
         
-        # Send to all backup servers
-        for replica in self.replica_addresses:
-            # Skip self
-            if replica == self.local_address:
-                continue
-                
-            try:
-                # Create replication message
-                replication_msg = {
-                    "type": "REPLICATE",
-                    "term": self.current_term,
-                    "server_id": self.server_id,
-                    "operation": data.decode('utf-8')
-                }
-                
-                # Send to backup
+        The primary's heartbeats carry its last log index. As long as the last
+        heartbeat is within the read lease and we have applied everything it
+        reported, our state is at most one lease behind the primary.
+        
+        Args:
+            data: Operation data
+            
+        Returns:
+            True if the read can be served locally, False if it must be forwarded
+        """
+        if self.role != ServerRole.BACKUP or self.primary_id is None:
+            return False
+        if not self._is_read_operation(data):
+            return False
+        if time.time() > self.read_lease_expires_at:
+            print("ReplicationManager: Read lease expired, forwarding read to primary")
+            return False
+        if self.replication_log.last_index < self.leader_last_index:
+            print(f"ReplicationManager: Behind primary ({self.replication_log.last_index} < {self.leader_last_index}), forwarding read")
+            return False
+        return True
+    
+    def _append_to_log(self, data: bytes, term: int, mutations: Optional[List[Dict]] = None) -> Dict:
+        """
+        Append a write to the replication log.
+        
+        Args:
+            data: Operation data
+            term: Term the write was executed in
+            mutations: Storage writes the operation made; logged instead of the
+                operation itself when recorded
+            
+        Returns:
+            The new log entry
+        """
+        if mutations is not None:
+            return self.replication_log.append(term, build_mutation_operation(mutations))
+        return self.replication_log.append(term, data.decode('utf-8'))
+    
+    def _replicate_operation(self, entry: Dict):
+        """
+        Replicate a log entry to all backup servers.
+        
+        The entry is queued on each backup's replication stream and sent in
+        the background, batched with whatever else is waiting.
+        
+        Args:
+            entry: Log entry to replicate
+        """
+        for replica in self.membership.peer_addresses():
+            self._peer_replicator(replica).enqueue(entry)
+    
+    def _peer_replicator(self, replica: Tuple[str, int]) -> PeerReplicator:
+        """
+        Get the replication stream to a backup, starting it if needed.
+        
+        Streams to servers that left the cluster are stopped on the way.
+        
+        Args:
+            replica: Replication address of the backup
+            
+        Returns:
+            The backup's PeerReplicator
+        """
+        peers = self.membership.peer_addresses()
+        with self.peer_replicators_lock:
+            for address in list(self.peer_replicators):
+                if address not in peers:
+                    self.peer_replicators.pop(address).stop()
+            
+            replicator = self.peer_replicators.get(replica)
+            if replicator is None:
+                replicator = PeerReplicator(self, replica, self.compression_methods)
+                replicator.start()
+                self.peer_replicators[replica] = replicator
+            return replicator
+    
+    def _stop_peer_replicators(self):
+        """Close all replication streams, after stepping down."""
+        with self.peer_replicators_lock:
+            replicators = list(self.peer_replicators.values())
+            self.peer_replicators = {}
+        for replicator in replicators:
+            replicator.stop()
+    
+    def _send_replicate(self, replica: Tuple[str, int], entry: Dict):
+        """
+        Send a single REPLICATE message over a new connection.
+        
+        Used for backups that do not support replication streams.
+        
+        Args:
+            replica: Replication address of the backup
+            entry: Log entry to replicate
+        """
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(2)  # 2 second timeout
+            sock.connect(replica)
+            sock.sendall(json.dumps(self._build_replicate_message(entry)).encode('utf-8'))
+            sock.close()
+        except Exception as e:
+            print(f"Error replicating to {replica}: {e}")
+    
+    def _build_replicate_message(self, entry: Dict) -> dict:
+        """
+        Build the REPLICATE message for a log entry.
+        
+        Args:
+            entry: Log entry to replicate
+            
+        Returns:
+            REPLICATE message
+        """
+        prev_log_index = entry["index"] - 1
+        return {
+            "type": "REPLICATE",
+            "term": entry["term"],
+            "server_id": self.server_id,
+            "index": entry["index"],
+            "prev_log_index": prev_log_index,
+            "prev_log_term": self.replication_log.term_at(prev_log_index),
+            "operation": entry["operation"],
+            "client_address": list(self.client_address) if self.client_address else None,
+            "commit_index": self.commit_index,
+            "lease": self.read_lease_duration
+        }
+    
+    def _replicate_to_quorum(self, entry: Dict, timeout: float = None) -> bool:
+        """
+        Replicate a log entry and wait until a majority of the cluster stored it.
+        
+        Backups that are behind answer with a failure and catch up on their
+        own; they are asked again until they acknowledge or the timeout passes.
+        
+        Args:
+            entry: Log entry to replicate
+            timeout: Seconds to wait, by default twice the maximum election timeout
+            
+        Returns:
+            True if a majority (of both configurations during a change) acknowledged the entry
+        """
+        deadline = time.time() + (timeout if timeout is not None else 2 * self.election_timeout_max)
+        replication_msg = json.dumps(self._build_replicate_message(entry)).encode('utf-8')
+        acknowledged = {self.server_id}
+        
+        while self.running and time.time() < deadline:
+            for replica in self.membership.peer_addresses():
+                if self.membership.server_id_of(replica) in acknowledged:
+                    continue
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(2)  # 2 second timeout
-                sock.connect(replica)
-                sock.sendall(json.dumps(replication_msg).encode('utf-8'))
-                sock.close()
-            except Exception as e:
-                print(f"Error replicating to {replica}: {e}")
+                try:
+                    sock.settimeout(2)
+                    sock.connect(replica)
+                    sock.sendall(replication_msg)
+                    response_data = self._recv_json(sock, timeout=2)
+                    if response_data:
+                        response = json.loads(response_data.decode('utf-8'))
+                        if response.get("success"):
+                            acknowledged.add(response.get("server_id"))
+                except Exception as e:
+                    print(f"Error replicating entry {entry['index']} to {replica}: {e}")
+                finally:
+                    sock.close()
+            
+            if self.membership.has_quorum(acknowledged):
+                print(f"Entry {entry['index']} stored by {sorted(acknowledged)}")
+                return True
+            time.sleep(self.heartbeat_interval)
+        
+        print(f"Entry {entry['index']} not acknowledged by a majority, only by {sorted(acknowledged)}")
+        return False
     
     def _replication_listener(self):
         """Listen for replication messages from other servers."""
@@ -359,122 +835,740 @@ class ReplicationManager:
             addr: Client address
         """
         try:
-            data = client_sock.recv(4096)
-            print(f"PRIMARY received data: {data}")
+            data = self._recv_json(client_sock)
+            print(f"PRIMARY received data: {data[:100]}")
             if not data:
                 return
 
             message = json.loads(data.decode('utf-8'))
-            message_type = message.get("type", "")
             
-            try:
-                # Handle replication protocol messages
-                if message_type in ["HEARTBEAT", "REQUEST_VOTE", "VOTE_RESPONSE", "REPLICATE"]:
-                    if message_type == "HEARTBEAT":
-                        self._handle_heartbeat(message)
-                    elif message_type == "REQUEST_VOTE":
-                        self._remove_dead_primary()
-                        response = self._handle_vote_request(message)
-                        client_sock.sendall(json.dumps(response).encode('utf-8'))
-                    elif message_type == "VOTE_RESPONSE":
-                        self._handle_vote_response(message)
-                    elif message_type == "REPLICATE":
-                        self._handle_replication(message)
-                        # Send acknowledgment
-                        response = {"type": "REPLICATE_ACK", "server_id": self.server_id}
-                        client_sock.sendall(json.dumps(response).encode('utf-8'))
-                # Handle client requests forwarded from backup servers
-                elif message_type in ["R", "L", "C", "V", "U", "G", "M", "D"]:
-                    response = self.handle_client_operation(data, client_sock)
-                    client_sock.sendall(response)
-                else:
-                    print(f"Unknown message type: {message_type}")
-
-            except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON from replication connection: {e}")
+            if message.get("type", "") == "CATCH_UP":
+                for reply in self._catch_up_messages(message):
+                    self._send_json_line(client_sock, reply)
+                return
+            
+            if message.get("type", "") == "REPLICATE_STREAM":
+                self._serve_replication_stream(message, client_sock)
+                return
+            
+            if message.get("type", "") == "FORWARD_STREAM":
+                self._serve_forward_stream(message, client_sock)
+                return
+            
+            response = self._dispatch_replication_message(message, data, client_sock)
+            if response:
+                client_sock.sendall(response)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from replication connection: {e}")
         except Exception as e:
             print(f"Error handling replication connection: {e}")
         finally:
             client_sock.close()
     
-    def _handle_heartbeat(self, message):
+    def _dispatch_replication_message(self, message: dict, data: bytes, client_sock: socket.socket=None) -> Optional[bytes]:
         """
-        Handle a heartbeat message from the primary.
+        Handle a single replication protocol message or forwarded client request.
+        
+        Shared by the threaded listener and the asyncio engine. CATCH_UP is a
+        stream and is handled by _catch_up_messages instead.
         
         Args:
-            message: Heartbeat message
+            message: Decoded message
+            data: Raw message bytes
+            client_sock: Connection the message arrived on, if any
+            
+        Returns:
+            Response bytes to send back, or None if the message has no response
         """
-        sender_term = message.get("term", 0)
-        sender_id = message.get("server_id", "")
+        message_type = message.get("type", "")
         
-        # Don't process our own heartbeats
-        if sender_id == self.server_id:
-            print(f"Ignoring heartbeat from self ({self.server_id})")
-            return
-            
-        print(f"Handling heartbeat from {sender_id}, term {sender_term}")
-        print(f"Current state before heartbeat - Role: {self.role}, Term: {self.current_term}, Primary: {self.primary_id}")
+        # Handle replication protocol messages
+        if message_type == "HEARTBEAT":
+            self._handle_heartbeat(message)
+        elif message_type == "REQUEST_VOTE":
+            # Votes also follow a leadership transfer, while the primary is healthy; only drop one that went quiet
+            if time.time() - self.last_heartbeat_time >= self.election_timeout_min:
+                self._remove_dead_primary()
+            response = self._handle_vote_request(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "PRE_VOTE":
+            response = self._handle_pre_vote(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "VOTE_RESPONSE":
+            self._handle_vote_response(message)
+        elif message_type == "TIMEOUT_NOW":
+            response = self._handle_timeout_now(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "REPLICATION_STATS":
+            return json.dumps(self.get_replication_stats()).encode('utf-8')
+        elif message_type == "JOIN":
+            response = self._handle_join(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "MEMBERSHIP_CHANGE":
+            response = self._handle_membership_change(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "NOTIFY":
+            response = self._handle_notify(message)
+            return json.dumps(response).encode('utf-8')
+        elif message_type == "REPLICATE":
+            self._handle_heartbeat(message, check_progress=False)
+            success = self._handle_replication(message)
+            self._check_leader_progress(message.get("server_id", ""), message.get("index", 0),
+                                        message.get("commit_index"))
+            # Send acknowledgment
+            response = {
+                "type": "REPLICATE_ACK",
+                "server_id": self.server_id,
+                "success": bool(success),
+                "last_log_index": self.replication_log.last_index
+            }
+            return json.dumps(response).encode('utf-8')
+        # Handle client requests forwarded from backup servers
+        elif message_type in self.CLIENT_OPERATION_TYPES:
+            return self.handle_client_operation(data, client_sock)
+        else:
+            print(f"Unknown message type: {message_type}")
+        return None
+    
+    def _accept_forward_stream(self, message: dict) -> bytes:
+        """
+        Accept a forwarding stream opened by a backup.
         
-        with self.state_lock:
-            # Update last heartbeat time
-            self.last_heartbeat_time = time.time()
+        Args:
+            message: FORWARD_STREAM message
             
-            # Only step down if we receive a higher term
-            if sender_term > self.current_term:
-                print(f"Received higher term {sender_term} > {self.current_term}, stepping down")
-                self.current_term = sender_term
-                self.primary_id = sender_id
-                self.role = ServerRole.BACKUP
-                self.voted_for = None
-                self.active_replicas.add(sender_id)
-            elif sender_term == self.current_term:
-                # If we're not PRIMARY, update our primary_id
-                if self.role != ServerRole.PRIMARY:
-                    print(f"Updating primary to {sender_id} for current term")
-                    self.primary_id = sender_id
-                else:
-                    print(f"Ignoring heartbeat - we are PRIMARY for term {self.current_term}")
-            else:
-                print(f"Ignoring heartbeat with lower term {sender_term} < {self.current_term}")
-        
-        print(f"State after heartbeat - Role: {self.role}, Term: {self.current_term}, Primary: {self.primary_id}")
+        Returns:
+            FORWARD_STREAM_ACCEPT frame payload to send back
+        """
+        print(f"Accepting forwarding stream from {message.get('server_id')}")
+        response = {"type": "FORWARD_STREAM_ACCEPT", "server_id": self.server_id}
+        return json.dumps(response).encode('utf-8')
     
-    def _handle_vote_request(self, message):
+    def _handle_forwarded_request(self, frame: bytes) -> bytes:
         """
-        Handle a vote request from a candidate.
+        Execute one request from a forwarding stream.
         
         Args:
-            message: Vote request message
+            frame: Request ID followed by the client request bytes
             
         Returns:
-            Vote response message
+            Response frame payload: the same request ID followed by the response
         """
-        candidate_term = message.get("term", 0)
-        candidate_id = message.get("server_id", "")
+        request_id = frame[:REQUEST_ID.size]
+        data = frame[REQUEST_ID.size:]
+        try:
+            # The stream is shared by many clients, so nothing may be written to it directly
+            response = self.handle_client_operation(data, None)
+        except Exception as e:
+            print(f"Error handling forwarded request: {e}")
+            response = json.dumps([{"type": "E", "payload": f"Error processing request: {str(e)}"}]).encode('utf-8')
+        return request_id + (response or b'')
+    
+    def _serve_forward_stream(self, message: dict, sock: socket.socket):
+        """
+        Execute requests from a backup's forwarding stream until it closes.
         
-        print(f"Handling vote request from {candidate_id} for term {candidate_term}")
+        Requests run on the forwarding workers and each response is sent as
+        soon as it is ready, so a slow request does not hold up the ones
+        behind it. Once MAX_FORWARD_IN_FLIGHT requests of the stream are
+        running or waiting, no more are read until one finishes; the backup's
+        sends then wait on the connection instead of piling up here.
         
-        with self.vote_lock:
-            # If the candidate's term is higher than ours, update our term
-            if candidate_term > self.current_term:
-                print(f"Updating term from {self.current_term} to {candidate_term}")
-                self.current_term = candidate_term
+        Args:
+            message: FORWARD_STREAM message that opened the stream
+            sock: Connection the stream runs on
+        """
+        send_lock = threading.Lock()
+        slots = threading.BoundedSemaphore(self.MAX_FORWARD_IN_FLIGHT)
+        
+        def run(frame):
+            try:
+                response = self._handle_forwarded_request(frame)
+                with send_lock:
+                    send_frame(sock, response)
+            except Exception as e:
+                print(f"Error answering forwarded request: {e}")
+            finally:
+                slots.release()
+        
+        send_frame(sock, self._accept_forward_stream(message))
+        sock.settimeout(None)
+        while self.running:
+            frame = recv_frame(sock)
+            if frame is None:
+                break
+            slots.acquire()
+            try:
+                self.forward_executor.submit(run, frame)
+            except RuntimeError:
+                # Shutting down
+                break
+    
+    def _accept_replication_stream(self, message: dict) -> Tuple[ReplicationStreamCodec, bytes]:
+        """
+        Negotiate compression for a replication stream opened by the primary.
+        
+        Args:
+            message: REPLICATE_STREAM message with the offered compression methods
+            
+        Returns:
+            (codec, response) where response is the REPLICATE_STREAM_ACCEPT to send back
+        """
+        method = ReplicationStreamCodec.choose(message.get("compression", []))
+        print(f"Accepting replication stream from {message.get('server_id')} using {method}")
+        response = {
+            "type": "REPLICATE_STREAM_ACCEPT",
+            "server_id": self.server_id,
+            "compression": method
+        }
+        return ReplicationStreamCodec(method), json.dumps(response).encode('utf-8')
+    
+    def _serve_replication_stream(self, message: dict, sock: socket.socket):
+        """
+        Apply batches from a replication stream until the primary closes it.
+        
+        Args:
+            message: REPLICATE_STREAM message that opened the stream
+            sock: Connection the stream runs on
+        """
+        codec, response = self._accept_replication_stream(message)
+        sock.sendall(response)
+        sock.settimeout(None)  # The stream stays open while the primary has nothing to send
+        while self.running:
+            payload = recv_frame(sock)
+            if payload is None:
+                break
+            send_frame(sock, self._apply_replication_batch(codec, payload))
+    
+    def _apply_replication_batch(self, codec: ReplicationStreamCodec, payload: bytes) -> bytes:
+        """
+        Decode and apply one batch from a replication stream.
+        
+        Args:
+            codec: The stream's codec; batches must be decoded in order
+            payload: Compressed batch
+            
+        Returns:
+            REPLICATE_ACK to send back
+        """
+        header, entries = codec.decode_batch(payload)
+        # The header doubles as a heartbeat, so a busy stream needs no separate ones
+        leader_contact = dict(header, type="HEARTBEAT")
+        leader_contact.pop("entries", None)
+        self._handle_heartbeat(leader_contact, check_progress=False)
+        
+        success = True
+        if entries:
+            success = self._handle_replicated_entries(header.get("server_id", ""), header.get("term", 0), entries,
+                                                      header.get("prev_log_term"))
+        
+        self._check_leader_progress(header.get("server_id", ""), header.get("last_log_index", 0),
+                                    header.get("commit_index"))
+        last_index, last_term = self.replication_log.get_last()
+        response = {
+            "type": "REPLICATE_ACK",
+            "server_id": self.server_id,
+            "success": success,
+            "last_log_index": last_index,
+            "last_log_term": last_term
+        }
+        return json.dumps(response).encode('utf-8')
+    
+    def _recv_json(self, sock: socket.socket, timeout: float = 5) -> bytes:
+        """
+        Receive one complete JSON message from a socket.
+        
+        Messages larger than a single recv are read until they parse.
+        
+        Args:
+            sock: Socket to read from
+            timeout: Socket timeout in seconds
+            
+        Returns:
+            Raw message bytes, or empty bytes if the connection closed first
+        """
+        sock.settimeout(timeout)
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+            try:
+                json.loads(data.decode('utf-8'))
+                return data
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+    
+    def _read_json_stream(self, sock: socket.socket, timeout: float = 10):
+        """
+        Yield newline-delimited JSON messages from a socket until it closes.
+        
+        Args:
+            sock: Socket to read from
+            timeout: Socket timeout in seconds
+        """
+        sock.settimeout(timeout)
+        buffer = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+        if buffer.strip():
+            yield json.loads(buffer.decode('utf-8'))
+    
+    def _send_json_line(self, sock: socket.socket, message: dict):
+        """Send one message on a newline-delimited JSON stream."""
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    
+    def _catch_up_messages(self, message):
+        """
+        Generate the stream of missing log entries, or a snapshot if they were compacted, for a lagging replica.
+        
+        Runs on the connection's own thread (or the engine's worker), so the
+        primary's request path only waits on the brief log/storage reads,
+        never on the stream itself.
+        
+        Args:
+            message: CATCH_UP request with the follower's last log index and term
+            
+        Yields:
+            Messages to send to the follower, in order
+        """
+        follower_id = message.get("server_id", "")
+        follower_index = message.get("last_log_index", 0)
+        follower_term = message.get("last_log_term", 0)
+        print(f"Serving catch-up for {follower_id} from index {follower_index} (term {follower_term})")
+        
+        if self.role != ServerRole.PRIMARY:
+            yield {"type": "CATCH_UP_REJECT", "primary_id": self.primary_id}
+            return
+        
+        entries = None
+        # The follower's last entry has to match ours, otherwise its log diverged
+        if self.replication_log.term_at(follower_index) == follower_term:
+            entries = self.replication_log.entries_from(follower_index + 1)
+        
+        if entries is None:
+            chunks = self._snapshot_messages(follower_id)
+            snapshot_index = 0
+            for chunk in chunks:
+                snapshot_index = chunk["last_included_index"]
+                yield chunk
+            # Entries appended after the snapshot was taken
+            entries = self.replication_log.entries_from(snapshot_index + 1) or []
+        
+        for start in range(0, len(entries), self.CATCH_UP_BATCH_SIZE):
+            batch = entries[start:start + self.CATCH_UP_BATCH_SIZE]
+            yield {
+                "type": "CATCH_UP_ENTRIES",
+                "term": self.current_term,
+                "server_id": self.server_id,
+                "entries": batch
+            }
+        
+        yield {
+            "type": "CATCH_UP_DONE",
+            "term": self.current_term,
+            "server_id": self.server_id,
+            "last_log_index": self.replication_log.last_index
+        }
+        print(f"Catch-up for {follower_id} sent {len(entries)} entries")
+    
+    def _snapshot_messages(self, follower_id: str):
+        """
+        Generate a chunked snapshot of the users/messages state.
+        
+        Args:
+            follower_id: Server ID of the replica being caught up
+            
+        Yields:
+            SNAPSHOT_CHUNK messages, the last one marked done
+        """
+        if self.storage is None:
+            raise RuntimeError("Cannot send snapshot without a storage backend")
+        
+        # Take the snapshot and the log position together so they describe the same state
+        self._pause_writes()
+        try:
+            last_index, last_term = self.replication_log.get_last()
+            collections = self.storage.export_snapshot()
+            config = self.membership.to_config()
+        finally:
+            self._resume_writes()
+        
+        snapshot_data = json.dumps(collections)
+        total = len(snapshot_data)
+        print(f"Sending snapshot at index {last_index} to {follower_id} ({total} bytes)")
+        
+        offset = 0
+        while True:
+            chunk = snapshot_data[offset:offset + self.SNAPSHOT_CHUNK_SIZE]
+            done = offset + len(chunk) >= total
+            yield {
+                "type": "SNAPSHOT_CHUNK",
+                "term": self.current_term,
+                "server_id": self.server_id,
+                "last_included_index": last_index,
+                "last_included_term": last_term,
+                "offset": offset,
+                "data": chunk,
+                "done": done,
+                "config": config if done else None
+            }
+            offset += len(chunk)
+            if done:
+                break
+    
+    def _request_catch_up(self):
+        """Start catching up from the primary in the background, unless already doing so."""
+        with self.catch_up_lock:
+            if self.catching_up:
+                return
+            self.catching_up = True
+        threading.Thread(target=self._catch_up_from_primary, daemon=True).start()
+    
+    def _catch_up_from_primary(self):
+        """Report our last log index to the primary and apply whatever it streams back."""
+        try:
+            primary_address = self.get_primary()
+            if primary_address is None or self.role == ServerRole.PRIMARY:
+                return
+            
+            last_index, last_term = self.replication_log.get_last()
+            print(f"Catching up from primary {self.primary_id} at {primary_address}, last index {last_index}")
+            request = {
+                "type": "CATCH_UP",
+                "server_id": self.server_id,
+                "last_log_index": last_index,
+                "last_log_term": last_term
+            }
+            
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(primary_address)
+            try:
+                self._send_json_line(sock, request)
+                snapshot_parts = []
+                for message in self._read_json_stream(sock):
+                    message_type = message.get("type")
+                    if message_type == "SNAPSHOT_CHUNK":
+                        snapshot_parts.append(message.get("data", ""))
+                        if message.get("done"):
+                            self._install_snapshot(
+                                json.loads("".join(snapshot_parts)),
+                                message.get("last_included_index", 0),
+                                message.get("last_included_term", 0),
+                                message.get("config")
+                            )
+                            snapshot_parts = []
+                    elif message_type == "CATCH_UP_ENTRIES":
+                        if not self._apply_entries(message.get("entries", [])):
+                            print(f"Stopping catch-up at index {self.replication_log.last_index}")
+                            return
+                    elif message_type == "CATCH_UP_DONE":
+                        print(f"Catch-up complete at index {self.replication_log.last_index}")
+                        break
+                    elif message_type == "CATCH_UP_REJECT":
+                        print(f"Catch-up rejected, primary is {message.get('primary_id')}")
+                        break
+            finally:
+                sock.close()
+        except Exception as e:
+            print(f"Error catching up from primary: {e}")
+        finally:
+            with self.catch_up_lock:
+                self.catching_up = False
+    
+    def _install_snapshot(self, collections: Dict[str, str], last_included_index: int, last_included_term: int,
+                          config: Optional[Dict] = None):
+        """
+        Replace local state with a snapshot received from the primary.
+        
+        Args:
+            collections: Raw collection file contents by collection name
+            last_included_index: Index of the last entry covered by the snapshot
+            last_included_term: Term of that entry
+            config: Cluster configuration at the time of the snapshot
+        """
+        if self.storage is None:
+            print("Cannot install snapshot without a storage backend")
+            return
+        with self.apply_lock:
+            print(f"Installing snapshot up to index {last_included_index}")
+            self.storage.install_snapshot(collections)
+            self.replication_log.reset_to_snapshot(last_included_index, last_included_term)
+            if config:
+                self._apply_config(config)
+    
+    def _apply_entry(self, entry: Dict, prev_log_term: Optional[int] = None) -> bool:
+        """
+        Apply a replicated log entry if it directly follows our last one.
+        
+        Args:
+            entry: Log entry with index, term and operation
+            prev_log_term: Term of the primary's entry before it, if known
+            
+        Returns:
+            True if the entry is applied (or was already applied), False on a gap or a diverged log
+        """
+        return self._apply_entries([entry], prev_log_term)
+    
+    def _apply_entries(self, entries: List[Dict], prev_log_term: Optional[int] = None) -> bool:
+        """
+        Apply consecutive replicated log entries that continue our log.
+        
+        Entries that do not share a user or conversation are applied in
+        parallel by the apply scheduler; each is appended to our log once
+        every entry before it is applied. Entries we already hold must have
+        the same terms as ours, as must the entry before the first one;
+        otherwise our log diverged from the primary's, e.g. because we were
+        deposed with entries that never reached a majority, and nothing is applied.
+        
+        Args:
+            entries: Log entries with index, term and operation, in index order
+            prev_log_term: Term of the primary's entry before the first one, if known
+            
+        Returns:
+            True if all entries are applied (or were already applied), False on a gap,
+            a diverged log or an error
+        """
+        with self.apply_lock:
+            last_index = self.replication_log.last_index
+            if entries and self._log_diverged(entries, prev_log_term, last_index):
+                return False
+            new_entries = [entry for entry in entries if entry.get("index", 0) > last_index]
+            if len(new_entries) < len(entries):
+                print(f"Skipping {len(entries) - len(new_entries)} entries already applied (last index {last_index})")
+            if not new_entries:
+                return True
+            first_index = new_entries[0].get("index", 0)
+            if first_index != last_index + 1:
+                print(f"Gap in log: received entry {first_index}, last index {last_index}")
+                return False
+            
+            if len(new_entries) > 1:
+                print(f"Applying entries {first_index}-{new_entries[-1].get('index')}")
+            return self.apply_scheduler.run(new_entries, self.replication_log.append_entry)
+    
+    def _log_diverged(self, entries: List[Dict], prev_log_term: Optional[int], last_index: int) -> bool:
+        """
+        Check whether our log disagrees with the primary's where they overlap.
+        
+        Entries that were compacted away cannot be compared and are taken to match.
+        
+        Args:
+            entries: Log entries from the primary, in index order
+            prev_log_term: Term of the primary's entry before the first one, if known
+            last_index: Our last log index
+            
+        Returns:
+            True if an entry we hold has a different term than the primary's
+        """
+        prev_index = entries[0].get("index", 0) - 1
+        overlap = [(prev_index, prev_log_term)] if prev_log_term is not None else []
+        overlap += [(entry.get("index", 0), entry.get("term")) for entry in entries]
+        for index, term in overlap:
+            if index > last_index:
+                break
+            local_term = self.replication_log.term_at(index)
+            if local_term is not None and local_term != term:
+                print(f"Log diverged from the primary at index {index}: term {local_term} here, {term} on the primary")
+                return True
+        return False
+    
+    def _apply_operation(self, entry: Dict):
+        """
+        Apply the operation of one log entry to this server's state.
+        
+        Args:
+            entry: Log entry with index, term and operation
+        """
+        operation_data = entry.get("operation", "")
+        print(f"Applying entry {entry.get('index')}: {operation_data[:100]}...")
+        
+        config = self._config_from_operation(operation_data)
+        mutations = mutations_from_operation(operation_data) if config is None else None
+        if config is not None:
+            self._apply_config(config)
+        elif mutations is not None and self.storage is not None:
+            # The primary already resolved the write, only the storage changes are left to make
+            apply_mutations(self.storage, mutations)
+            print(f"Applied {len(mutations)} storage changes")
+        else:
+            # Process the operation as if it came from a client
+            result = self.client_handler(operation_data.encode('utf-8'), None, is_replication=True)
+            if result:
+                print(f"Successfully applied operation, result: {result[:100]}...")
+            else:
+                print("Operation applied but no result returned")
+    
+    def _apply_keys(self, entry: Dict) -> Optional[List[str]]:
+        """
+        Get the keys a log entry touches, for ordering parallel applies.
+        
+        Args:
+            entry: Log entry with index, term and operation
+            
+        Returns:
+            Keys of the form "user:<username>" or "conversation:<user>|<user>",
+            or None if the entry may touch anything and must be applied alone;
+            client operations are always applied alone, since running one again
+            after an earlier entry failed would repeat its writes
+        """
+        operation_data = entry.get("operation", "")
+        mutations = mutations_from_operation(operation_data)
+        if mutations is not None:
+            keys = set()
+            for mutation in mutations:
+                fields = mutation.get("document") or mutation.get("query") or {}
+                if mutation.get("collection") == "users" and fields.get("user_name"):
+                    keys.add(f"user:{fields['user_name']}")
+                elif mutation.get("collection") == "messages" and fields.get("sender") and fields.get("receiver"):
+                    keys.add(self._conversation_key(fields["sender"], fields["receiver"]))
+                else:
+                    # E.g. deleting all messages of a user, which spans conversations
+                    return None
+            return sorted(keys)
+        # Configuration changes and client operations
+        return None
+    
+    def _conversation_key(self, user: str, other_user: str) -> str:
+        """Key shared by all messages between two users, whoever sent them."""
+        first, second = sorted([user, other_user])
+        return f"conversation:{first}|{second}"
+    
+    def _handle_heartbeat(self, message, check_progress: bool = True):
+        """
+        Handle a heartbeat message from the primary.
+        
+        Also used for the leader information carried on REPLICATE messages and
+        replication stream batches.
+        
+        Args:
+            message: Heartbeat message
+            check_progress: Whether to compare our log with the primary's right away;
+                callers that apply entries first do this themselves afterwards
+        """
+        sender_term = message.get("term", 0)
+        sender_id = message.get("server_id", "")
+        
+        # Don't process our own heartbeats
+        if sender_id == self.server_id:
+            print(f"Ignoring heartbeat from self ({self.server_id})")
+            return
+            
+        print(f"Handling heartbeat from {sender_id}, term {sender_term}")
+        print(f"Current state before heartbeat - Role: {self.role}, Term: {self.current_term}, Primary: {self.primary_id}")
+        
+        # A primary we dropped from our view, or one that joined later, is added back
+        if message.get("address") and self.membership.address_of(sender_id) is None:
+            self.membership.register(sender_id, message["address"])
+        
+        with self.state_lock:
+            # Update last heartbeat time
+            self.last_heartbeat_time = time.time()
+            
+            # Only step down if we receive a higher term
+            if sender_term > self.current_term:
+                print(f"Received higher term {sender_term} > {self.current_term}, stepping down")
+                self._step_down()
+                self.current_term = sender_term
+                self.primary_id = sender_id
                 self.voted_for = None
-                
-                # If we were the primary, step down
+                self.active_replicas.add(sender_id)
+                self._record_failover_event("new_primary_learned", f"{sender_id} term {sender_term}")
+            elif sender_term == self.current_term:
+                # If we're not PRIMARY, update our primary_id
+                if self.role != ServerRole.PRIMARY:
+                    if self.primary_id != sender_id:
+                        self._record_failover_event("new_primary_learned", f"{sender_id} term {sender_term}")
+                    print(f"Updating primary to {sender_id} for current term")
+                    self.role = ServerRole.BACKUP
+                    self.primary_id = sender_id
+                else:
+                    print(f"Ignoring heartbeat - we are PRIMARY for term {self.current_term}")
+            else:
+                print(f"Ignoring heartbeat with lower term {sender_term} < {self.current_term}")
+        
+        print(f"State after heartbeat - Role: {self.role}, Term: {self.current_term}, Primary: {self.primary_id}")
+        
+        # Every message from the primary renews the read lease
+        if self.role == ServerRole.BACKUP and sender_id == self.primary_id:
+            lease = min(self.read_lease_duration, message.get("lease", self.read_lease_duration))
+            self.read_lease_expires_at = self.last_heartbeat_time + lease
+            if message.get("client_address"):
+                self.primary_client_address = (sender_id, tuple(message["client_address"]))
+        
+        if check_progress:
+            self._check_leader_progress(sender_id, message.get("last_log_index", 0), message.get("commit_index"))
+    
+    def _check_leader_progress(self, sender_id: str, primary_last_index: int, commit_index: Optional[int] = None):
+        """
+        Record how far the primary is, and fetch whatever we are missing.
+        
+        Args:
+            sender_id: Server that sent the message
+            primary_last_index: Last log index the primary reported
+            commit_index: Primary's commit index, if the message carried one
+        """
+        if sender_id != self.primary_id:
+            return
+        self.leader_last_index = primary_last_index
+        if commit_index is not None:
+            self.commit_index = max(self.commit_index, min(commit_index, self.replication_log.last_index))
+        
+        # A restarted or lagging backup learns from the primary that it is behind
+        if self.role == ServerRole.BACKUP and primary_last_index > self.replication_log.last_index:
+            print(f"Behind primary ({self.replication_log.last_index} < {primary_last_index}), requesting catch-up")
+            self._request_catch_up()
+    
+    def _handle_vote_request(self, message):
+        """
+        Handle a vote request from a candidate.
+        
+        Args:
+            message: Vote request message
+            
+        Returns:
+            Vote response message
+        """
+        candidate_term = message.get("term", 0)
+        candidate_id = message.get("server_id", "")
+        
+        print(f"Handling vote request from {candidate_id} for term {candidate_term}")
+        
+        with self.vote_lock:
+            # If the candidate's term is higher than ours, update our term
+            if candidate_term > self.current_term:
+                # If we were the primary, step down before the term changes
                 if self.role == ServerRole.PRIMARY:
                     print(f"Stepping down from PRIMARY to BACKUP")
-                    self.role = ServerRole.BACKUP
+                    self._step_down()
                     self.primary_id = None
+                
+                print(f"Updating term from {self.current_term} to {candidate_term}")
+                self.current_term = candidate_term
+                self.voted_for = None
+            
+            # Never elect a candidate missing entries we have, or catch-up would roll them back
+            last_log_index, last_log_term = self.replication_log.get_last()
+            candidate_log = (message.get("last_log_term", 0), message.get("last_log_index", 0))
+            log_ok = candidate_log >= (last_log_term, last_log_index)
             
             # Decide whether to vote for the candidate
             vote_granted = False
-            if candidate_term >= self.current_term and (self.voted_for is None or self.voted_for == candidate_id):
+            if candidate_term >= self.current_term and log_ok and (self.voted_for is None or self.voted_for == candidate_id):
                 print(f"Voting for {candidate_id}")
                 self.voted_for = candidate_id
                 vote_granted = True
             else:
-                print(f"Not voting for {candidate_id} (term={candidate_term}, current_term={self.current_term}, voted_for={self.voted_for})")
+                print(f"Not voting for {candidate_id} (term={candidate_term}, current_term={self.current_term}, voted_for={self.voted_for}, log_ok={log_ok})")
             
             response = {
                 "type": "VOTE_RESPONSE",
@@ -503,8 +1597,8 @@ class ReplicationManager:
             if self.role != ServerRole.CANDIDATE or sender_term > self.current_term:
                 if sender_term > self.current_term:
                     print(f"Updating term from {self.current_term} to {sender_term} due to higher term in vote response")
+                    self._step_down()
                     self.current_term = sender_term
-                    self.role = ServerRole.BACKUP
                     self.voted_for = None
                 return
             
@@ -514,11 +1608,14 @@ class ReplicationManager:
                 self.active_replicas.add(sender_id)
                 
                 # If we have a majority of votes, become the primary
-                if len(self.active_replicas) > len(self.replica_addresses) / 2:
-                    print(f"Received majority of votes ({len(self.active_replicas)}/{len(self.replica_addresses)}), becoming PRIMARY")
+                if self.membership.has_quorum(self.active_replicas):
+                    print(f"Received majority of votes ({sorted(self.active_replicas)} of {len(self.replica_addresses)} servers), becoming PRIMARY")
                     self.role = ServerRole.PRIMARY
                     self.primary_id = self.server_id
                     print(f"Server {self.server_id} elected as PRIMARY for term {self.current_term}")
+                    self._record_failover_event("became_primary", f"term {self.current_term}")
+                    # Announce ourselves immediately rather than at the next heartbeat tick
+                    self._wake_heartbeat()
     
     def _handle_replication(self, message):
         """
@@ -541,31 +1638,22 @@ class ReplicationManager:
                 if sender_term > self.current_term:
                     self.current_term = sender_term
                 
-                # Apply the operation
-                if operation_data:
-                    # Convert operation_data from string back to bytes
-                    operation_bytes = operation_data.encode('utf-8')
-                    
-                    # Log the operation
-                    print(f"Applying operation: {operation_data[:100]}...")
-                    
-                    # Process the operation as if it came from a client
-                    result = self.client_handler(operation_bytes, None, is_replication=True)
-                    
-                    # Log the result
-                    if result:
-                        print(f"Successfully applied operation, result: {result[:100]}...")
-                    else:
-                        print("Operation applied but no result returned")
-                    
-                    # Add to operation log
-                    with self.log_lock:
-                        self.operation_log.append(operation_bytes)
-                    
-                    return True
-                else:
+                if not operation_data:
                     print("Empty operation data received")
                     return False
+                
+                entry = {
+                    "index": message.get("index", self.replication_log.last_index + 1),
+                    "term": sender_term,
+                    "operation": operation_data
+                }
+                self.leader_last_index = max(self.leader_last_index, entry["index"])
+                if self._apply_entry(entry, message.get("prev_log_term")):
+                    return True
+                
+                # We missed entries or our log diverged, fetch them from the primary instead of applying out of order
+                self._request_catch_up()
+                return False
             except Exception as e:
                 print(f"Error applying operation: {e}")
                 import traceback
@@ -575,145 +1663,639 @@ class ReplicationManager:
             print(f"Ignoring replication from {sender_id} (role={self.role}, primary={self.primary_id}, term={sender_term}/{self.current_term})")
             return False
     
+    def _handle_replicated_entries(self, sender_id: str, sender_term: int, entries: List[Dict],
+                                   prev_log_term: Optional[int] = None) -> bool:
+        """
+        Handle a batch of entries from the primary's replication stream.
+        
+        Args:
+            sender_id: Server that sent the batch
+            sender_term: Sender's term
+            entries: Log entries in index order
+            prev_log_term: Term of the primary's entry before the first one, if known
+            
+        Returns:
+            True if all entries are applied, False if they were rejected or did not continue our log
+        """
+        if not (self.role == ServerRole.BACKUP and sender_id == self.primary_id and sender_term >= self.current_term):
+            print(f"Ignoring replication from {sender_id} (role={self.role}, primary={self.primary_id}, term={sender_term}/{self.current_term})")
+            return False
+        if sender_term > self.current_term:
+            self.current_term = sender_term
+        self.leader_last_index = max(self.leader_last_index, entries[-1]["index"])
+        try:
+            if self._apply_entries(entries, prev_log_term):
+                return True
+        except Exception as e:
+            print(f"Error applying entries: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        
+        # We missed entries, diverged or could not apply one; catch-up compares terms and falls back to a snapshot
+        self._request_catch_up()
+        return False
+    
     def _heartbeat_loop(self):
         """Send heartbeats if this server is the primary."""
         while self.running:
-            should_send_heartbeat = False
-            heartbeat_msg = None
-            
-            # Check if we should send heartbeat under lock
-            with self.state_lock:
-                if self.role == ServerRole.PRIMARY:
-                    should_send_heartbeat = True
-                    heartbeat_msg = {
-                        "type": "HEARTBEAT",
-                        "term": self.current_term,
-                        "server_id": self.server_id
-                    }
-            
-            # Send heartbeats outside the lock if needed
-            if should_send_heartbeat and heartbeat_msg:
-                self._send_heartbeats(heartbeat_msg)
+            self._heartbeat_tick()
             
-            # Sleep for a short time
-            time.sleep(0.5)  # 500ms heartbeat interval
+            # Sleep until the next interval, or until a new primary wants to announce itself
+            self.heartbeat_wakeup.wait(self.heartbeat_interval)
+            self.heartbeat_wakeup.clear()
     
-    def _send_heartbeats(self, heartbeat_msg):
-        """Send heartbeats to all other servers."""
-        print(f"Sending heartbeats as PRIMARY for term {heartbeat_msg['term']}")
+    def _heartbeat_tick(self):
+        """
+        Make sure every backup hears from the primary once per heartbeat interval.
         
-        for replica in self.replica_addresses:
-            # Skip self
-            if replica == self.local_address:
-                print(f"Skipping heartbeat to self ({self.local_address})")
-                continue
-                
-            try:
-                print(f"Sending heartbeat to {replica}")
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)  # 1 second timeout
-                sock.connect(replica)
-                sock.sendall(json.dumps(heartbeat_msg).encode('utf-8'))
-                sock.close()
-            except Exception as e:
-                print(f"Error sending heartbeat to {replica}: {e}")
+        Heartbeats go out over the backups' replication streams. A backup that
+        was sent a batch within the last half interval already got the same
+        information with it, so it gets no separate heartbeat.
+        """
+        leader_state = self._leader_state()
+        if leader_state is None:
+            self._stop_peer_replicators()
+            return
+        
+        now = time.time()
+        sent, covered = 0, 0
+        for replica in self.membership.peer_addresses():
+            replicator = self._peer_replicator(replica)
+            if now - replicator.last_sent_at < self.heartbeat_interval / 2:
+                covered += 1
+            else:
+                replicator.send_heartbeat()
+                sent += 1
+            # A backup this far behind would lose acknowledged writes if it won the next election
+            lag_seconds = replicator.stats(self.replication_log.last_index)["lag_seconds"]
+            if lag_seconds is not None and lag_seconds > self.election_timeout_max:
+                print(f"WARNING: Backup {self.membership.server_id_of(replica)} at {replica} is "
+                      f"{self.replication_log.last_index - replicator.match_index} entries / {lag_seconds:.1f}s behind")
+        print(f"Heartbeat tick as PRIMARY for term {leader_state['term']}: {sent} sent, {covered} covered by replication traffic")
+    
+    def _leader_state(self) -> Optional[dict]:
+        """
+        Describe the primary's position, to be carried on every message it sends.
+        
+        Returns:
+            Term, address, commit index and read lease, or None if this server is not the primary
+        """
+        with self.state_lock:
+            if self.role != ServerRole.PRIMARY:
+                return None
+            return {
+                "term": self.current_term,
+                "address": list(self.local_address),
+                "client_address": list(self.client_address) if self.client_address else None,
+                "commit_index": self.commit_index,
+                "lease": self.read_lease_duration
+            }
+    
+    def _build_heartbeat(self) -> Optional[dict]:
+        """
+        Build the heartbeat message to send, if this server is the primary.
+        
+        Returns:
+            Heartbeat message, or None if this server should not send heartbeats
+        """
+        leader_state = self._leader_state()
+        if leader_state is None:
+            return None
+        return dict(leader_state, type="HEARTBEAT", server_id=self.server_id,
+                    last_log_index=self.replication_log.last_index)
+    
+    def _send_heartbeat(self, replica: Tuple[str, int], heartbeat_msg: dict):
+        """
+        Send a standalone heartbeat over a new connection.
+        
+        Used for backups that do not support replication streams.
+        
+        Args:
+            replica: Replication address of the backup
+            heartbeat_msg: Heartbeat message
+        """
+        try:
+            print(f"Sending heartbeat to {replica}")
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.heartbeat_interval)
+            sock.connect(replica)
+            sock.sendall(json.dumps(heartbeat_msg).encode('utf-8'))
+            sock.close()
+        except Exception as e:
+            print(f"Error sending heartbeat to {replica}: {e}")
+    
+    def _update_commit_index(self):
+        """Advance the commit index to the highest entry a majority has stored."""
+        with self.peer_replicators_lock:
+            match_indexes = {self.membership.server_id_of(address): replicator.match_index
+                             for address, replicator in self.peer_replicators.items()}
+        match_indexes[self.server_id] = self.replication_log.last_index
+        
+        for index in sorted(set(match_indexes.values()), reverse=True):
+            if index <= self.commit_index:
+                break
+            stored_by = {server_id for server_id, match_index in match_indexes.items() if match_index >= index}
+            if self.membership.has_quorum(stored_by):
+                self.commit_index = index
+                break
+    
+    def _wake_heartbeat(self):
+        """Send the next heartbeat immediately."""
+        self.heartbeat_wakeup.set()
+        if self.async_engine:
+            self.async_engine.wake_heartbeat()
+    
+    def _random_election_timeout(self) -> float:
+        """Draw a randomized election timeout."""
+        return random.uniform(self.election_timeout_min, self.election_timeout_max)
     
     def _election_timeout_loop(self):
         """Check for election timeout and start election if needed."""
         while self.running:
-            timeout = random.uniform(1.5, 3.0)
-            time.sleep(timeout)
-            
-            should_start_election = False
-            with self.state_lock:
-                # Start election if we're BACKUP with no heartbeat OR if we're a CANDIDATE that hasn't won yet
-                if self.role == ServerRole.BACKUP:
-                    print(f"Server {self.server_id} considering election (current term: {self.current_term})")
-                    print(f"Current replica_addresses: {self.replica_addresses}")
-                    print(f"Current primary_id: {self.primary_id}")
-                    
-                    # Check if we've received a heartbeat recently (within random timeout)
-                    current_time = time.time()
-                    heartbeat_timeout = random.uniform(1.5, 3.0)  # Random timeout between 1.5 and 3 seconds
-                    if current_time - self.last_heartbeat_time > heartbeat_timeout:
-                        print(f"No heartbeat received for {current_time - self.last_heartbeat_time:.1f} seconds (timeout: {heartbeat_timeout:.1f}s), clearing primary")
-                        self._remove_dead_primary()
-                        self.primary_id = None
-                        should_start_election = True
-                    elif self.primary_id is None:
-                        print("No primary known, will start election")
-                        should_start_election = True
-                    else:
-                        print(f"Have primary {self.primary_id}, skipping election")
-                elif self.role == ServerRole.CANDIDATE:
-                    # If we've been CANDIDATE too long, assume we are primary
-                    current_time = time.time()
-                    if current_time - self.last_heartbeat_time > timeout:
-                        print(f"Election timed out after {current_time - self.last_heartbeat_time:.1f} seconds, starting new election")
-                        self.role = ServerRole.PRIMARY
-                else:
-                    print(f"Not starting election - current role is {self.role}")
+            timeout = self._random_election_timeout()
+            # Poll well within the timeout so a missed heartbeat is noticed promptly
+            self.election_wakeup.wait(min(timeout, self.heartbeat_interval))
+            self.election_wakeup.clear()
             
             # Start election outside the lock if needed
-            if should_start_election:
+            if self._check_election_timeout(timeout):
                 print(f"Starting election outside lock")
                 self._start_election()
-            else:
-                time.sleep(1)  # Sleep outside the lock
+    
+    def _check_election_timeout(self, timeout: float) -> bool:
+        """
+        Decide whether this server should start an election.
+        
+        Args:
+            timeout: Election timeout drawn for this round, in seconds
+            
+        Returns:
+            True if an election should be started
+        """
+        with self.state_lock:
+            # Start election if we're BACKUP with no heartbeat OR if we're a CANDIDATE that hasn't won yet
+            if self.role == ServerRole.BACKUP:
+                # Check if we've received a heartbeat recently (within random timeout)
+                elapsed = time.time() - self.last_heartbeat_time
+                if not self.membership.is_member(self.server_id):
+                    # Only members may elect a primary; ask to be added back instead
+                    if elapsed > timeout and not self.removed_from_cluster:
+                        print(f"Server {self.server_id} is not a member yet, joining again")
+                        self.last_heartbeat_time = time.time()
+                        threading.Thread(target=self._join_cluster, daemon=True).start()
+                    return False
+                if elapsed > timeout:
+                    print(f"No heartbeat received for {elapsed:.2f} seconds (timeout: {timeout:.2f}s), clearing primary")
+                    self._record_failover_event("leader_suspected", f"no heartbeat for {elapsed:.2f}s")
+                    self._remove_dead_primary()
+                    self.primary_id = None
+                    return True
+                elif self.primary_id is None and time.time() - self.election_started_at > timeout:
+                    # Retry at most once per timeout so a lost pre-vote is not repeated in a tight loop
+                    print("No primary known, will start election")
+                    return True
+            elif self.role == ServerRole.CANDIDATE:
+                # An election that hasn't been decided within the timeout is retried
+                elapsed = time.time() - self.election_started_at
+                if elapsed > timeout:
+                    print(f"Election timed out after {elapsed:.2f} seconds, starting new election")
+                    self.role = ServerRole.BACKUP
+                    return True
+        return False
+    
+    def _trigger_election(self, suspected_primary: Optional[str], reason: str):
+        """
+        Start an election right away because the primary looks dead.
+        
+        Args:
+            suspected_primary: Server ID of the primary that could not be reached
+            reason: Why the primary is suspected, for the failover timeline
+        """
+        with self.state_lock:
+            if self.role == ServerRole.PRIMARY or self.primary_id != suspected_primary:
+                # Someone already replaced the primary
+                return
+            self._record_failover_event("leader_suspected", reason)
+            self.primary_id = None
+            self.suspected_primary = suspected_primary
+        self.election_wakeup.set()
+        if self.async_engine:
+            self.async_engine.wake_election()
     
     def _start_election(self):
-        """Start a leader election."""
+        """Start a leader election, after a pre-vote round shows we could win it."""
+        pre_vote_request = self._prepare_pre_vote()
+        if pre_vote_request is None:
+            return
+        
+        responses = []
+        for replica in self.replica_addresses:
+            # Skip self
+            if replica == self.local_address:
+                continue
+            try:
+                response = self._send_request(replica, pre_vote_request, self.election_timeout_min / 2)
+                if response:
+                    responses.append(response)
+            except Exception as e:
+                print(f"Error requesting pre-vote from {replica}: {e}")
+        
+        if not self._pre_vote_succeeded(responses):
+            return
+        
+        vote_request = self._prepare_election()
+        if vote_request is None:
+            return
+        self._request_votes(vote_request)
+    
+    def _request_votes(self, vote_request: dict):
+        """
+        Ask every other server for its vote and count the answers.
+        
+        Args:
+            vote_request: REQUEST_VOTE message for the term we are a candidate in
+        """
+        for replica in self.replica_addresses:
+            # Skip self
+            if replica == self.local_address:
+                continue
+                
+            try:
+                print(f"Requesting vote from {replica}")
+                response = self._send_request(replica, vote_request, self.election_timeout_min / 2)
+                if response:
+                    print(f"Received vote response from {replica}: {response}")
+                    self._handle_vote_response(response)
+            except Exception as e:
+                print(f"Error requesting vote from {replica}: {e}")
+    
+    def _send_request(self, replica: Tuple[str, int], request: dict, timeout: float) -> Optional[dict]:
+        """
+        Send a request to a replica and wait for its answer.
+        
+        Args:
+            replica: Replica address
+            request: Message to send
+            timeout: Seconds to wait for connecting and for the answer
+            
+        Returns:
+            The decoded response, or None if the replica did not answer
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(replica)
+            sock.sendall(json.dumps(request).encode('utf-8'))
+            response_data = self._recv_json(sock, timeout=timeout)
+            if response_data:
+                return json.loads(response_data.decode('utf-8'))
+            return None
+        finally:
+            sock.close()
+    
+    def _prepare_pre_vote(self) -> Optional[dict]:
+        """
+        Build a pre-vote request for the next term without changing any state.
+        
+        A pre-vote asks the other servers whether they would vote for us, so a
+        server that was partitioned or restarted does not bump the term and
+        depose a healthy primary.
+        
+        Returns:
+            The PRE_VOTE request, or None if no election is needed
+        """
+        with self.state_lock:
+            if self.role == ServerRole.PRIMARY or self.primary_id is not None:
+                return None
+            if not self.membership.is_member(self.server_id):
+                print(f"Server {self.server_id} is not a member of the cluster, not starting an election")
+                return None
+            self.election_started_at = time.time()
+            last_log_index, last_log_term = self.replication_log.get_last()
+            self._record_failover_event("pre_vote_started", f"term {self.current_term + 1}")
+            return {
+                "type": "PRE_VOTE",
+                "term": self.current_term + 1,
+                "server_id": self.server_id,
+                "last_log_index": last_log_index,
+                "last_log_term": last_log_term,
+                "suspected_primary": self.suspected_primary
+            }
+    
+    def _pre_vote_succeeded(self, responses: List[dict]) -> bool:
+        """
+        Count pre-vote responses.
+        
+        Args:
+            responses: PRE_VOTE_RESPONSE messages received
+            
+        Returns:
+            True if a majority (including ourselves) would vote for us
+        """
+        granted = {self.server_id} | {response.get("server_id") for response in responses
+                                      if response.get("vote_granted")}
+        won = self.membership.has_quorum(granted)
+        with self.state_lock:
+            for response in responses:
+                if response.get("term", 0) > self.current_term:
+                    self.current_term = response["term"]
+                    self.voted_for = None
+        self._record_failover_event("pre_vote_won" if won else "pre_vote_lost",
+                                    f"{len(granted)}/{len(self.replica_addresses)}")
+        return won
+    
+    def _handle_pre_vote(self, message) -> dict:
+        """
+        Answer a pre-vote request without changing our term or vote.
+        
+        The vote is refused while we still hear from a primary. If the
+        candidate reports that the primary is unreachable and we have also
+        missed two heartbeats from it, we agree right away instead of waiting
+        for our own election timeout.
+        
+        Args:
+            message: PRE_VOTE message
+            
+        Returns:
+            PRE_VOTE_RESPONSE message
+        """
+        candidate_id = message.get("server_id", "")
+        proposed_term = message.get("term", 0)
+        with self.state_lock:
+            last_log_index, last_log_term = self.replication_log.get_last()
+            candidate_log = (message.get("last_log_term", 0), message.get("last_log_index", 0))
+            log_ok = candidate_log >= (last_log_term, last_log_index)
+            
+            since_heartbeat = time.time() - self.last_heartbeat_time
+            if self.role == ServerRole.PRIMARY:
+                leader_alive = True
+            elif self.primary_id is None:
+                leader_alive = False
+            elif message.get("suspected_primary") == self.primary_id:
+                leader_alive = since_heartbeat < 2 * self.heartbeat_interval
+            else:
+                leader_alive = since_heartbeat < self.election_timeout_min
+            
+            vote_granted = proposed_term > self.current_term and log_ok and not leader_alive
+            print(f"Pre-vote for {candidate_id} term {proposed_term}: granted={vote_granted} (log_ok={log_ok}, leader_alive={leader_alive})")
+            return {
+                "type": "PRE_VOTE_RESPONSE",
+                "term": self.current_term,
+                "server_id": self.server_id,
+                "vote_granted": vote_granted
+            }
+    
+    def _prepare_election(self) -> Optional[dict]:
+        """
+        Become a candidate for the next term.
+        
+        Returns:
+            The vote request to send to all other servers, or None if no election is needed
+        """
         with self.state_lock:
             # Don't start election if we're already PRIMARY
             if self.role == ServerRole.PRIMARY:
                 print(f"Skipping election start - already PRIMARY")
-                return
+                return None
                 
             # Don't start election if we already know about a valid primary
             if self.primary_id is not None:
                 print(f"Skipping election start - already have primary {self.primary_id}")
-                return
+                return None
                 
             print(f"Starting election process for server {self.server_id}")
+            return self._become_candidate()
+    
+    def _become_candidate(self) -> dict:
+        """
+        Move to the next term as a candidate that votes for itself. Called with state_lock held.
+        
+        Returns:
+            The vote request to send to all other servers
+        """
+        # Increment term and vote for self
+        self.current_term += 1
+        self.voted_for = self.server_id
+        self.role = ServerRole.CANDIDATE
+        self.active_replicas = {self.server_id}  # Vote for self
+        self.primary_id = None  # Clear primary_id since we're starting an election
+        self.election_started_at = time.time()
+        
+        print(f"Server {self.server_id} starting election for term {self.current_term}")
+        self._record_failover_event("election_started", f"term {self.current_term}")
+        
+        last_log_index, last_log_term = self.replication_log.get_last()
+        return {
+            "type": "REQUEST_VOTE",
+            "term": self.current_term,
+            "server_id": self.server_id,
+            "last_log_index": last_log_index,
+            "last_log_term": last_log_term
+        }
+    
+    def transfer_leadership(self, target_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Hand leadership to a backup, so a planned restart does not wait out an election timeout.
+        
+        New writes are held back while the transfer runs. Once the running
+        writes are logged and the target has stored the whole log, it is told
+        to start an election right away (TIMEOUT_NOW), and its higher term
+        makes this server step down. The held back writes are then forwarded
+        to the new primary, and this method returns once they are answered.
+        
+        Args:
+            target_id: Backup to hand over to, by default the one that has stored the most of our log
+            timeout: Seconds the transfer may take, by default the maximum election timeout
+            
+        Returns:
+            True if this server stepped down, False if there was nothing to hand
+            over or the transfer was abandoned and this server is still the primary
+        """
+        deadline = time.time() + (timeout if timeout is not None else self.election_timeout_max)
+        with self.state_lock:
+            if self.role != ServerRole.PRIMARY:
+                return False
+            term = self.current_term
+        target_id = target_id or self._choose_transfer_target()
+        target_address = self.membership.address_of(target_id) if target_id else None
+        if target_address is None:
+            print(f"No backup to transfer leadership to")
+            return False
+        
+        print(f"Transferring leadership of term {term} to {target_id}")
+        self._record_failover_event("transfer_started", f"to {target_id}")
+        self.leadership_transfer_done.clear()
+        try:
+            # Writes that got past the check finish and are logged first
+            with self.write_condition:
+                while self.active_writes > 0 and time.time() < deadline:
+                    self.write_condition.wait(deadline - time.time())
+            last_index = self.replication_log.last_index
             
-            # Increment term and vote for self
-            self.current_term += 1
-            self.voted_for = self.server_id
-            self.role = ServerRole.CANDIDATE
-            self.active_replicas = {self.server_id}  # Vote for self
-            self.primary_id = None  # Clear primary_id since we're starting an election
+            replicator = self._peer_replicator(target_address)
+            accepted = False
+            while not accepted and self.running and time.time() < deadline:
+                # A backup without replication streams does not report its progress; it checks itself
+                if replicator.match_index >= last_index or time.time() < replicator.legacy_until:
+                    try:
+                        response = self._send_request(target_address, {
+                            "type": "TIMEOUT_NOW",
+                            "term": term,
+                            "server_id": self.server_id,
+                            "last_log_index": last_index
+                        }, self.election_timeout_min / 2)
+                        accepted = bool(response and response.get("accepted"))
+                    except Exception as e:
+                        print(f"Error sending TIMEOUT_NOW to {target_id}: {e}")
+                    if not accepted:
+                        time.sleep(self.heartbeat_interval / 5)
+                else:
+                    if replicator.queue.empty():
+                        replicator.send_heartbeat()  # Its acknowledgment reports the backup's log
+                    time.sleep(0.01)
             
-            print(f"Server {self.server_id} starting election for term {self.current_term}")
+            if not accepted:
+                print(f"Leadership transfer to {target_id} abandoned, staying PRIMARY for term {term}")
+                self._record_failover_event("transfer_abandoned", f"to {target_id}")
+                return False
+            
+            # The target's vote request makes us step down, its first heartbeat names it primary
+            while self.role == ServerRole.PRIMARY and time.time() < deadline:
+                time.sleep(0.01)
+            with self.state_lock:
+                if self.role == ServerRole.PRIMARY:
+                    return False
+                self.last_heartbeat_time = time.time()  # Give the new primary time to announce itself
+            self._wait_for_primary(max(0, deadline - time.time()))
+            print(f"Leadership transferred from {self.server_id} to {self.primary_id}")
+            return True
+        finally:
+            self.leadership_transfer_done.set()
+            # Held writes go to the new primary through us; wait for them before the caller shuts down
+            drain_deadline = time.time() + self.election_timeout_max
+            with self.write_condition:
+                while self.held_writes > 0 and time.time() < drain_deadline:
+                    self.write_condition.wait(drain_deadline - time.time())
+    
+    def _choose_transfer_target(self) -> Optional[str]:
+        """
+        Pick the backup to hand leadership to.
         
-        # Send vote requests to all other servers
-        vote_request = {
-            "type": "REQUEST_VOTE",
+        Returns:
+            Server ID of the voting member that has stored the most of our log, or None if there is none
+        """
+        with self.peer_replicators_lock:
+            match_indexes = {self.membership.server_id_of(address): replicator.match_index
+                             for address, replicator in self.peer_replicators.items()}
+        candidates = [self.membership.server_id_of(address) for address in self.membership.peer_addresses()]
+        candidates = [server_id for server_id in candidates if server_id and self.membership.is_member(server_id)]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda server_id: match_indexes.get(server_id, 0))
+    
+    def _handle_timeout_now(self, message) -> dict:
+        """
+        Start an election right away because the primary is handing leadership to us.
+        
+        Only the current primary may ask, and only once our log has
+        everything it logged, so the election can be won and loses nothing.
+        The pre-vote round is skipped: the other servers still hear from the
+        primary and would refuse it.
+        
+        Args:
+            message: TIMEOUT_NOW message
+            
+        Returns:
+            TIMEOUT_NOW_RESPONSE message
+        """
+        sender_id = message.get("server_id", "")
+        vote_request = None
+        with self.state_lock:
+            last_index = self.replication_log.last_index
+            accepted = (self.role == ServerRole.BACKUP and sender_id == self.primary_id
+                        and message.get("term", 0) == self.current_term
+                        and last_index >= message.get("last_log_index", 0)
+                        and self.membership.is_member(self.server_id))
+            print(f"TIMEOUT_NOW from {sender_id}: accepted={accepted} (our last index {last_index}, theirs {message.get('last_log_index', 0)})")
+            if accepted:
+                self._record_failover_event("transfer_requested", f"by {sender_id}")
+                # Same lock as the check, so a heartbeat in between cannot bring the old primary back
+                vote_request = self._become_candidate()
+        if vote_request is not None:
+            threading.Thread(target=self._request_votes, args=(vote_request,), daemon=True).start()
+        return {
+            "type": "TIMEOUT_NOW_RESPONSE",
             "term": self.current_term,
-            "server_id": self.server_id
+            "server_id": self.server_id,
+            "accepted": accepted,
+            "last_log_index": last_index
         }
+    
+    def _record_failover_event(self, event: str, detail: str = ""):
+        """
+        Add an event to the failover timeline.
         
-        for replica in self.replica_addresses:
-            # Skip self
-            if replica == self.local_address:
-                continue
-                
-            try:
-                print(f"Requesting vote from {replica}")
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)  # 1 second timeout
-                sock.connect(replica)
-                sock.sendall(json.dumps(vote_request).encode('utf-8'))
-                
-                # Wait for response
-                response_data = sock.recv(4096)
-                if response_data:
-                    response = json.loads(response_data.decode('utf-8'))
-                    print(f"Received vote response from {replica}: {response}")
-                    self._handle_vote_response(response)
-                
-                sock.close()
-            except Exception as e:
-                print(f"Error requesting vote from {replica}: {e}")
+        A failover starts when the primary is suspected and ends when this
+        server becomes primary or learns about the new one; its duration is
+        printed so failover latency can be measured from the logs.
+        
+        Args:
+            event: Event name
+            detail: Human readable detail
+        """
+        now = time.time()
+        if event in ["leader_suspected", "transfer_requested"] and self.failover_started_at is None:
+            self.failover_started_at = now
+        self.failover_timeline.append((now, event, detail))
+        
+        if self.failover_started_at is None:
+            return
+        elapsed_ms = (now - self.failover_started_at) * 1000
+        print(f"Failover timeline [{self.server_id}] +{elapsed_ms:.0f}ms {event} {detail}")
+        if event in ["became_primary", "new_primary_learned"]:
+            print(f"Failover completed on {self.server_id} in {elapsed_ms:.0f}ms")
+            self.failover_started_at = None
+            self.suspected_primary = None
+    
+    def get_replication_stats(self) -> dict:
+        """
+        Report this server's replication state, for the REPLICATION_STATS command.
+        
+        On the primary this includes the health of every backup's stream; on a
+        backup, how far it is behind the primary as far as it knows.
+        
+        Returns:
+            JSON-serializable statistics
+        """
+        with self.state_lock:
+            role, term, primary_id = self.role, self.current_term, self.primary_id
+        now = time.time()
+        last_index = self.replication_log.last_index
+        stats = {
+            "server_id": self.server_id,
+            "role": role.value,
+            "term": term,
+            "primary_id": primary_id,
+            "last_log_index": last_index,
+            "commit_index": self.commit_index
+        }
+        if role == ServerRole.PRIMARY:
+            with self.peer_replicators_lock:
+                replicators = list(self.peer_replicators.items())
+            stats["followers"] = {self.membership.server_id_of(address) or f"{address[0]}:{address[1]}":
+                                  replicator.stats(last_index) for address, replicator in replicators}
+        else:
+            stats["leader_last_index"] = self.leader_last_index
+            stats["lag_entries"] = max(0, self.leader_last_index - last_index)
+            stats["last_heartbeat_age"] = round(now - self.last_heartbeat_time, 3) if self.last_heartbeat_time else None
+            stats["read_lease_valid"] = now < self.read_lease_expires_at
+        return stats
+    
+    def get_failover_timeline(self) -> List[dict]:
+        """Return the recorded failover events, oldest first."""
+        return [{"time": timestamp, "event": event, "detail": detail}
+                for timestamp, event, detail in list(self.failover_timeline)]
     
     def _get_server_id_from_address(self, given_address: Tuple[str, int]) -> str:
         """
@@ -725,17 +2307,7 @@ class ReplicationManager:
         Returns:
             Server ID string
         """
-        # Map ports to server IDs regardless of host
-        # This allows for both localhost and IP address connections
-        PORT_TO_SERVER_ID = {
-            8081: "replica1",
-            8082: "replica2",
-            8083: "replica3"
-        }
-        
-        # Get server ID based on port number
-        _, port = given_address
-        return PORT_TO_SERVER_ID.get(port, None)
+        return self.membership.server_id_of(given_address)
         
     def is_primary(self) -> bool:
         """Check if this server is the primary."""
@@ -743,6 +2315,91 @@ class ReplicationManager:
         print(f"ReplicationManager.is_primary: Checking if primary - Role: {self.role}, Result: {is_primary}")
         return is_primary
             
+    def get_primary_client_address(self) -> Optional[Tuple[str, int]]:
+        """
+        Get the address clients should send requests to, if it is not this server.
+        
+        Returns:
+            The primary's client-facing (host, port), or None if this server is the
+            primary or the primary has not advertised one yet
+        """
+        if self.role == ServerRole.PRIMARY:
+            return None
+        primary_id, address = self.primary_client_address
+        if primary_id is None or primary_id != self.primary_id:
+            return None
+        return address
+    
+    def can_read_locally(self, data: bytes) -> bool:
+        """
+        Check whether a read may be answered from this server's own state right now.
+        
+        Args:
+            data: Operation data
+            
+        Returns:
+            True on the primary, and on a backup within its read lease
+        """
+        return self.role == ServerRole.PRIMARY or self._can_serve_read_locally(data)
+    
+    def notify_primary(self, username: str, notification: bytes) -> bool:
+        """
+        Pass a live message on to this group's primary, which holds the sessions of its users.
+        
+        Args:
+            username: User the message is for
+            notification: Message to push to the user's session
+            
+        Returns:
+            True if the primary queued it on a session of the user
+        """
+        primary = self.get_primary()
+        if primary is None or self.role == ServerRole.PRIMARY:
+            return False
+        request = {
+            "type": "NOTIFY",
+            "server_id": self.server_id,
+            "username": username,
+            "notification": notification.decode('utf-8')
+        }
+        response = self._send_request(primary, request, self.election_timeout_min)
+        return bool(response and response.get("delivered"))
+    
+    def _handle_notify(self, message) -> dict:
+        """
+        Push a live message passed on by another server to the session of its user.
+        
+        Args:
+            message: NOTIFY message
+            
+        Returns:
+            NOTIFY_RESPONSE message saying whether it was queued
+        """
+        username = message.get("username", "")
+        delivered = False
+        if self.role == ServerRole.PRIMARY and self.notify_handler is not None:
+            delivered = bool(self.notify_handler(username, message.get("notification", "").encode('utf-8')))
+        print(f"Notification for {username} from {message.get('server_id')}: delivered={delivered}")
+        return {"type": "NOTIFY_RESPONSE", "server_id": self.server_id, "delivered": delivered}
+    
+    def add_primary_hint(self, response: bytes) -> bytes:
+        """
+        Tell a client connected to a backup where the primary is.
+        
+        The hint is added as a "primary" field of the response's first JSON
+        message, so clients that do not know it simply ignore it.
+        
+        Args:
+            response: Response bytes for the client
+            
+        Returns:
+            The response, with the hint if this server knows a primary other than itself
+        """
+        address = self.get_primary_client_address()
+        if not address or not response:
+            return response
+        return add_field(response, "primary", list(address)) or response
+    
     def get_primary(self) -> Optional[Tuple[str, int]]:
         """Get the address of the primary server."""
         # If we are the primary, return our own address
@@ -754,38 +2411,286 @@ class ReplicationManager:
         if self.primary_id:
             print(f"ReplicationManager.get_primary: Primary ID is {self.primary_id}")
             # Find the primary's address
-            for replica in self.replica_addresses:
-                server_id = self._get_server_id_from_address(replica)
-                print(f"ReplicationManager.get_primary: Checking replica {replica} with ID {server_id}")
-                if server_id == self.primary_id:
-                    print(f"ReplicationManager.get_primary: Found primary address {replica}")
-                    return replica
+            primary_address = self.membership.address_of(self.primary_id)
+            if primary_address is not None:
+                print(f"ReplicationManager.get_primary: Found primary address {primary_address}")
+                return primary_address
         print("ReplicationManager.get_primary: No primary found")
         return None
     
     def _remove_dead_primary(self):
-        """Remove the dead primary from replica_addresses if we know who it was."""
-        # Remove dead primary from replica_addresses if we know who it was
-        if self.primary_id:
-            print(f"Attempting to remove dead primary {self.primary_id} from replica_addresses")
-            dead_primary = None
-            # Extract replica number from primary_id (e.g., "replica1" -> "1")
-            primary_number = self.primary_id.replace("replica", "")
-            print(f"Looking for replica number: {primary_number}")
-            
-            for replica in self.replica_addresses:
-                # Extract replica number from address (e.g., "localhost:8081" -> "1")
-                replica_number = str(replica[1] - 8080)  # Convert port to replica number
-                print(f"Checking replica {replica} -> number: {replica_number}")
-                if replica_number == primary_number:
-                    dead_primary = replica
-                    print(f"Found dead primary at {replica}")
-                    break
-            if dead_primary:
-                print(f"Removing dead primary {dead_primary} from replica_addresses")
-                self.replica_addresses.remove(dead_primary)
-                print(f"Updated replica_addresses: {self.replica_addresses}")
+        """
+        Remove the dead primary from this server's membership view if we know who it was.
+        
+        The server is added back when it joins again or sends us a heartbeat.
+        """
+        if self.primary_id and self.primary_id != self.server_id:
+            print(f"Attempting to remove dead primary {self.primary_id} from the membership")
+            if self.membership.remove(self.primary_id):
+                print(f"Removed dead primary {self.primary_id}, replica addresses now: {self.replica_addresses}")
             else:
-                print(f"Could not find dead primary {self.primary_id} in replica_addresses")
+                print(f"Could not find dead primary {self.primary_id} in the membership")
         else:
             print(f"No primary_id so no dead primary to remove")
+    
+    def _join_cluster(self):
+        """
+        Introduce this server to the servers it knows the addresses of.
+        
+        Every server that answers reports its ID, which fills in the registry.
+        If one of them knows the primary, this server takes over the cluster
+        configuration, follows that primary and asks it to be added as a member.
+        """
+        join_request = {
+            "type": "JOIN",
+            "server_id": self.server_id,
+            "address": list(self.local_address),
+            "term": self.current_term
+        }
+        responses = []
+        for replica in self.membership.peer_addresses():
+            try:
+                response = self._send_request(replica, join_request, timeout=self.election_timeout_min / 2)
+                if response and response.get("type") == "JOIN_RESPONSE":
+                    responses.append(response)
+            except Exception as e:
+                print(f"Could not join through {replica}: {e}")
+        
+        led = [response for response in responses
+               if response.get("primary_id") not in [None, self.server_id] and response.get("config")]
+        if not led:
+            # Nobody knows a primary yet, the cluster is still forming
+            for response in responses:
+                self.membership.register(response["server_id"], response["address"])
+            print(f"Joined cluster without a primary, members: {sorted(self.membership.current_members())}")
+            return
+        
+        # Follow whoever knows the most recent primary
+        best = max(led, key=lambda response: response.get("term", 0))
+        primary_id = best["primary_id"]
+        self.membership.apply_config(best["config"])
+        if best.get("primary_address") and self.membership.address_of(primary_id) is None:
+            self.membership.register(primary_id, best["primary_address"])
+        
+        with self.state_lock:
+            if best.get("term", 0) >= self.current_term and self.role != ServerRole.PRIMARY:
+                self.current_term = best.get("term", 0)
+                self.role = ServerRole.BACKUP
+                self.primary_id = primary_id
+                self.last_heartbeat_time = time.time()
+        print(f"Joined cluster with primary {primary_id} for term {best.get('term')}")
+        
+        # The primary adds us when it receives our JOIN; ask it directly if we went through a backup
+        primary_address = self.membership.address_of(primary_id)
+        if best["server_id"] != primary_id and primary_address is not None:
+            try:
+                self._send_request(primary_address, join_request, timeout=self.election_timeout_min / 2)
+            except Exception as e:
+                print(f"Could not send JOIN to primary {primary_id}: {e}")
+    
+    def _handle_join(self, message) -> dict:
+        """
+        Handle a JOIN from a server that is starting up or coming back.
+        
+        The primary adds unknown servers, or servers whose address changed,
+        through a configuration change. While there is no primary yet, the
+        joining server is simply registered.
+        
+        Args:
+            message: JOIN message
+            
+        Returns:
+            JOIN_RESPONSE with our ID, the primary and the cluster configuration
+        """
+        joiner_id = message.get("server_id", "")
+        joiner_address = tuple(message.get("address", []))
+        print(f"Handling JOIN from {joiner_id} at {joiner_address}")
+        
+        snapshot = self._role_snapshot()
+        if snapshot.role == ServerRole.PRIMARY:
+            if self.membership.current_members().get(joiner_id) != joiner_address:
+                threading.Thread(target=self.add_member, args=(joiner_id, joiner_address), daemon=True).start()
+        elif snapshot.primary_id is None:
+            self.membership.register(joiner_id, joiner_address)
+        
+        primary_address = self.get_primary() if snapshot.primary_id is not None else None
+        return {
+            "type": "JOIN_RESPONSE",
+            "server_id": self.server_id,
+            "address": list(self.local_address),
+            "term": snapshot.term,
+            "primary_id": snapshot.primary_id,
+            "primary_address": list(primary_address) if primary_address else None,
+            "config": self.membership.to_config() if snapshot.primary_id is not None else None
+        }
+    
+    def _handle_membership_change(self, message) -> dict:
+        """
+        Handle an operator request to add or remove a server.
+        
+        Backups forward the request to the primary.
+        
+        Args:
+            message: MEMBERSHIP_CHANGE message with action ("add" or "remove"),
+                server_id and, for "add", address
+            
+        Returns:
+            MEMBERSHIP_CHANGE_RESPONSE message
+        """
+        action = message.get("action")
+        server_id = message.get("server_id", "")
+        print(f"Handling membership change: {action} {server_id}")
+        
+        if not self.is_primary():
+            primary_address = self.get_primary()
+            if primary_address is None:
+                return {"type": "MEMBERSHIP_CHANGE_RESPONSE", "success": False, "error": "No primary server available"}
+            return self._send_request(primary_address, message, timeout=4 * self.election_timeout_max)
+        
+        if action == "add" and message.get("address"):
+            success = self.add_member(server_id, tuple(message["address"]))
+        elif action == "remove":
+            success = self.remove_member(server_id)
+        else:
+            return {"type": "MEMBERSHIP_CHANGE_RESPONSE", "success": False, "error": f"Unknown action {action}"}
+        return {
+            "type": "MEMBERSHIP_CHANGE_RESPONSE",
+            "success": success,
+            "members": self.membership.to_config()["members"]
+        }
+    
+    def add_member(self, server_id: str, address: Tuple[str, int]) -> bool:
+        """
+        Add a server to the cluster, or move a member to a new address.
+        
+        Args:
+            server_id: Server ID
+            address: Replication address of the server
+            
+        Returns:
+            True if the new configuration was committed
+        """
+        with self.membership_change_lock:
+            new_members = self.membership.current_members()
+            if new_members.get(server_id) == tuple(address) and not self.membership.is_changing():
+                return True
+            new_members[server_id] = tuple(address)
+            return self._change_membership(new_members, f"add {server_id} at {address}")
+    
+    def remove_member(self, server_id: str) -> bool:
+        """
+        Remove a server from the cluster.
+        
+        Args:
+            server_id: Server ID
+            
+        Returns:
+            True if the new configuration was committed
+        """
+        with self.membership_change_lock:
+            new_members = self.membership.current_members()
+            if server_id not in new_members and not self.membership.is_changing():
+                return True
+            new_members.pop(server_id, None)
+            return self._change_membership(new_members, f"remove {server_id}")
+    
+    def _change_membership(self, new_members: Dict[str, Tuple[str, int]], description: str) -> bool:
+        """
+        Move the cluster to a new set of members through a joint configuration.
+        
+        The joint configuration (old and new members) is appended to the log
+        and used right away. Once a majority of both the old and the new
+        members stored it, the new configuration alone is appended. Elections
+        in between need both majorities, so the old and the new members can
+        never each elect a primary of their own. Must be called with
+        membership_change_lock held.
+        
+        Args:
+            new_members: Complete new member map
+            description: What is being changed, for the log output
+            
+        Returns:
+            True if the new configuration was committed
+        """
+        if not self.is_primary():
+            print(f"Cannot {description}: not the primary")
+            return False
+        
+        print(f"Membership change: {description}")
+        joint = self.membership.joint_config(new_members)
+        if not self._commit_config(joint):
+            print(f"Membership change stalled in the joint configuration: {description}")
+            return False
+        if not self._commit_config({"members": joint["members"], "old_members": None}):
+            print(f"New configuration not committed: {description}")
+            return False
+        print(f"Membership change complete: {description}, members: {sorted(new_members)}")
+        
+        # A primary that removed itself hands over to the remaining members
+        if not self.membership.is_member(self.server_id):
+            with self.state_lock:
+                print(f"Server {self.server_id} removed itself from the cluster, stepping down")
+                self._step_down()
+                self.primary_id = None
+                self.removed_from_cluster = True
+        return True
+    
+    def _commit_config(self, config: Dict) -> bool:
+        """
+        Append a configuration to the log, use it, and replicate it to a majority.
+        
+        Args:
+            config: Configuration to commit
+            
+        Returns:
+            True if a majority acknowledged the configuration
+        """
+        with self.state_lock:
+            if self.role != ServerRole.PRIMARY:
+                return False
+            term = self.current_term
+        
+        operation = dict(config, type="CONFIG")
+        if not self._begin_write(term):
+            return False
+        try:
+            entry = self.replication_log.append(term, json.dumps(operation))
+            self._apply_config(config)
+        finally:
+            self._end_write()
+        return self._replicate_to_quorum(entry)
+    
+    def _apply_config(self, config: Dict):
+        """
+        Switch to a cluster configuration and note whether it removed this server.
+        
+        Args:
+            config: Configuration from the log or a snapshot
+        """
+        was_member = self.membership.is_member(self.server_id)
+        self.membership.apply_config(config)
+        if self.membership.is_member(self.server_id):
+            self.removed_from_cluster = False
+        elif was_member:
+            print(f"Server {self.server_id} was removed from the cluster")
+            self.removed_from_cluster = True
+    
+    def _config_from_operation(self, operation_data: str) -> Optional[Dict]:
+        """
+        Decode a configuration entry.
+        
+        Args:
+            operation_data: Operation stored in a log entry
+            
+        Returns:
+            The configuration, or None if the entry is a client operation
+        """
+        if '"CONFIG"' not in operation_data:
+            return None
+        try:
+            operation = json.loads(operation_data)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(operation, dict) or operation.get("type") != "CONFIG":
+            return None
+        return operation
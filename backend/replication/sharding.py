@@ -0,0 +1,221 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from backend.protocol.batch import parse_batch
+
+
+def shard_of(username: str, shard_count: int) -> int:
+    """
+    Find the shard that owns a username.
+
+    The 32-bit hash space is split into shard_count equal ranges, and a user
+    belongs to the range its hash falls in.
+
+    Args:
+        username: Username
+        shard_count: Number of shards
+
+    Returns:
+        Shard index from 0 to shard_count - 1
+    """
+    digest = hashlib.md5(username.encode('utf-8')).digest()
+    return (int.from_bytes(digest[:4], 'big') * shard_count) >> 32
+
+
+class ShardRouter:
+    """
+    Routes client requests to the replication group that owns them.
+
+    Every shard is a separate replication group with its own primary, log
+    and storage, and owns a hash range of usernames. Requests about one user
+    (register, login, stats, view count, log off) go to that user's shard. A
+    message is stored on the sender's shard only, so sending is a write to a
+    single group and deleting it goes to the same group. As a consequence:
+
+    - GM collects a user's conversations from every shard, since messages
+      they received live on the senders' shards.
+    - G lists the users of every shard.
+    - U deletes the user and the messages they sent on their own shard
+      first. Once that succeeded, the messages they received are removed from
+      the other shards; that cleanup is not atomic with the deletion.
+
+    A user's session lives on the primary of their own shard: responses
+    carry the client address of that primary as the primary hint, and
+    clients log in again there. A message is sent through the sender's
+    session, so it is stored by the primary that holds it; when the receiver
+    belongs to a shard whose primary is another server, the live message is
+    passed on to that primary with notify. Receivers whose client is not
+    connected to their shard's primary, e.g. right after a failover, only see
+    the message once they fetch their messages.
+    """
+
+    def __init__(self, managers: List):
+        """
+        Initialize the router.
+
+        Args:
+            managers: ReplicationManager of each shard, indexed by shard number
+        """
+        self.managers = managers
+        self.executor = ThreadPoolExecutor(max_workers=max(2, 2 * len(managers)), thread_name_prefix="shard-router")
+
+    def shard_for_user(self, username: str) -> int:
+        """Return the shard that owns a username."""
+        return shard_of(username, len(self.managers))
+
+    def dispatch(self, data: bytes, client_socket=None) -> bytes:
+        """
+        Handle a client request on the shard, or shards, it belongs to.
+
+        Args:
+            data: Client request bytes
+            client_socket: Socket of the client that sent the request
+
+        Returns:
+            Response bytes for the client
+        """
+        try:
+            request = json.loads(data.decode('utf-8'))
+            msg_type = request.get('type')
+            payload = request.get('payload')
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            # Let shard 0 produce the usual error response
+            return self.managers[0].handle_client_operation(data, client_socket)
+
+        if msg_type == 'GM':
+            return self._merge_messages(self._scatter(data, client_socket))
+        if msg_type == 'G':
+            return self._merge_user_lists(self._scatter(data, client_socket))
+
+        owner = self._owner(msg_type, payload)
+        shard = self.shard_for_user(owner) if owner else 0
+        print(f"ShardRouter: {msg_type} for {owner} goes to shard {shard}")
+        response = self.managers[shard].handle_client_operation(data, client_socket)
+
+        if msg_type == 'U' and self._is_success(response):
+            others = [manager for index, manager in enumerate(self.managers) if index != shard]
+            for other_response in self.executor.map(lambda manager: manager.handle_client_operation(data, None), others):
+                print(f"ShardRouter: Cleanup of {owner} on another shard: {other_response[:100]}")
+        return response
+
+    def notify(self, sender: str, receiver: str, notification: bytes):
+        """
+        Pass a live message on to the primary of the receiver's shard, in the background.
+
+        Only the primary that stored the message passes it on, so a backup
+        applying the same message does not push it a second time.
+
+        Args:
+            sender: User who sent the message; it is stored on their shard
+            receiver: User the message is for
+            notification: Message to push to the receiver's session
+        """
+        if not self.managers[self.shard_for_user(sender)].is_primary():
+            return
+        manager = self.managers[self.shard_for_user(receiver)]
+        if manager.is_primary():
+            # Their session would be on this server, and they have none
+            return
+        self.executor.submit(manager.notify_primary, receiver, notification)
+
+    def add_primary_hint(self, data: bytes, response: bytes) -> bytes:
+        """
+        Point the client at the primary of the shard of the user a request acts for.
+
+        That is where the user's session belongs, since live messages for
+        them are pushed from there. Requests that read every shard, and
+        requests that name no user, get no hint.
+
+        Args:
+            data: Client request bytes, possibly a batch
+            response: Response bytes for the client
+
+        Returns:
+            The response, with the hint if that primary is another server
+        """
+        try:
+            operations = parse_batch(data)
+            if operations is None:
+                operations = [json.loads(data.decode('utf-8'))]
+        except (ValueError, UnicodeDecodeError):
+            return response
+        for operation in operations:
+            if not isinstance(operation, dict) or operation.get('type') in ['G', 'GM']:
+                continue
+            owner = self._owner(operation.get('type'), operation.get('payload'))
+            if owner:
+                return self.managers[self.shard_for_user(owner)].add_primary_hint(response)
+        return response
+
+    def _owner(self, msg_type: str, payload) -> Optional[str]:
+        """
+        Get the user whose shard handles a request.
+
+        Args:
+            msg_type: Request type
+            payload: Request payload
+
+        Returns:
+            Username, or None if the payload names none
+        """
+        if isinstance(payload, list) and payload:
+            return payload[0] if isinstance(payload[0], str) else None
+        if isinstance(payload, dict):
+            if msg_type in ['M', 'D']:
+                # Messages live with their sender
+                return payload.get('sender')
+            return payload.get('username')
+        return None
+
+    def _scatter(self, data: bytes, client_socket) -> List[bytes]:
+        """Send a read to every shard at once and collect the responses in shard order."""
+        return list(self.executor.map(lambda manager: manager.handle_client_operation(data, client_socket),
+                                      self.managers))
+
+    def _decode(self, response: bytes):
+        try:
+            return json.loads(response.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            return None
+
+    def _is_success(self, response: bytes) -> bool:
+        decoded = self._decode(response)
+        return isinstance(decoded, dict) and decoded.get('type') == 'S'
+
+    def _first_error(self, decoded_responses: list, responses: List[bytes]) -> Optional[bytes]:
+        """Return the first response that is not a normal dict response, e.g. a primary-unavailable error."""
+        for decoded, response in zip(decoded_responses, responses):
+            if not isinstance(decoded, dict) or decoded.get('type') == 'E':
+                return response
+        return None
+
+    def _merge_messages(self, responses: List[bytes]) -> bytes:
+        """Combine the conversations a user has on each shard, oldest message first."""
+        decoded_responses = [self._decode(response) for response in responses]
+        error = self._first_error(decoded_responses, responses)
+        if error is not None:
+            return error
+        conversations = {}
+        for decoded in decoded_responses:
+            for user, messages in (decoded.get('payload') or {}).items():
+                conversations.setdefault(user, []).extend(messages)
+        for user in conversations:
+            conversations[user].sort(key=lambda message: message.get('timestamp') or '')
+        return json.dumps({"type": decoded_responses[0].get('type'), "payload": conversations}).encode('utf-8')
+
+    def _merge_user_lists(self, responses: List[bytes]) -> bytes:
+        """Combine the user lists of all shards."""
+        decoded_responses = [self._decode(response) for response in responses]
+        error = self._first_error(decoded_responses, responses)
+        if error is not None:
+            return error
+        users = []
+        for decoded in decoded_responses:
+            users.extend(decoded.get('payload') or [])
+        return json.dumps({"type": decoded_responses[0].get('type'), "payload": users}).encode('utf-8')
+
+    def stop(self):
+        """Stop the router's worker threads."""
+        self.executor.shutdown(wait=False)
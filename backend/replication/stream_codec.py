@@ -0,0 +1,156 @@
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+
+# Preset dictionary for zlib. Replicated chat operations are short JSON
+# documents that repeat the same keys and message types, so seeding the
+# compressor with them lets even the first batch on a stream compress well.
+# The most frequent operation (M) comes last, where zlib finds it cheapest.
+# Changing the contents requires a new entry in COMPRESSION_METHODS, since
+# both sides of a stream must use the same dictionary.
+# V1 was built from client operations, which the log held before it
+# recorded storage writes; it is kept for backups that only offer it.
+REPLICATION_DICTIONARY_V1 = (
+    b'{"term": , "server_id": "replica", "entries": [{"index": , "term": , "length": }]}\n'
+    b'{"type": "R", "payload": ["'
+    b'{"type": "L", "payload": ["'
+    b'{"type": "U", "payload": {"username": "'
+    b'{"type": "O", "payload": {"username": "'
+    b'{"type": "W", "payload": {"username": "", "new_count": '
+    b'{"type": "D", "payload": {"message": "", "timestamp": "", "sender": "", "receiver": "'
+    b'{"type": "CONFIG", "members": {"replica": ["localhost", 808], "old_members": null}'
+    b'{"type": "M", "payload": {"sender": "", "recipient": "", "message": "'
+)
+
+# V2 is built from what the log holds now: the batch header with the
+# primary's state, configuration entries and the MUTATIONS entries of each
+# write, as build_mutation_operation writes them. Inserted messages are
+# the most frequent entries and come last.
+REPLICATION_DICTIONARY_V2 = (
+    b'{"address": ["", 808], "client_address": ["", 809], "commit_index": , "lease": , "last_log_index": , '
+    b'"term": , "server_id": "replica", "entries": [{"index": , "term": , "length": }]}\n'
+    b'{"members": {"replica": ["", 808]}, "old_members": null, "type": "CONFIG"}'
+    b'{"type": "MUTATIONS", "mutations": [{"op": "delete", "collection": "messages", "query": {"receiver": "'
+    b'{"op": "delete", "collection": "users", "query": {"user_name": "'
+    b'{"type": "MUTATIONS", "mutations": [{"op": "delete", "collection": "messages", "query": '
+    b'{"message": "", "sender": "", "receiver": "", "timestamp": {"$gte": "", "$lt": "'
+    b'{"type": "MUTATIONS", "mutations": [{"op": "insert", "collection": "users", "document": {"user_name": "", '
+    b'"user_password": {"__type__": "bytes", "data": "JDJiJDEyJ"}, "view_count": 5, "log_off_time": null, "_id": "'
+    b'{"type": "MUTATIONS", "mutations": [{"op": "update", "collection": "users", "query": {"user_name": ""}, '
+    b'"values": {"view_count": '
+    b'{"type": "MUTATIONS", "mutations": [{"op": "update", "collection": "users", "query": {"user_name": ""}, '
+    b'"values": {"log_off_time": "20'
+    b'{"type": "MUTATIONS", "mutations": [{"op": "insert", "collection": "messages", "document": '
+    b'{"sender": "", "receiver": "", "message": "", "timestamp": "20'
+)
+
+DICTIONARIES = {
+    "zlib-dict-v1": REPLICATION_DICTIONARY_V1,
+    "zlib-dict-v2": REPLICATION_DICTIONARY_V2,
+}
+
+# Methods a replication stream can use, in order of preference
+COMPRESSION_METHODS = ["zlib-dict-v2", "zlib-dict-v1", "zlib", "none"]
+
+
+class ReplicationStreamCodec:
+    """
+    Encodes batches of log entries for a persistent replication stream.
+
+    A batch is a one-line JSON header describing the entries, followed by the
+    raw operation bytes back to back. Operations are already JSON, so they are
+    not escaped into a JSON string a second time. The whole batch is then
+    compressed with one zlib context that lives as long as the stream, so
+    later batches also reuse everything sent before them.
+    """
+
+    def __init__(self, method: str):
+        """
+        Initialize the codec.
+
+        Args:
+            method: One of COMPRESSION_METHODS
+        """
+        if method not in COMPRESSION_METHODS:
+            raise ValueError(f"Unknown compression method {method}")
+        self.method = method
+        self.compressor = None
+        self.decompressor = None
+        if method in DICTIONARIES:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                               DICTIONARIES[method])
+            self.decompressor = zlib.decompressobj(15, DICTIONARIES[method])
+        elif method == "zlib":
+            self.compressor = zlib.compressobj(6)
+            self.decompressor = zlib.decompressobj()
+
+    @staticmethod
+    def choose(offered: List[str]) -> str:
+        """
+        Pick the compression method for a stream.
+
+        Args:
+            offered: Methods the sender supports, most preferred first
+
+        Returns:
+            The first offered method this side supports, or "none"
+        """
+        for method in offered:
+            if method in COMPRESSION_METHODS:
+                return method
+        return "none"
+
+    def encode_batch(self, term: int, server_id: str, entries: List[Dict],
+                     leader_state: Optional[Dict] = None) -> Tuple[bytes, int]:
+        """
+        Encode and compress a batch of log entries.
+
+        Args:
+            term: Sender's current term
+            server_id: Sender's server ID
+            entries: Log entries with index, term and operation; may be empty
+            leader_state: Extra header fields, such as the commit index and read lease
+
+        Returns:
+            (payload, raw_size) where raw_size is the size before compression
+        """
+        operations = [entry["operation"].encode('utf-8') for entry in entries]
+        header = dict(leader_state or {})
+        header.update({
+            "term": term,
+            "server_id": server_id,
+            "entries": [{"index": entry["index"], "term": entry["term"], "length": len(operation)}
+                        for entry, operation in zip(entries, operations)]
+        })
+        body = json.dumps(header).encode('utf-8') + b"\n" + b"".join(operations)
+        if self.compressor is None:
+            return body, len(body)
+        # Sync flush ends the batch on a byte boundary without resetting the context
+        return self.compressor.compress(body) + self.compressor.flush(zlib.Z_SYNC_FLUSH), len(body)
+
+    def decode_batch(self, payload: bytes) -> Tuple[Dict, List[Dict]]:
+        """
+        Decompress and decode a batch of log entries.
+
+        Args:
+            payload: Payload produced by encode_batch on the other side
+
+        Returns:
+            (header, entries) with entries in the same form as log entries
+        """
+        body = self.decompressor.decompress(payload) if self.decompressor else payload
+        header_line, operations = body.split(b"\n", 1)
+        header = json.loads(header_line.decode('utf-8'))
+        entries = []
+        offset = 0
+        for entry in header.get("entries", []):
+            length = entry["length"]
+            entries.append({
+                "index": entry["index"],
+                "term": entry["term"],
+                "operation": operations[offset:offset + length].decode('utf-8')
+            })
+            offset += length
+        return header, entries
+
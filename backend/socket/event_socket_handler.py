@@ -0,0 +1,425 @@
+import socket
+import selectors
+import threading
+import logging
+from collections import deque
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from backend.interfaces.communication_interface import CommunicationInterface
+from backend.protocol.framing import FrameDecoder, encode_frame, is_framed
+from backend.protocol.request_ids import request_id_of, tag_response
+from backend.protocol.handshake import Capabilities, ConnectionOptions
+from backend.socket.outbound import OutboundQueue, ClientHandle
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Selector keys that are not client connections
+LISTENER = "listener"
+WAKEUP = "wakeup"
+
+
+class ClientConnection:
+    """State of one client connection. Only the event loop thread changes it."""
+
+    def __init__(self, sock, address, handle, capabilities: Capabilities = None):
+        self.sock = sock
+        self.address = address
+        self.handle = handle  # Given to request handling instead of the socket
+        self.decoder = None  # Set once the first bytes show the client frames its messages
+        self.legacy = False  # Bare JSON client: every read is one request
+        self.options = ConnectionOptions(capabilities)  # What the client's handshake agreed on
+        self.requests = deque()  # Complete requests waiting for their turn
+        self.in_flight = 0  # Requests of this connection with a worker
+        self.exclusive = False  # The request with a worker has no id, nothing may overtake it
+        self.outgoing = bytearray()  # Response bytes not written yet
+        # Pushed messages, written once the responses are out
+        self.outbound = OutboundQueue(max_batch_bytes=self.options.max_frame_size)
+        self.events = 0  # Events the selector currently watches for
+        self.closed = False
+
+
+class EventSocketHandler(CommunicationInterface):
+    """
+    Socket handler for the server that multiplexes all clients on one thread.
+
+    A selector watches every client socket, so an idle connection costs a
+    registered file descriptor instead of a thread waking up twice a second.
+    Complete requests are handed to a fixed pool of worker threads. Requests
+    without an id run one at a time per connection, so a client gets their
+    responses in the order of its requests; a framed client that tags its
+    requests with ids gets up to MAX_IN_FLIGHT of them worked on at once and
+    the responses, carrying the same ids, as they finish. Workers never touch the sockets: responses are
+    handed back to the loop, which writes them without blocking. A connection
+    with MAX_QUEUED_REQUESTS waiting is not read from until its backlog shrinks.
+    Messages pushed to a client wait in its OutboundQueue and are written,
+    merged, whenever its responses are out; a client that falls too far behind
+    is disconnected. A framed client may open with a HELLO to agree on a
+    protocol version, encoding, compression and maximum frame size; requests are decoded to JSON as they are read and responses
+    and pushes are encoded for the client before they are written.
+    """
+
+    # Requests buffered per connection before it stops being read
+    MAX_QUEUED_REQUESTS = 32
+    # Requests with an id worked on at the same time per connection
+    MAX_IN_FLIGHT = 16
+    RECV_SIZE = 65536
+
+    def __init__(self, host: str, port: int, controller, logger=None, workers: int = 16, scheduler=None,
+                 reuse_port: bool = False, capabilities: Capabilities = None):
+        """
+        Initialize the handler.
+
+        Args:
+            host: Address to listen on
+            port: Client port
+            controller: Controller whose handle_incoming_message answers requests
+            logger: Logger, by default this module's
+            workers: Requests processed at the same time
+            scheduler: RequestScheduler that runs the requests instead of the handler's own workers
+            reuse_port: Let several processes accept on the same port
+            capabilities: Encodings, compressions and frame size offered in handshakes
+        """
+        self.host = host
+        self.port = port
+        self.controller = controller
+        self.workers = max(1, workers)
+        self.socket = None
+        self.running = False
+        self.logger = logger or logging.getLogger(__name__)
+        self.message_handler = None
+        self.scheduler = scheduler
+        self.reuse_port = reuse_port
+        self.capabilities = capabilities or Capabilities()
+
+        self.selector = None
+        self.executor = None
+        self.loop_thread = None
+        self.connections = {}  # Client socket to ClientConnection
+        # (connection, data, is_response) handed to the loop by other threads
+        self.handoff = deque()
+        self.wakeup_reader = None
+        self.wakeup_writer = None
+
+    def start_server(self, message_handler=None):
+        """Start the socket server"""
+        self.message_handler = message_handler or self.controller.handle_incoming_message
+        try:
+            self._raise_file_limit()
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(socket.SOMAXCONN)
+            self.socket.setblocking(False)
+
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.socket, selectors.EVENT_READ, LISTENER)
+            self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+            self.wakeup_reader.setblocking(False)
+            self.wakeup_writer.setblocking(False)
+            self.selector.register(self.wakeup_reader, selectors.EVENT_READ, WAKEUP)
+            if self.scheduler is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="client-worker")
+
+            self.running = True
+            self.logger.info(f"Event socket server running on {self.host}:{self.port}")
+            print(f"Event socket server running on {self.host}:{self.port} with "
+                  f"{'scheduler' if self.scheduler else self.workers} workers")
+
+            self.loop_thread = threading.Thread(target=self._run, name="client-event-loop")
+            self.loop_thread.daemon = True
+            self.loop_thread.start()
+            return True
+        except Exception as e:
+            self.logger.error(f"Error starting socket server: {e}")
+            print(f"Error starting socket server: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+
+    def _raise_file_limit(self):
+        """Allow as many open connections as the system permits"""
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+                print(f"Raised open file limit from {soft} to {hard}")
+        except (ValueError, OSError) as e:
+            print(f"Could not raise open file limit: {e}")
+
+    def _run(self):
+        """Event loop body"""
+        while self.running:
+            try:
+                events = self.selector.select(timeout=1)
+            except OSError as e:
+                if self.running:
+                    print(f"Error waiting for client events: {e}")
+                break
+            for key, mask in events:
+                if key.data == LISTENER:
+                    self._accept()
+                elif key.data == WAKEUP:
+                    self._drain_wakeup()
+                else:
+                    connection = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(connection)
+                    if mask & selectors.EVENT_WRITE and not connection.closed:
+                        self._write(connection)
+            self._process_handoff()
+
+    def _accept(self):
+        """Accept every connection waiting in the backlog"""
+        while True:
+            try:
+                client_socket, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    print(f"Error accepting client: {e}")
+                return
+            client_socket.setblocking(False)
+            handle = ClientHandle(lambda data, sock=client_socket: self.send_message(sock, data), address)
+            connection = ClientConnection(client_socket, address, handle, self.capabilities)
+            self.connections[client_socket] = connection
+            self._update_events(connection)
+            self.logger.info(f"New client connected: {address}")
+            print(f"New client connected: {address} ({len(self.connections)} connected)")
+
+    def _read(self, connection: ClientConnection):
+        """Read what a client sent and queue the requests it completed"""
+        try:
+            data = connection.sock.recv(self.RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print(f"Error reading from client {connection.address}: {e}")
+            self._close(connection)
+            return
+        if not data:
+            self.logger.info(f"Client disconnected: {connection.address}")
+            print(f"Client disconnected: {connection.address}")
+            self._close(connection)
+            return
+
+        print(f"Received data from {connection.address}: {data[:100]}")
+        if connection.decoder is None and not connection.legacy:
+            if is_framed(data):
+                connection.decoder = FrameDecoder(self.capabilities.max_frame_size)
+            else:
+                print(f"Client {connection.address} sends unframed messages")
+                connection.legacy = True
+        try:
+            requests = connection.decoder.feed(data) if connection.decoder else [data]
+            if connection.decoder:
+                requests = [self._decode(connection, request) for request in requests]
+                requests = [request for request in requests if request is not None]
+        except ValueError as e:
+            print(f"Error decoding request from {connection.address}: {e}")
+            self._close(connection)
+            return
+        connection.requests.extend(requests)
+        self._dispatch(connection)
+        self._update_events(connection)
+
+    def _decode(self, connection: ClientConnection, request: bytes) -> Optional[bytes]:
+        """
+        A framed request as JSON, or None for the hello opening the connection, which is answered here.
+
+        The hello is the first request, so nothing is in flight or written
+        yet and the answer goes out ahead of everything else.
+
+        Raises:
+            ValueError: If the request is malformed, or a hello that is not the first request
+        """
+        answer = connection.options.take_hello(request)
+        if answer is None:
+            return connection.options.decode_request(request)
+        connection.outgoing += encode_frame(answer)
+        connection.decoder.max_frame_size = connection.options.max_frame_size
+        connection.outbound.max_batch_bytes = connection.options.max_frame_size
+        print(f"Client {connection.address} agreed on version {connection.options.version}, "
+              f"{connection.options.encoding} encoding, compression {connection.options.compression}")
+        return None
+
+    def _dispatch(self, connection: ClientConnection):
+        """Hand the connection's waiting requests to workers, as many as may run at once"""
+        while connection.requests and not connection.closed and not connection.exclusive:
+            request = connection.requests[0]
+            # Only framed clients can tell responses apart by id
+            request_id = request_id_of(request) if connection.decoder else None
+            if request_id is None:
+                if connection.in_flight:
+                    return  # Waits for the requests before it
+                connection.exclusive = True
+            elif connection.in_flight >= self.MAX_IN_FLIGHT:
+                return
+            connection.requests.popleft()
+            connection.in_flight += 1
+            if self.scheduler is not None:
+                # Responses are written by the loop only, so the handler gets a handle instead of the socket
+                self.scheduler.submit(request, connection.handle,
+                                      lambda response, request_id=request_id: self._respond(connection, response, request_id))
+            else:
+                self.executor.submit(self._work, connection, request, request_id)
+
+    def _work(self, connection: ClientConnection, request: bytes, request_id=None):
+        """Worker thread body: answer one request and pass the response to the loop"""
+        try:
+            response = self.message_handler(request, connection.handle)
+        except Exception as e:
+            print(f"Error handling request from {connection.address}: {e}")
+            response = b''
+        self._respond(connection, response, request_id)
+
+    def _respond(self, connection: ClientConnection, response: bytes, request_id=None):
+        """Hand a request's response to the loop; called from any thread"""
+        if request_id is not None:
+            response = tag_response(response, request_id)
+        if connection.decoder:
+            response = connection.options.encode(response)
+        self.handoff.append((connection, response, True))
+        self._wake()
+
+    def _wake(self):
+        """Interrupt the loop's select so it picks up handed off data"""
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Already woken, or shutting down
+
+    def _drain_wakeup(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _process_handoff(self):
+        """Queue responses and pushed messages for writing, and start the next requests"""
+        while self.handoff:
+            connection, data, is_response = self.handoff.popleft()
+            if is_response:
+                connection.in_flight -= 1
+                connection.exclusive = False
+            if connection.closed:
+                continue
+            if not is_response:
+                if not connection.outbound.push(data, buffered=len(connection.outgoing)):
+                    print(f"Client {connection.address} fell more than {connection.outbound.high_water} "
+                          f"bytes behind, disconnecting it")
+                    self._close(connection)
+                    continue
+            elif connection.decoder:
+                # Every framed request gets exactly one framed response, compressed in the order written
+                connection.outgoing += encode_frame(connection.options.compress(data or b''))
+            elif data:
+                connection.outgoing += data
+            if is_response:
+                print(f"Sending response to {connection.address}: {data[:100] if data else data}")
+                self._dispatch(connection)
+            self._write(connection)
+
+    def _write(self, connection: ClientConnection):
+        """Write as much pending output as the socket takes without blocking"""
+        if not connection.outgoing:
+            batch = connection.outbound.next_batch()
+            if batch:
+                if connection.decoder:
+                    batch = encode_frame(connection.options.compress(connection.options.encode(batch)))
+                connection.outgoing += batch
+        if connection.outgoing:
+            try:
+                sent = connection.sock.send(connection.outgoing)
+                del connection.outgoing[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                print(f"Error writing to client {connection.address}: {e}")
+                self._close(connection)
+                return
+        self._update_events(connection)
+
+    def _update_events(self, connection: ClientConnection):
+        """Watch for input unless the backlog is full, and for output while some is pending"""
+        if connection.closed:
+            return
+        events = 0
+        if len(connection.requests) < self.MAX_QUEUED_REQUESTS:
+            events |= selectors.EVENT_READ
+        if connection.outgoing or connection.outbound.messages:
+            events |= selectors.EVENT_WRITE
+        if events == connection.events:
+            return
+        if connection.events == 0:
+            self.selector.register(connection.sock, events, connection)
+        elif events == 0:
+            self.selector.unregister(connection.sock)
+        else:
+            self.selector.modify(connection.sock, events, connection)
+        connection.events = events
+
+    def _close(self, connection: ClientConnection):
+        if connection.closed:
+            return
+        connection.closed = True
+        if connection.events:
+            try:
+                self.selector.unregister(connection.sock)
+            except (KeyError, ValueError):
+                pass
+        connection.events = 0
+        self.connections.pop(connection.sock, None)
+        try:
+            connection.sock.close()
+        except Exception as e:
+            self.logger.error(f"Error closing client socket: {e}")
+            print(f"Error closing client socket: {e}")
+
+    def stop_server(self):
+        """Stop the socket server"""
+        self.running = False
+        if self.wakeup_writer:
+            self._wake()
+        if self.loop_thread and self.loop_thread is not threading.current_thread():
+            self.loop_thread.join(timeout=2)
+
+        for connection in list(self.connections.values()):
+            self._close(connection)
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        for sock in [self.socket, self.wakeup_reader, self.wakeup_writer]:
+            if sock:
+                try:
+                    sock.close()
+                except Exception as e:
+                    self.logger.error(f"Error closing server socket: {e}")
+                    print(f"Error closing server socket: {e}")
+        if self.selector:
+            self.selector.close()
+
+        self.logger.info("Socket server stopped")
+        print("Socket server stopped")
+
+    def broadcast(self, message, exclude=None):
+        """Broadcast a message to all connected clients"""
+        for client in list(self.connections):
+            if exclude and client == exclude:
+                continue
+            self.send_message(client, message)
+
+    def send_message(self, client, message: bytes) -> None:
+        """Queue a message for a client; safe to call from any thread"""
+        connection = self.connections.get(client)
+        if connection is None:
+            return
+        self.handoff.append((connection, message, False))
+        self._wake()
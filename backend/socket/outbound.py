@@ -0,0 +1,177 @@
+import threading
+from collections import deque
+from typing import Callable, List, Optional
+
+from backend.protocol.framing import MAX_FRAME_SIZE
+
+# Bytes of pushed messages a client may fall behind by before it is disconnected
+DEFAULT_HIGH_WATER = 1024 * 1024
+# Pushed messages merged into one write
+DEFAULT_MAX_BATCH = 64
+
+
+def coalesce(messages: List[bytes]) -> bytes:
+    """
+    Merge JSON messages into one JSON array.
+
+    Clients already accept an array of messages wherever they accept one
+    message. Messages that are arrays themselves are flattened into it.
+
+    Args:
+        messages: Encoded JSON messages, oldest first
+
+    Returns:
+        The single message if there is one, otherwise the array
+    """
+    if len(messages) == 1:
+        return messages[0]
+    parts = []
+    for message in messages:
+        message = message.strip()
+        if message.startswith(b'['):
+            inner = message[1:-1].strip()
+            if inner:
+                parts.append(inner)
+        elif message:
+            parts.append(message)
+    return b'[' + b', '.join(parts) + b']'
+
+
+class OutboundQueue:
+    """
+    Messages pushed to one client connection that are not written yet.
+
+    push() never blocks, so whoever produces a notification (usually the
+    request of another client) returns at once however slow the receiver
+    is. The connection's writer takes the waiting messages in batches,
+    merged into a single message each. A client that lets more than
+    high_water bytes pile up is not going to catch up: push() refuses the
+    message and the connection should be closed.
+
+    Responses to requests answered out of order are queued here too; they
+    are written before waiting pushes, one at a time, and never refused.
+
+    A merged batch stays within max_batch_bytes, the largest frame the
+    client accepts, so only a single message that is too large on its own
+    is ever replaced by an error. The connection lowers it once the
+    client's handshake agreed on a smaller frame size.
+    """
+
+    def __init__(self, high_water: int = DEFAULT_HIGH_WATER, max_batch: int = DEFAULT_MAX_BATCH,
+                 max_batch_bytes: int = MAX_FRAME_SIZE):
+        """
+        Initialize the queue.
+
+        Args:
+            high_water: Bytes that may wait before the client counts as hopelessly slow
+            max_batch: Messages merged into one write at most
+            max_batch_bytes: Size a merged batch may reach at most
+        """
+        self.high_water = high_water
+        self.max_batch = max(1, max_batch)
+        self.max_batch_bytes = max_batch_bytes
+        self.messages = deque()
+        self.pending_bytes = 0
+        self.responses = deque()
+        self.response_bytes = 0
+        self.overflowed = False
+        self.draining = False  # A writer is taking batches from the queue
+        self.lock = threading.Lock()
+
+    def push(self, message: bytes, buffered: int = 0) -> bool:
+        """
+        Queue a message.
+
+        Args:
+            message: Encoded message
+            buffered: Bytes of this connection waiting elsewhere, e.g. responses not written yet
+
+        Returns:
+            False if the client fell more than high_water bytes behind; the message was dropped
+        """
+        with self.lock:
+            if self.overflowed:
+                return False
+            if self.pending_bytes + self.response_bytes + buffered + len(message) > self.high_water:
+                self.overflowed = True
+                self.messages.clear()
+                self.pending_bytes = 0
+                return False
+            self.messages.append(message)
+            self.pending_bytes += len(message)
+            return True
+
+    def push_response(self, response: bytes):
+        """
+        Queue a response; it is written as it is, ahead of waiting pushes.
+
+        Args:
+            response: Encoded response
+        """
+        with self.lock:
+            self.responses.append(response)
+            self.response_bytes += len(response)
+
+    def start_draining(self) -> bool:
+        """
+        Claim the queue for a writer.
+
+        Returns:
+            True if the caller has to start writing; False if a writer is already at it or nothing waits
+        """
+        with self.lock:
+            if self.draining or not (self.messages or self.responses):
+                return False
+            self.draining = True
+            return True
+
+    def next_batch(self) -> Optional[bytes]:
+        """
+        Take the oldest waiting response, or else the oldest waiting messages, merged into one.
+
+        Returns:
+            The message, or None if the queue is empty; the writer's claim ends then
+        """
+        with self.lock:
+            if self.responses:
+                response = self.responses.popleft()
+                self.response_bytes -= len(response)
+                return response
+            if not self.messages:
+                self.draining = False
+                return None
+            # The array adds two brackets and a separator per message
+            batch = [self.messages.popleft()]
+            size = len(batch[0]) + 2
+            while (self.messages and len(batch) < self.max_batch
+                   and size + len(self.messages[0]) + 2 <= self.max_batch_bytes):
+                size += len(self.messages[0]) + 2
+                batch.append(self.messages.popleft())
+            self.pending_bytes -= sum(len(message) for message in batch)
+        return coalesce(batch)
+
+
+class ClientHandle:
+    """
+    What request handling gets instead of a client's socket.
+
+    The controller keeps it for online users and pushes notifications with
+    sendall(), which queues them on the connection and returns at once.
+    """
+
+    def __init__(self, send: Callable[[bytes], None], address):
+        """
+        Initialize the handle.
+
+        Args:
+            send: Queues a message on the client's connection without blocking
+            address: Client address, for logging
+        """
+        self.send = send
+        self.address = address
+
+    def sendall(self, data: bytes):
+        self.send(data)
+
+    def __repr__(self):
+        return f"<ClientHandle {self.address}>"
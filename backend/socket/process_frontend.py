@@ -0,0 +1,408 @@
+import itertools
+import json
+import os
+import socket
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import bcrypt
+
+from backend.protocol.batch import (BATCH, batch_request, batch_response, check_operations, is_success, skipped,
+                                    unpack_batch_response)
+from backend.protocol.fields import add_field
+from backend.protocol.framing import recv_frame, send_frame
+
+# Messages on the channel are frames holding a JSON header, a newline and a raw body
+
+
+def encode_ipc(header: Dict, body: bytes = b'') -> bytes:
+    return json.dumps(header).encode('utf-8') + b'\n' + (body or b'')
+
+
+def decode_ipc(frame: bytes) -> Tuple[Dict, bytes]:
+    header, _, body = frame.partition(b'\n')
+    return json.loads(header.decode('utf-8')), body
+
+
+def create_ipc_listener(path: str) -> socket.socket:
+    """
+    Create the owner's listening socket.
+
+    Called before the front end processes are forked, so they can connect
+    right away while the owner is still starting its replication groups.
+
+    Args:
+        path: Filesystem path of the Unix domain socket
+
+    Returns:
+        Listening socket
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+class RemoteClient:
+    """
+    Stands in for a client socket that lives in a front end process.
+
+    The controller keeps one per online user and pushes notifications to it
+    with sendall, exactly as it does with a real socket.
+    """
+
+    def __init__(self, connection: 'IpcConnection', client_id: int):
+        self.connection = connection
+        self.client_id = client_id
+
+    def sendall(self, data: bytes):
+        self.connection.send({"op": "push", "client": self.client_id}, data)
+
+    def __repr__(self):
+        return f"<RemoteClient {self.client_id} via front end {self.connection.name}>"
+
+
+class IpcConnection:
+    """One end of a channel between the owner and a front end process."""
+
+    def __init__(self, sock: socket.socket, name: str = ""):
+        self.sock = sock
+        self.name = name
+        self.send_lock = threading.Lock()
+
+    def send(self, header: Dict, body: bytes = b''):
+        with self.send_lock:
+            send_frame(self.sock, encode_ipc(header, body))
+
+    def receive(self) -> Optional[Tuple[Dict, bytes]]:
+        """Read the next message, or None if the other side closed the channel."""
+        frame = recv_frame(self.sock)
+        return decode_ipc(frame) if frame is not None else None
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class FrontendOwner:
+    """
+    Serves the front end processes from the process that owns replication and storage.
+
+    Every front end holds one channel. Requests arriving on it are answered
+    by the controller on a thread pool, so one slow request does not hold up
+    the others of that front end. Operations:
+
+    - request: a client request, answered like one from a local socket
+    - password_hash: a user's stored hash, so the front end checks a login's
+      password itself; answered only when this server may serve reads locally
+    - online: a user logged in on a front end; notifications for them are
+      pushed back over the channel
+    """
+
+    def __init__(self, listener: socket.socket, controller,
+                 password_lookup: Callable[[str], Optional[bytes]], workers: int = 16):
+        """
+        Initialize the owner side.
+
+        Args:
+            listener: Socket from create_ipc_listener
+            controller: Controller that answers client requests
+            password_lookup: Returns a user's stored hash, b'' for an unknown user,
+                or None if the read has to go to the primary
+            workers: Requests answered at the same time
+        """
+        self.listener = listener
+        self.controller = controller
+        self.password_lookup = password_lookup
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="frontend-owner")
+        self.connections = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._accept_loop, name="frontend-accept")
+        thread.daemon = True
+        thread.start()
+
+    def _accept_loop(self):
+        count = itertools.count(1)
+        while self.running:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                break
+            connection = IpcConnection(sock, str(next(count)))
+            self.connections.append(connection)
+            print(f"FrontendOwner: Front end {connection.name} connected")
+            thread = threading.Thread(target=self._read_loop, args=(connection,), name=f"frontend-{connection.name}")
+            thread.daemon = True
+            thread.start()
+
+    def _read_loop(self, connection: IpcConnection):
+        while self.running:
+            try:
+                message = connection.receive()
+            except (OSError, ValueError) as e:
+                print(f"FrontendOwner: Error reading from front end {connection.name}: {e}")
+                message = None
+            if message is None:
+                break
+            self.executor.submit(self._answer, connection, *message)
+        print(f"FrontendOwner: Front end {connection.name} disconnected")
+        connection.close()
+
+    def _answer(self, connection: IpcConnection, header: Dict, body: bytes):
+        reply = {"id": header.get("id")}
+        response = b''
+        try:
+            op = header.get("op")
+            if op == "request":
+                client = RemoteClient(connection, header["client"]) if header.get("client") is not None else None
+                response = self.controller.handle_incoming_message(body, client)
+            elif op == "password_hash":
+                stored = self.password_lookup(header["username"])
+                if stored is None:
+                    reply["forward"] = True
+                else:
+                    response = stored
+            elif op == "online":
+                with self.controller.lock:
+                    self.controller.online_users[header["username"]] = RemoteClient(connection, header["client"])
+            else:
+                reply["error"] = f"Unknown operation {op}"
+        except Exception as e:
+            print(f"FrontendOwner: Error answering {header.get('op')} from front end {connection.name}: {e}")
+            reply["error"] = str(e)
+        try:
+            connection.send(reply, response or b'')
+        except OSError as e:
+            print(f"FrontendOwner: Error replying to front end {connection.name}: {e}")
+
+    def stop(self):
+        self.running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        for connection in self.connections:
+            connection.close()
+        self.executor.shutdown(wait=False)
+
+
+class FrontendChannel:
+    """
+    Front end side of the channel: concurrent calls to the owner over one connection.
+
+    Each call carries an id and the caller waits for the reply with that id,
+    so many worker threads share the connection. Notifications the owner
+    pushes for a client are queued on the client's connection through the
+    ClientHandle the socket handler gave with the client's requests.
+    """
+
+    def __init__(self, path: str, on_close: Callable = None, timeout: float = 30.0):
+        """
+        Initialize the channel.
+
+        Args:
+            path: Filesystem path of the owner's Unix domain socket
+            on_close: Called once if the owner goes away
+            timeout: Seconds to wait for a reply
+        """
+        self.path = path
+        self.on_close = on_close
+        self.timeout = timeout
+        self.connection = None
+        self.ids = itertools.count(1)
+        self.pending = {}  # Call id to [Event, reply]
+        self.pending_lock = threading.Lock()
+        # Client handles of this process by the id the owner knows them as
+        self.clients = weakref.WeakValueDictionary()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        self.connection = IpcConnection(sock, str(os.getpid()))
+        thread = threading.Thread(target=self._read_loop, name="frontend-channel")
+        thread.daemon = True
+        thread.start()
+
+    def client_id(self, client_socket) -> Optional[int]:
+        """Name a client's handle so the owner can push to it later."""
+        if client_socket is None:
+            return None
+        self.clients[id(client_socket)] = client_socket
+        return id(client_socket)
+
+    def call(self, header: Dict, body: bytes = b'') -> Tuple[Dict, bytes]:
+        """
+        Send an operation to the owner and wait for its reply.
+
+        Args:
+            header: Operation and its arguments
+            body: Raw bytes, e.g. a client request
+
+        Returns:
+            Reply header and body
+
+        Raises:
+            ConnectionError: If the owner is gone or did not answer in time
+        """
+        call_id = next(self.ids)
+        waiter = [threading.Event(), None]
+        with self.pending_lock:
+            self.pending[call_id] = waiter
+        try:
+            self.connection.send(dict(header, id=call_id), body)
+            if not waiter[0].wait(self.timeout) or waiter[1] is None:
+                raise ConnectionError("No reply from the replication process")
+            return waiter[1]
+        except OSError as e:
+            raise ConnectionError(f"Replication process unavailable: {e}")
+        finally:
+            with self.pending_lock:
+                self.pending.pop(call_id, None)
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = self.connection.receive()
+            except (OSError, ValueError) as e:
+                print(f"FrontendChannel: Error reading from the replication process: {e}")
+                message = None
+            if message is None:
+                break
+            header, body = message
+            if header.get("op") == "push":
+                client = self.clients.get(header.get("client"))
+                if client is not None:
+                    try:
+                        # Only queues, so one slow client never holds up the channel
+                        client.sendall(body)
+                    except Exception as e:
+                        print(f"FrontendChannel: Error pushing to {client}: {e}")
+                continue
+            with self.pending_lock:
+                waiter = self.pending.get(header.get("id"))
+            if waiter:
+                waiter[1] = (header, body)
+                waiter[0].set()
+        print("FrontendChannel: Replication process closed the channel")
+        with self.pending_lock:
+            for waiter in self.pending.values():
+                waiter[0].set()
+        if self.on_close:
+            self.on_close()
+
+
+class FrontendWorker:
+    """
+    Answers client requests in a front end process.
+
+    Logins are checked here: the stored hash comes from the owner and the
+    bcrypt comparison, the most expensive part of any request, runs in this
+    process, also when a login opens a batch. Everything else is passed to
+    the owner unchanged.
+    """
+
+    def __init__(self, channel: FrontendChannel, json_protocol):
+        self.channel = channel
+        self.json_protocol = json_protocol
+
+    def handle(self, data: bytes, client_socket=None) -> bytes:
+        """
+        Answer one client request.
+
+        Args:
+            data: Request bytes
+            client_socket: Socket of the client, if the socket handler provides it
+
+        Returns:
+            Response bytes
+        """
+        try:
+            try:
+                request = json.loads(data.decode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                request = None
+            if isinstance(request, dict) and request.get('type') == 'L':
+                response = self._login(data, request.get('payload'), client_socket)
+                if response is not None:
+                    return response
+            if isinstance(request, dict) and request.get('type') == BATCH:
+                response = self._batch(request.get('payload'), client_socket)
+                if response is not None:
+                    return response
+            return self._call_owner(data, client_socket)
+        except ConnectionError as e:
+            print(f"FrontendWorker: {e}")
+            return self.json_protocol.serialize_error("Server is restarting, please retry")
+
+    def _call_owner(self, data: bytes, client_socket) -> bytes:
+        """Pass a request to the owner and return its response"""
+        header, response = self.channel.call(
+            {"op": "request", "client": self.channel.client_id(client_socket)}, data)
+        if header.get("error"):
+            return self.json_protocol.serialize_error(f"Error: {header['error']}")
+        return response
+
+    def _batch(self, operations, client_socket) -> Optional[bytes]:
+        """
+        Check the login a batch starts with in this process, and pass the rest to the owner in one call.
+
+        Returns:
+            The BATCH response, or None if the owner has to handle the whole batch
+        """
+        try:
+            operations = check_operations(operations)
+        except ValueError:
+            return None
+        if not operations or operations[0].get('type') != 'L':
+            return None
+        login = self._login(None, operations[0].get('payload'), client_socket)
+        if login is None:
+            return None
+        rest = operations[1:]
+        if not is_success(login):
+            return batch_response([login] + skipped(len(rest), "Not run, login failed"))
+        if not rest:
+            return batch_response([login])
+        responses, fields = unpack_batch_response(self._call_owner(batch_request(rest), client_socket), len(rest))
+        response = batch_response([login] + responses)
+        if 'primary' in fields:
+            # Keep the primary location hint a backup's owner added to its response
+            response = add_field(response, 'primary', fields['primary'])
+        return response
+
+    def _login(self, data: bytes, payload, client_socket) -> Optional[bytes]:
+        """
+        Check a login in this process.
+
+        Returns:
+            The response, or None if the owner has to handle the login
+        """
+        try:
+            username, password = self.json_protocol.deserialize_login(payload)
+        except Exception:
+            return None
+        header, stored = self.channel.call({"op": "password_hash", "username": username})
+        if header.get("forward") or header.get("error"):
+            # Our state may be behind the primary's; let the owner route the login
+            return None
+        try:
+            valid = bool(stored) and bcrypt.checkpw(password.encode('utf-8'), stored)
+        except Exception as e:
+            print(f"FrontendWorker: Error checking password: {e}")
+            valid = False
+        if not valid:
+            return self.json_protocol.serialize_error("Invalid username or password")
+        client = self.channel.client_id(client_socket)
+        if client is not None:
+            self.channel.call({"op": "online", "username": username, "client": client})
+        print(f"FrontendWorker: Login successful for user: {username}")
+        return self.json_protocol.serialize_success("Login successful")
@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from backend.protocol.batch import BATCH, operation_types
+
+# Operation classes and the request types each one handles; anything else is a read
+AUTH_TYPES = ['R', 'L']  # bcrypt hashing makes these the most expensive requests
+WRITE_TYPES = ['M', 'D', 'U', 'W', 'O']
+OPERATION_CLASSES = ['auth', 'write', 'read']
+
+
+class OperationQueue:
+    """Waiting requests and counters of one operation class."""
+
+    def __init__(self, name: str, workers: int, max_depth: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_depth = max(1, max_depth)
+        self.pending = deque()  # (data, client_socket, callback, enqueued_at)
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.service_time = 0.0  # Moving average of seconds spent handling one request
+        self.threads = []
+
+
+class RequestScheduler:
+    """
+    Runs client requests on bounded worker pools, one per operation class.
+
+    Logins and registrations, writes and reads each have their own queue and
+    workers, so a burst of bcrypt-heavy logins cannot hold up message sends
+    and a flood of reads cannot delay either. A request whose queue already
+    holds max_depth requests is turned away at once with a retry-after error
+    instead of waiting behind all of them, and a request that still waited
+    longer than max_queue_wait by the time a worker gets to it is turned away
+    the same way: its client has most likely given up on it. Latency under
+    overload is therefore bounded by the queue limits rather than growing
+    with the number of clients.
+    """
+
+    # Bounds of the retry-after hint, in seconds
+    MIN_RETRY_AFTER = 0.1
+    MAX_RETRY_AFTER = 5.0
+
+    def __init__(self, handler: Callable[[bytes, object], bytes], workers: Optional[Dict[str, int]] = None,
+                 max_depth: int = 64, max_queue_wait: float = 2.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            handler: Answers one request, e.g. Controller.handle_incoming_message
+            workers: Worker threads per operation class, by default 2 for auth and 4 for writes and reads
+            max_depth: Requests that may wait in each class's queue
+            max_queue_wait: Seconds a request may wait for a worker before it is rejected
+        """
+        self.handler = handler
+        workers = dict({'auth': 2, 'write': 4, 'read': 4}, **(workers or {}))
+        self.queues = {name: OperationQueue(name, workers[name], max_depth) for name in OPERATION_CLASSES}
+        self.max_queue_wait = max_queue_wait
+        self.condition = threading.Condition()
+        self.running = False
+
+    def start(self):
+        """Start the worker threads."""
+        self.running = True
+        for queue in self.queues.values():
+            for number in range(queue.workers):
+                thread = threading.Thread(target=self._worker, args=(queue,), name=f"{queue.name}-worker-{number}")
+                thread.daemon = True
+                thread.start()
+                queue.threads.append(thread)
+        print("RequestScheduler: Started " +
+              ", ".join(f"{queue.workers} {queue.name}" for queue in self.queues.values()) + " workers")
+
+    def stop(self):
+        """Stop the workers; requests still waiting are answered with an error."""
+        with self.condition:
+            self.running = False
+            waiting = [item for queue in self.queues.values() for item in queue.pending]
+            for queue in self.queues.values():
+                queue.pending.clear()
+            self.condition.notify_all()
+        for data, client_socket, callback, enqueued_at in waiting:
+            callback(self._error("Server is shutting down, please retry on another server", self.MAX_RETRY_AFTER))
+
+    def classify(self, data: bytes) -> str:
+        """
+        Find the operation class of a request.
+
+        A batch belongs to the most expensive class of the operations it carries.
+
+        Args:
+            data: Request bytes
+
+        Returns:
+            'auth', 'write' or 'read'
+        """
+        try:
+            request = json.loads(data.decode('utf-8'))
+            msg_types = [request.get('type')]
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            return 'read'
+        if msg_types == [BATCH]:
+            msg_types = operation_types(request.get('payload'))
+        if any(msg_type in AUTH_TYPES for msg_type in msg_types):
+            return 'auth'
+        if any(msg_type in WRITE_TYPES for msg_type in msg_types):
+            return 'write'
+        return 'read'
+
+    def submit(self, data: bytes, client_socket=None, callback: Callable[[bytes], None] = None) -> bool:
+        """
+        Queue a request without waiting for it.
+
+        Args:
+            data: Request bytes
+            client_socket: Socket of the client that sent the request, passed on to the handler
+            callback: Called with the response; on a worker thread, or right away if the request is rejected
+
+        Returns:
+            True if the request was queued, False if it was rejected
+        """
+        queue = self.queues[self.classify(data)]
+        with self.condition:
+            if self.running and len(queue.pending) < queue.max_depth:
+                queue.pending.append((data, client_socket, callback, time.time()))
+                self.condition.notify_all()
+                return True
+            queue.rejected += 1
+            retry_after = self._retry_after(queue)
+            running = self.running
+        if running:
+            print(f"RequestScheduler: {queue.name} queue is full ({queue.max_depth} waiting), rejecting request")
+            callback(self._error("Server is busy, please retry", retry_after))
+        else:
+            callback(self._error("Server is shutting down, please retry on another server", self.MAX_RETRY_AFTER))
+        return False
+
+    def handle(self, data: bytes, client_socket=None) -> bytes:
+        """
+        Queue a request and wait for its response.
+
+        Args:
+            data: Request bytes
+            client_socket: Socket of the client that sent the request
+
+        Returns:
+            Response bytes, or an error with a retry-after hint if the request was rejected
+        """
+        done = threading.Event()
+        result = []
+
+        def callback(response):
+            result.append(response)
+            done.set()
+
+        self.submit(data, client_socket, callback)
+        done.wait()
+        return result[0]
+
+    def _worker(self, queue: OperationQueue):
+        """Worker thread body: answer the requests of one operation class."""
+        while True:
+            with self.condition:
+                while self.running and not queue.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                data, client_socket, callback, enqueued_at = queue.pending.popleft()
+                waited = time.time() - enqueued_at
+                if waited > self.max_queue_wait:
+                    queue.expired += 1
+                    retry_after = self._retry_after(queue)
+                else:
+                    queue.running += 1
+                    retry_after = None
+
+            if retry_after is not None:
+                print(f"RequestScheduler: {queue.name} request waited {waited:.2f}s, rejecting it")
+                callback(self._error("Server is busy, please retry", retry_after))
+                continue
+
+            started = time.time()
+            try:
+                response = self.handler(data, client_socket)
+            except Exception as e:
+                print(f"RequestScheduler: Error handling {queue.name} request: {e}")
+                response = self._error(f"Error: {str(e)}")
+            elapsed = time.time() - started
+
+            with self.condition:
+                queue.running -= 1
+                queue.completed += 1
+                queue.service_time = elapsed if queue.completed == 1 else 0.9 * queue.service_time + 0.1 * elapsed
+            try:
+                callback(response)
+            except Exception as e:
+                print(f"RequestScheduler: Error delivering {queue.name} response: {e}")
+
+    def _retry_after(self, queue: OperationQueue) -> float:
+        """
+        Estimate when a rejected request would find room: the time the workers need for the current queue.
+
+        Must be called with the condition held.
+        """
+        estimate = (len(queue.pending) + queue.running) * queue.service_time / queue.workers
+        return round(min(self.MAX_RETRY_AFTER, max(self.MIN_RETRY_AFTER, estimate)), 1)
+
+    def _error(self, message: str, retry_after: Optional[float] = None) -> bytes:
+        response = {"type": "E", "payload": message}
+        if retry_after is not None:
+            response["payload"] = f"{message} in {retry_after} seconds"
+            response["retry_after"] = retry_after
+        return json.dumps(response).encode('utf-8')
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Report the state of every operation class.
+
+        Returns:
+            Queue depth, busy workers and request counters per class
+        """
+        with self.condition:
+            return {queue.name: {
+                "workers": queue.workers,
+                "queued": len(queue.pending),
+                "running": queue.running,
+                "max_depth": queue.max_depth,
+                "completed": queue.completed,
+                "rejected": queue.rejected,
+                "expired": queue.expired,
+                "service_ms": round(queue.service_time * 1000, 1),
+            } for queue in self.queues.values()}
@@ -3,18 +3,33 @@ import threading
 import logging
 import time
 from typing import Callable
-from interfaces.communication_interface import CommunicationInterface
+from backend.interfaces.communication_interface import CommunicationInterface
+from backend.protocol.framing import FrameDecoder, encode_frame, is_framed
+from backend.protocol.request_ids import request_id_of, tag_response
+from backend.protocol.handshake import Capabilities, ConnectionOptions
+from backend.socket.outbound import OutboundQueue, ClientHandle
 
 class SocketHandler(CommunicationInterface):
     """Socket handler for the server"""
-    def __init__(self, host: str, port: int, controller, logger=None):
+    # Requests with an id worked on at the same time per connection
+    MAX_IN_FLIGHT = 16
+
+    def __init__(self, host: str, port: int, controller, logger=None, reuse_port: bool = False, scheduler=None,
+                 capabilities: Capabilities = None):
         self.host = host
         self.port = port
         self.controller = controller
+        self.reuse_port = reuse_port  # Let several processes accept on the same port
+        self.scheduler = scheduler  # Runs requests that carry an id while the client's thread reads on
+        self.capabilities = capabilities or Capabilities()  # What handshakes offer
         self.socket = None
         self.running = False
         self.clients = []
+        self.framed_clients = set()  # Clients that send length-prefixed frames
+        self.connection_options = {}  # Client socket to the ConnectionOptions of its handshake
         self.client_threads = []
+        self.outboxes = {}  # Client socket to the OutboundQueue of messages pushed to it
+        self.write_locks = {}  # Client socket to the lock held while writing to it
         self.logger = logger or logging.getLogger(__name__)
         self.lock = threading.Lock()
         self.message_handler = None
@@ -25,8 +40,10 @@ class SocketHandler(CommunicationInterface):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.bind((self.host, self.port))
-            self.socket.listen(5)
+            self.socket.listen(socket.SOMAXCONN)
             self.running = True
             self.logger.info(f"Socket server running on {self.host}:{self.port}")
             print(f"Socket server running on {self.host}:{self.port}")
@@ -52,13 +69,18 @@ class SocketHandler(CommunicationInterface):
                 self.logger.info(f"New client connected: {address}")
                 print(f"New client connected: {address}")
                 
+                with self.lock:
+                    self.clients.append(client_socket)
+                    self.outboxes[client_socket] = OutboundQueue(max_batch_bytes=self.capabilities.max_frame_size)
+                    self.connection_options[client_socket] = ConnectionOptions(self.capabilities)
+                    self.write_locks[client_socket] = threading.Lock()
+                
                 # Start a new thread to handle the client
                 client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address))
                 client_thread.daemon = True
                 client_thread.start()
                 
                 with self.lock:
-                    self.clients.append(client_socket)
                     self.client_threads.append(client_thread)
             except Exception as e:
                 if self.running:  # Only log if we're still supposed to be running
@@ -69,7 +91,46 @@ class SocketHandler(CommunicationInterface):
                 time.sleep(0.1)  # Prevent CPU spinning
 
     def handle_client(self, client_socket, address):
-        """Handle client connection"""
+        """
+        Handle client connection.
+        
+        Clients frame every request with a length prefix, and get every
+        response framed the same way, so requests of any size can be sent
+        back to back. The first bytes tell whether a client does this; older
+        clients send bare JSON and are served one request per read, as before.
+        
+        Request handling gets a ClientHandle instead of the socket, so
+        notifications for this client go through its outbound queue.
+        
+        A framed client may open with a HELLO to agree on a protocol version,
+        encoding, compression and maximum frame size. Its requests are
+        decoded to JSON for request handling, and responses and pushed
+        messages are encoded for it on the way out.
+        
+        A framed request with an id is handed to the scheduler and its
+        response, tagged with the id, is queued when it is ready, so up to
+        MAX_IN_FLIGHT of them are worked on at once. A request without an id
+        waits for those and is answered in order, as before.
+        """
+        decoder = None
+        legacy = False
+        handle = ClientHandle(lambda data: self.send_message(client_socket, data), address)
+        write_lock = self.write_locks[client_socket]
+        options = self.connection_options[client_socket]
+        in_flight = [0]
+        settled = threading.Condition()
+        
+        def finished(response, request_id):
+            self._queue_response(client_socket, tag_response(response, request_id))
+            with settled:
+                in_flight[0] -= 1
+                settled.notify_all()
+        
+        def wait_for_in_flight(at_most):
+            with settled:
+                while self.running and in_flight[0] > at_most:
+                    settled.wait(0.5)
+        
         try:
             while self.running:
                 try:
@@ -77,7 +138,7 @@ class SocketHandler(CommunicationInterface):
                     client_socket.settimeout(0.5)
                     
                     # Receive data from client
-                    data = client_socket.recv(4096)
+                    data = client_socket.recv(65536)
                     if not data:
                         self.logger.info(f"Client disconnected: {address}")
                         print(f"Client disconnected: {address}")
@@ -86,14 +147,56 @@ class SocketHandler(CommunicationInterface):
                     self.logger.info(f"Received data from {address}: {data[:100]}")
                     print(f"Received data from {address}: {data[:100]}")
                     
-                    # Process the data
-                    response = self.message_handler(data, client_socket)
+                    if decoder is None and not legacy:
+                        if is_framed(data):
+                            decoder = FrameDecoder(self.capabilities.max_frame_size)
+                            with self.lock:
+                                self.framed_clients.add(client_socket)
+                        else:
+                            print(f"Client {address} sends unframed messages")
+                            legacy = True
                     
-                    # If there's a response, send it back to the client
-                    if response:
-                        self.logger.info(f"Sending response to {address}: {response[:100]}")
-                        print(f"Sending response to {address}: {response[:100]}")
-                        client_socket.sendall(response)
+                    # A read may hold part of a request or several of them
+                    requests = decoder.feed(data) if decoder else [data]
+                    for request in requests:
+                        answer = options.take_hello(request) if decoder else None
+                        if answer is not None:
+                            with write_lock:
+                                client_socket.sendall(encode_frame(answer))
+                            decoder.max_frame_size = options.max_frame_size
+                            self.outboxes[client_socket].max_batch_bytes = options.max_frame_size
+                            print(f"Client {address} agreed on version {options.version}, "
+                                  f"{options.encoding} encoding, compression {options.compression}")
+                            continue
+                        if decoder:
+                            request = options.decode_request(request)
+                        
+                        request_id = request_id_of(request) if decoder and self.scheduler else None
+                        if request_id is not None:
+                            # Stops reading this client while too many of its requests are running
+                            wait_for_in_flight(self.MAX_IN_FLIGHT - 1)
+                            with settled:
+                                in_flight[0] += 1
+                            self.scheduler.submit(request, handle,
+                                                  lambda response, request_id=request_id: finished(response, request_id))
+                            continue
+                        wait_for_in_flight(0)
+                        
+                        # Process the data
+                        response = self.message_handler(request, handle)
+                        
+                        if decoder:
+                            # Every framed request gets exactly one framed response
+                            response = options.encode(response)
+                            print(f"Sending response to {address}: {response[:100]}")
+                            with write_lock:
+                                client_socket.sendall(encode_frame(options.compress(response)))
+                        elif response:
+                            # If there's a response, send it back to the client
+                            self.logger.info(f"Sending response to {address}: {response[:100]}")
+                            print(f"Sending response to {address}: {response[:100]}")
+                            with write_lock:
+                                client_socket.sendall(response)
                 
                 except socket.timeout:
                     # This is expected, just continue the loop
@@ -112,6 +215,10 @@ class SocketHandler(CommunicationInterface):
                 with self.lock:
                     if client_socket in self.clients:
                         self.clients.remove(client_socket)
+                    self.framed_clients.discard(client_socket)
+                    self.connection_options.pop(client_socket, None)
+                    self.outboxes.pop(client_socket, None)
+                    self.write_locks.pop(client_socket, None)
             except Exception as e:
                 self.logger.error(f"Error closing client socket: {e}")
                 print(f"Error closing client socket: {e}")
@@ -128,6 +235,10 @@ class SocketHandler(CommunicationInterface):
                 except Exception:
                     pass
             self.clients.clear()
+            self.framed_clients.clear()
+            self.connection_options.clear()
+            self.outboxes.clear()
+            self.write_locks.clear()
         
         # Close the server socket
         if self.socket:
@@ -143,28 +254,82 @@ class SocketHandler(CommunicationInterface):
     def broadcast(self, message, exclude=None):
         """Broadcast a message to all connected clients"""
         with self.lock:
-            for client in self.clients:
-                if exclude and client == exclude:
-                    continue
-                try:
-                    client.sendall(message)
-                except Exception as e:
-                    self.logger.error(f"Error broadcasting message: {e}")
-                    print(f"Error broadcasting message: {e}")
-                    # Remove the client if we can't send to it
-                    try:
-                        client.close()
-                        self.clients.remove(client)
-                    except Exception:
-                        pass
+            clients = list(self.clients)
+        for client in clients:
+            if exclude and client == exclude:
+                continue
+            self.send_message(client, message)
+
+    def _encode_for(self, client, message: bytes) -> bytes:
+        """
+        Encode and frame a message for a client that uses frames, leave it bare for older ones.
+
+        Must be called with the client's write lock held, as the message is
+        compressed on the connection's stream.
+        """
+        if client not in self.framed_clients:
+            return message
+        options = self.connection_options.get(client)
+        return encode_frame(options.compress(options.encode(message)) if options else message)
 
     def send_message(self, client, message: bytes) -> None:
-        if client in self.clients:
+        """Queue a message for a client and return at once; a writer thread of the client sends it"""
+        with self.lock:
+            outbox = self.outboxes.get(client)
+        if outbox is None:
+            return
+        if not outbox.push(message):
+            print(f"Client {self._address_of(client)} fell more than {outbox.high_water} bytes behind, disconnecting it")
+            self._disconnect(client)
+            return
+        self._start_writer(client, outbox)
+
+    def _queue_response(self, client, response: bytes):
+        """Queue the response to a request with an id; it is written ahead of pushed messages"""
+        with self.lock:
+            outbox = self.outboxes.get(client)
+        if outbox is None:
+            return
+        print(f"Sending response to {self._address_of(client)}: {response[:100]}")
+        outbox.push_response(response)
+        self._start_writer(client, outbox)
+
+    def _start_writer(self, client, outbox: OutboundQueue):
+        """Start a writer thread for the client unless one is already sending its queue"""
+        if outbox.start_draining():
+            writer = threading.Thread(target=self._drain_outbox, args=(client, outbox))
+            writer.daemon = True
+            writer.start()
+
+    def _drain_outbox(self, client, outbox: OutboundQueue):
+        """Writer thread body: send the client's queued messages until none are left"""
+        while True:
+            batch = outbox.next_batch()
+            if batch is None:
+                return
+            with self.lock:
+                write_lock = self.write_locks.get(client)
+            if write_lock is None:
+                return
             try:
-                client.sendall(message)
+                with write_lock:
+                    client.sendall(self._encode_for(client, batch))
             except Exception as e:
+                # A partial write leaves the stream unusable, and the client is not reading anyway
                 self.logger.error(f"Error sending message: {e}")
-                print(f"Error sending message: {e}")
-                with self.lock:
-                    self.clients.remove(client)
-                    client.close()
\ No newline at end of file
+                print(f"Error sending message to {self._address_of(client)}: {e}")
+                self._disconnect(client)
+                return
+
+    def _disconnect(self, client):
+        """Make the client's own thread see the connection end, so it cleans up"""
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _address_of(self, client):
+        try:
+            return client.getpeername()
+        except OSError:
+            return "closed client"
\ No newline at end of file
@@ -14,8 +14,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) # a
 from interfaces.client_serialization_interface import ClientSerializationInterface
 from interfaces.client_communication_interface import ClientCommunicationInterface
 
-# import only JSON protocol
+# import protocols
 from protocol.client_json_protocol import ClientJsonProtocol
+from protocol.client_binary_protocol import ClientBinaryProtocol
 
 # import only socket handler
 from network.client_socket_handler import ClientSocketHandler
@@ -24,6 +25,7 @@ from enum import Enum
 
 class ProtocolType(Enum):
     JSON = "json"
+    BINARY = "binary"
 
 class ClientApp:
     def __init__(self, serialization_interface: ClientSerializationInterface, communication_interface: ClientCommunicationInterface):
@@ -69,15 +71,6 @@ class ClientApp:
         self.messages_by_user = {}  # Store messages by user
         self.periodic_check_messages()
 
-    def read_exact(self, n):
-        data = b''
-        while len(data) < n:
-            packet = self.comm_handler.get_message(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
-
     def login_screen(self):
         for widget in self.root.winfo_children():
             widget.destroy()
@@ -447,10 +440,30 @@ class ClientApp:
             return
         
         data = self.serialize_message('L', [username, password])
-        print(f"Sending login: {len(data)} bytes")  
-        # Proceed with login
-        self.comm_handler.send_message(data)
+        # The user list, stats and messages the chat screen starts with
+        ready_requests = [self.serialization_interface.serialize_user_list(),
+                          self.serialize_message('GS', [username]),
+                          self.serialize_message('GM', [username])]  # 'GM' for Get Messages
+        batch = self.serialization_interface.serialize_batch([data] + ready_requests)
+        print(f"Sending login: {len(batch)} bytes")  
+        # Log in and fetch everything the chat screen needs in one round trip
+        self.comm_handler.send_message(batch)
         response = self.read_json_response()
+        if self.comm_handler.redirected():
+            # A backup answered; live messages are only pushed to sessions on the primary, so log in there
+            print("Logged in through a backup, logging in again on the primary")
+            self.comm_handler.send_message(batch)
+            response = self.read_json_response()
+        ready_responses = None
+        
+        if (isinstance(response, dict) and response.get('type') == 'BATCH'
+                and isinstance(response.get('payload'), list) and len(response['payload']) == 1 + len(ready_requests)):
+            response, ready_responses = response['payload'][0], response['payload'][1:]
+        else:
+            # Servers without batches answer with an error; log in with separate requests
+            print(f"Batch not supported by server ({response}), sending login alone")
+            self.comm_handler.send_message(data)
+            response = self.read_json_response()
         
         # Handle potential None response from server
         if not response:
@@ -472,11 +485,14 @@ class ClientApp:
             self.password = password
             messagebox.showinfo("Success", resp['payload'])
             
-            # First request the user list
-            self.request_user_list()
+            if ready_responses is None:
+                # Ask for the user list, stats and messages at once; the server answers
+                # them concurrently and the responses are matched by request id
+                request_ids = [self.comm_handler.send_request(request) for request in ready_requests]
+                ready_responses = [self.read_json_response(request_id) for request_id in request_ids]
+            user_list_response, stats_response, message_response = ready_responses
             
-            # Wait for the user list response
-            user_list_response = self.read_json_response()
+            # Process the user list response
             if user_list_response:
                 if isinstance(user_list_response, dict):
                     self.receive_message_helper(user_list_response.get('type'), user_list_response.get('payload'))
@@ -485,15 +501,7 @@ class ClientApp:
                         if isinstance(msg, dict):
                             self.receive_message_helper(msg.get('type'), msg.get('payload'))
             
-            # Request user stats
-            print("Requesting user stats")
-            stats_request = self.serialize_message('GS', [username])
-            print(f"Stats request: {stats_request}")
-            self.comm_handler.send_message(stats_request)
-            
-            # Wait for the stats response
-            print("Waiting for stats response...")
-            stats_response = self.read_json_response()
+            # Process the stats response
             print(f"Raw stats response: {stats_response}")
             if stats_response:
                 print(f"Received stats response type: {type(stats_response)}")
@@ -516,14 +524,7 @@ class ClientApp:
                                 print(f"Processing stats response with type: {msg.get('type')}")
                                 self.receive_message_helper(msg.get('type'), msg.get('payload'))
             
-            # Explicitly request messages after login
-            print("Requesting messages after login")
-            message_request = self.serialize_message('GM', [username])  # 'GM' for Get Messages
-            self.comm_handler.send_message(message_request)
-            
-            # Wait for the message response
-            print("Waiting for message response...")
-            message_response = self.read_json_response()
+            # Process the message response
             if message_response:
                 print(f"Received message response: {type(message_response)}")
                 # Process the message response
@@ -616,55 +617,22 @@ class ClientApp:
         print("Registration timed out after waiting for response")
         messagebox.showerror("Error", "Server did not respond in time. Please try again later.")
 
-    def read_json_response(self) -> list:
-        """Read complete JSON responses from the socket"""
+    def read_json_response(self, request_id=None) -> list:
+        """Read the next complete JSON response from the socket, or the response to a request sent with an id"""
         try:
-            # Use the get_message method from our socket handler which already handles timeouts
-            data = self.comm_handler.get_message(4096)
+            # Use the get_message method from our socket handler which already handles timeouts;
+            # responses are framed, so this is always exactly one whole response
+            if request_id is not None:
+                data = self.comm_handler.get_response(request_id)
+            else:
+                data = self.comm_handler.get_message()
             if not data:
                 # No data received, but don't print anything to avoid console flooding
                 return []  # Return empty list instead of None
             
-            # Try to decode the JSON
+            # Try to decode the response, JSON or binary as the connection agreed
             try:
-                decoded_data = data.decode('utf-8')
-                
-                # Check if we have multiple JSON objects in the response
-                if decoded_data.count('}{') > 0:
-                    print("Detected multiple JSON objects in response, splitting them")
-                    # Split the response into individual JSON objects
-                    json_objects = []
-                    
-                    # Insert proper delimiters between JSON objects
-                    fixed_data = decoded_data.replace('}{', '},{')
-                    
-                    # Wrap in array brackets if not already present
-                    if not fixed_data.startswith('['):
-                        fixed_data = '[' + fixed_data
-                    if not fixed_data.endswith(']'):
-                        fixed_data = fixed_data + ']'
-                    
-                    try:
-                        # Parse the fixed JSON array
-                        json_objects = json.loads(fixed_data)
-                        return json_objects
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding multiple JSON objects: {e}")
-                        
-                        # Fallback: try to parse each object individually
-                        individual_jsons = []
-                        parts = decoded_data.replace('}{', '}|{').split('|')
-                        for part in parts:
-                            try:
-                                obj = json.loads(part)
-                                individual_jsons.append(obj)
-                            except json.JSONDecodeError:
-                                print(f"Could not parse part: {part[:50]}...")
-                        
-                        return individual_jsons
-                
-                # Single JSON object
-                response = json.loads(decoded_data)
+                response = self.serialization_interface.decode(data)
                 
                 # Ensure we always return a consistent format
                 # If it's a dict, keep it as is
@@ -676,8 +644,8 @@ class ClientApp:
                     print(f"Unexpected response type: {type(response)}")
                     return [{"type": "E", "payload": f"Unexpected response type: {type(response)}"}]
                     
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
+            except ValueError as e:
+                print(f"Error decoding response: {e}")
                 print(f"Received data: {data[:100]}...")  # Show first 100 chars
                 return []
             
@@ -1065,12 +1033,13 @@ class ClientApp:
         self.login_screen()
 
 if __name__ == "__main__":
-    # Use only JSON protocol
-    json_protocol = ClientJsonProtocol()
+    # JSON unless CLIENT_PROTOCOL=binary; the binary encoding is negotiated with each server
+    protocol_type = ProtocolType(os.getenv('CLIENT_PROTOCOL', ProtocolType.JSON.value))
+    protocol = ClientBinaryProtocol() if protocol_type == ProtocolType.BINARY else ClientJsonProtocol()
     
     # Use only socket handler
-    socket_handler = ClientSocketHandler()
+    socket_handler = ClientSocketHandler(encoding=protocol.encoding)
     
-    # Create the app with JSON protocol
-    app = ClientApp(json_protocol, socket_handler)
+    # Create the app with the chosen protocol
+    app = ClientApp(protocol, socket_handler)
     app.root.mainloop()
\ No newline at end of file
@@ -12,6 +12,14 @@ class ClientSerializationInterface:
     @abstractmethod
     def serialize_user_list(self) -> bytes:
         pass
+
+    @abstractmethod
+    def serialize_batch(self, requests) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes):
+        pass
     
     @abstractmethod
     def deserialize_message(self, payload) -> Tuple[str, str, str]:
@@ -1,11 +1,21 @@
+import itertools
+import json
+import re
 import socket
 import threading
-from typing import Callable
+import time
+from collections import deque
+from typing import Callable, Optional
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) # add parent directory to python path
 from interfaces.client_communication_interface import ClientCommunicationInterface
+from backend.protocol.framing import FrameDecoder, encode_frame, MAX_FRAME_SIZE
+from backend.protocol.request_ids import request_id_of
+from backend.protocol.handshake import HELLO, COMPRESSIONS, hello_request
+from backend.protocol.compression import ZLIB, StreamCompressor, StreamDecompressor
+from backend.protocol import binary_codec
 
 # Define server addresses from environment variables with fallbacks
 def get_server_addresses():
@@ -26,13 +36,57 @@ def get_server_addresses():
 # Get server addresses when module is loaded
 SERVER_ADDRESSES = get_server_addresses()
 
+# Requests that only read state; any replica can answer them. A login is not
+# one of them: live messages are pushed only to sessions on the primary.
+READ_MESSAGE_TYPES = ['G', 'GM', 'GS']
+
+# Primary location hint that backups add to their responses
+PRIMARY_HINT = re.compile(rb'"primary": \["([^"]+)", (\d+)\]')
+
 class ClientSocketHandler(ClientCommunicationInterface):
         
-    def __init__(self):
+    def __init__(self, encoding: str = "json"):
+        """
+        Initialize the handler.
+
+        Args:
+            encoding: Encoding to ask servers for, that of the client's protocol; "json" skips the handshake
+        """
         self.server = None
         self.running = False
         self.clients = set()
         self.lock = threading.Lock()
+        self.primary_address = None  # Client address of the primary, learned from responses
+        # Responses arrive as length-prefixed frames; a read may hold part of one or several
+        self.decoder = FrameDecoder()
+        self.responses = deque()
+        # Requests sent with an id whose response is awaited, and responses that came before they were asked for
+        self.request_ids = itertools.count(1)
+        self.awaited = set()
+        self.matched = {}
+        self.preferred_encoding = encoding
+        # What the current connection agreed on in its handshake
+        self.protocol_version = 0
+        self.encoding = "json"
+        self.max_frame_size = MAX_FRAME_SIZE
+        # Compression streams of the current connection, once the server agreed to compress
+        self.compression = None
+        self.compressor = None
+        self.decompressor = None
+        self.hello_pending = False  # The server's answer to our HELLO is the next response
+        self.server_address = None
+        # Server address to the options it agreed on last time, None for a server without a handshake
+        self.server_options = {}
+
+    def _reset_stream(self) -> None:
+        """Forget partial and unread responses of the previous connection"""
+        self.decoder = FrameDecoder()
+        self.responses.clear()
+        self.awaited.clear()
+        self.matched.clear()
+        self.compression = None
+        self.compressor = None
+        self.decompressor = None
 
     def start_server(self, host: str, port: int) -> None:
         try:
@@ -45,6 +99,8 @@ class ClientSocketHandler(ClientCommunicationInterface):
             self.server.connect((host, port))
             # Reset timeout after connection
             self.server.settimeout(None)
+            self._reset_stream()
+            self._handshake((host, port))
             self.running = True
             print(f"Socket server running on {host}:{port}")
             return self.server
@@ -58,9 +114,19 @@ class ClientSocketHandler(ClientCommunicationInterface):
             print(f"Error connecting to server: {e}")
             raise
 
+    def _close_connection(self) -> None:
+        """Close the current connection, if any, so the next request opens a new one"""
+        if self.server:
+            try:
+                self.server.close()
+            except:
+                pass
+            self.server = None
+
     def reconnect(self) -> tuple:
         """Try to reconnect to any available server. Returns (success, new_address)"""
         try:
+            self._close_connection()
             
             # Try all servers
             for host, port in SERVER_ADDRESSES:
@@ -71,6 +137,8 @@ class ClientSocketHandler(ClientCommunicationInterface):
                     self.server.settimeout(10)
                     self.server.connect((host, port))
                     self.server.settimeout(None)
+                    self._reset_stream()
+                    self._handshake((host, port))
                     print(f"Successfully reconnected to {host}:{port}")
                     return True, (host, port)
                 except Exception as e:
@@ -88,6 +156,127 @@ class ClientSocketHandler(ClientCommunicationInterface):
             print(f"Error in reconnection process: {e}")
             return False, None
 
+    def _handshake(self, address) -> None:
+        """
+        Say hello on a new connection.
+
+        The hello goes out with the first request instead of costing a round
+        trip; the answer is read with the first response. A server that agreed
+        before gets requests in the agreed form right away, any other one gets
+        JSON until it has answered, and one without a handshake is not asked again.
+        Compression starts only once the server has answered, as it keeps
+        state for the whole connection.
+        """
+        self.server_address = address
+        self.hello_pending = False
+        known = self.server_options.get(address, {})
+        self._apply_options(known or {})
+        if known is None:
+            return
+        encodings = [self.preferred_encoding] + (["json"] if self.preferred_encoding != "json" else [])
+        try:
+            self.server.sendall(encode_frame(hello_request(encodings, COMPRESSIONS, max_frame_size=MAX_FRAME_SIZE)))
+            self.hello_pending = True
+        except (socket.error, ConnectionError) as e:
+            print(f"Connection error while sending hello: {e}")
+
+    def _apply_options(self, options: dict) -> None:
+        self.protocol_version = options.get('version', 0)
+        self.encoding = options.get('encoding') or "json"
+        self.max_frame_size = options.get('max_frame_size') or MAX_FRAME_SIZE
+
+    def _answer_to_hello(self, response: bytes) -> None:
+        """Take the options the server agreed on; servers without a handshake answer with an error"""
+        self.hello_pending = False
+        try:
+            answer = json.loads(response.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            answer = None
+        if isinstance(answer, dict) and answer.get('type') == HELLO and isinstance(answer.get('payload'), dict):
+            options = answer['payload']
+        else:
+            print(f"Server {self.server_address} has no handshake: {response[:100]}")
+            options = None
+        self.server_options[self.server_address] = options
+        self._apply_options(options or {})
+        self.compression = (options or {}).get('compression')
+        if self.compression == ZLIB:
+            self.compressor = StreamCompressor()
+            self.decompressor = StreamDecompressor()
+        print(f"Server {self.server_address} agreed on version {self.protocol_version}, {self.encoding} encoding, "
+              f"compression {self.compression}")
+
+    def _outgoing(self, message: bytes) -> bytes:
+        """
+        A request in a form the current connection's server accepts.
+
+        Raises:
+            ValueError: If the request is larger than the server accepts
+        """
+        if binary_codec.is_binary(message) and self.encoding != "binary":
+            message = binary_codec.to_json(message)
+        if len(message) > self.max_frame_size:
+            raise ValueError(f"Request of {len(message)} bytes exceeds the server's maximum of {self.max_frame_size}")
+        if self.compressor is not None:
+            message = self.compressor.compress(message)
+        return message
+
+    def redirected(self) -> bool:
+        """Check whether the current connection is to a backup that named another server as the primary"""
+        return self.primary_address is not None and self.primary_address != self.server_address
+
+    def connect_to_primary(self) -> bool:
+        """Connect straight to the cached primary. Returns False, forgetting the hint, if it is unreachable"""
+        if not self.primary_address:
+            return False
+        host, port = self.primary_address
+        self._close_connection()
+        try:
+            print(f"Connecting to primary at {host}:{port}")
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.settimeout(10)
+            self.server.connect((host, port))
+            self.server.settimeout(None)
+            self._reset_stream()
+            self._handshake((host, port))
+            return True
+        except Exception as e:
+            print(f"Failed to connect to primary at {host}:{port}: {e}, trying any replica")
+            try:
+                self.server.close()
+            except:
+                pass
+            self.server = None
+            self.primary_address = None
+            return False
+
+    def remember_primary(self, data: bytes) -> None:
+        """Cache the primary location hint of a response, if it has one"""
+        if binary_codec.is_binary(data):
+            key, value = binary_codec.peek_first_field(data)
+            address = tuple(value) if key == 'primary' and isinstance(value, list) and len(value) == 2 else None
+        else:
+            match = PRIMARY_HINT.search(data[:512])
+            address = (match.group(1).decode('utf-8'), int(match.group(2))) if match else None
+        if address:
+            if address != self.primary_address:
+                print(f"Primary is at {address[0]}:{address[1]}")
+                self.primary_address = address
+
+    @staticmethod
+    def is_write(message: bytes) -> bool:
+        """Check whether a request changes state and therefore has to reach the primary"""
+        try:
+            if binary_codec.is_binary(message):
+                request = binary_codec.decode(message)
+            else:
+                request = json.loads(message.decode('utf-8'))
+            if request.get('type') == 'BATCH':
+                return any(op.get('type') not in READ_MESSAGE_TYPES for op in request.get('payload'))
+            return request.get('type') not in READ_MESSAGE_TYPES
+        except (ValueError, AttributeError, TypeError):
+            return True
+
     def stop_server(self) -> None:
         self.running = False
         if self.server:
@@ -100,36 +289,171 @@ class ClientSocketHandler(ClientCommunicationInterface):
                     pass
             self.clients.clear()
 
-    def send_message(self, message: bytes) -> bool:
-        """Send a message to the server"""
+    def _connect_for(self, message: bytes) -> bool:
+        """
+        Make sure the current connection can answer the message, opening a new one if not.
+
+        The connection is kept across requests, so its handshake and
+        compression streams are paid for once; a new one is only opened
+        when there is none, or for a write once a backup has said where the
+        primary is.
+        """
+        if self.server and not (self.redirected() and self.is_write(message)):
+            return True
         print(f"connect to server")
-        success, new_address = self.reconnect()
+        # Writes go straight to the primary instead of being relayed by a backup
+        if self.is_write(message) and self.connect_to_primary():
+            success, new_address = True, self.primary_address
+        else:
+            success, new_address = self.reconnect()
         if not success:
             print("Not connected to server")
             return False
         print(f"connected to server: {new_address}")
+        return True
+
+    def send_message(self, message: bytes) -> bool:
+        """Send a message to the server, reconnecting once if the connection was lost"""
+        for attempt in range(2):
+            if not self._connect_for(message):
+                return False
+            try:
+                print(f"Sending message: {message[:100]}...")
+                self.server.sendall(encode_frame(self._outgoing(message)))
+                print("Message sent successfully")
+                return True
+            except ValueError as e:
+                print(f"Message not sent: {e}")
+                return False
+            except (socket.error, ConnectionError) as e:
+                print(f"Connection error while sending: {e}")
+                self._close_connection()
+        return False
+
+    def send_request(self, message: bytes) -> Optional[int]:
+        """
+        Send a request tagged with an id on the current connection, without waiting for its response.
+
+        Several requests can be in flight at once; the server answers them
+        concurrently and each response carries the id of its request.
+
+        Args:
+            message: Request, JSON or binary
+
+        Returns:
+            The id to pass to get_response, or None if the request could not be sent
+        """
+        if not self.server and not self._connect_for(message):
+            return None
+        request_id = next(self.request_ids)
+        if binary_codec.is_binary(message):
+            tagged = binary_codec.with_request_id(message, request_id)
+        else:
+            tagged = json.dumps(dict(id=request_id, **json.loads(message.decode('utf-8')))).encode('utf-8')
         try:
-            print(f"Sending message: {message[:100]}...")
-            self.server.sendall(message)
-            print("Message sent successfully")
-            return True
+            print(f"Sending request {request_id}: {tagged[:100]}...")
+            self.server.sendall(encode_frame(self._outgoing(tagged)))
+        except ValueError as e:
+            print(f"Request not sent: {e}")
+            return None
         except (socket.error, ConnectionError) as e:
             print(f"Connection error while sending: {e}")
+            self._close_connection()
+            return None
+        self.awaited.add(request_id)
+        return request_id
+
+    def get_response(self, request_id: int, timeout: float = 10.0) -> bytes:
+        """
+        Wait for the response to a request sent with send_request.
+
+        Responses to other requests are kept until they are asked for, and
+        messages without an id are left for get_message.
+
+        Args:
+            request_id: Id returned by send_request
+            timeout: Seconds to wait
 
-    def get_message(self, buffer_size: int = 4096) -> bytes:
-        """Get a message from the server"""
+        Returns:
+            The response, or b'' if it did not arrive within the timeout
+        """
+        deadline = time.time() + timeout
+        try:
+            while request_id not in self.matched:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.server:
+                    print(f"No response to request {request_id}")
+                    return b''
+                self.server.settimeout(remaining)
+                data = self.server.recv(65536)
+                if not data:
+                    print("Server closed the connection")
+                    self._close_connection()
+                    return b''
+                for response in self.decoder.feed(data):
+                    self._sort_response(response)
+            self.server.settimeout(None)
+        except socket.timeout:
+            print(f"No response to request {request_id}")
+            return b''
+        except (socket.error, ConnectionError) as e:
+            print(f"Connection error while receiving: {e}")
+            self._close_connection()
+            return b''
+        finally:
+            self.awaited.discard(request_id)
+        return self.matched.pop(request_id)
+
+    def _sort_response(self, response: bytes) -> None:
+        """Keep a response for the request that awaits it, or queue it for get_message"""
+        if self.hello_pending:
+            self._answer_to_hello(response)
+            return
+        if self.decompressor is not None:
+            try:
+                response = self.decompressor.decompress(response, MAX_FRAME_SIZE)
+            except ValueError as e:
+                # The rest of the stream cannot be decompressed either
+                raise ConnectionError(f"Undecodable response: {e}")
+        self.remember_primary(response)
+        if binary_codec.is_binary(response):
+            request_id = binary_codec.peek_request_id(response)
+        else:
+            request_id = request_id_of(response)
+        if request_id in self.awaited:
+            self.matched[request_id] = response
+        else:
+            self.responses.append(response)
+
+    def get_message(self, buffer_size: int = 65536, timeout: float = 0.5) -> bytes:
+        """Get the next complete response from the server, or b'' if none arrives within the timeout"""
+        if self.responses:
+            return self.responses.popleft()
         if not self.server:
             return b''
         print(f"connected to server: {self.server}")
+        deadline = time.time() + timeout
         try:
-            # Set a short timeout to avoid blocking indefinitely
-            self.server.settimeout(0.5)
-            data = self.server.recv(buffer_size)
+            # Keep reading until a whole frame is in, however the response was split
+            while not self.responses:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return b''
+                self.server.settimeout(remaining)
+                data = self.server.recv(buffer_size)
+                if not data:
+                    print("Server closed the connection")
+                    self._close_connection()
+                    return b''
+                for response in self.decoder.feed(data):
+                    self._sort_response(response)
             # Reset timeout to default
             self.server.settimeout(None)
-            return data
+            return self.responses.popleft()
         except socket.timeout:
             # This is expected, just return empty bytes silently
             return b''
         except (socket.error, ConnectionError) as e:
-            print(f"Connection error while receiving: {e}")
\ No newline at end of file
+            print(f"Connection error while receiving: {e}")
+            self._close_connection()
+            return b''
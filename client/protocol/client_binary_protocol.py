@@ -0,0 +1,27 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) # add parent directory to python path
+from protocol.client_json_protocol import ClientJsonProtocol
+from backend.protocol import binary_codec
+
+class ClientBinaryProtocol(ClientJsonProtocol):
+    """
+    Compact binary encoding of the same messages.
+
+    Requests are encoded straight from their fields, with a type byte,
+    one byte keys and varint lengths instead of JSON. Responses may still be
+    JSON, from servers that did not agree to the binary encoding, so both are
+    decoded; the payloads come out the same either way.
+    """
+    encoding = "binary"
+
+    def encode(self, data) -> bytes:
+        """Encode a request"""
+        return binary_codec.encode(data)
+
+    def decode(self, data: bytes):
+        """Decode a response or pushed message; raises ValueError if it is malformed"""
+        if binary_codec.is_binary(data):
+            return binary_codec.decode(data)
+        return super().decode(data)
@@ -8,9 +8,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) # a
 from interfaces.client_serialization_interface import ClientSerializationInterface
 
 class ClientJsonProtocol(ClientSerializationInterface):
+    encoding = "json"  # Encoding the socket handler negotiates for this protocol
+
     def __init__(self):
         super().__init__()
 
+    def encode(self, data) -> bytes:
+        """Encode a request"""
+        return json.dumps(data, default=self._json_serial).encode('utf-8')
+
+    def decode(self, data: bytes):
+        """Decode a response or pushed message; raises ValueError if it is malformed"""
+        return json.loads(data.decode('utf-8'))
+
     def serialize_message(self, msg_type: str, payload_data: list) -> bytes:
         """Serialize a message with type and payload"""
         if msg_type == 'M':  # Chat message
@@ -60,7 +70,7 @@ class ClientJsonProtocol(ClientSerializationInterface):
                 "payload": payload_data
             }
         
-        return json.dumps(data, default=self._json_serial).encode('utf-8')
+        return self.encode(data)
 
     def _json_serial(self, obj):
         """JSON serializer for objects not serializable by default json code"""
@@ -74,7 +84,15 @@ class ClientJsonProtocol(ClientSerializationInterface):
             "type": "G",
             "payload": None
         }
-        return json.dumps(data).encode('utf-8')
+        return self.encode(data)
+
+    def serialize_batch(self, requests: List[bytes]) -> bytes:
+        """Combine serialized requests into one BATCH request, answered with one response per request"""
+        data = {
+            "type": "BATCH",
+            "payload": [self.decode(request) for request in requests]
+        }
+        return self.encode(data)
 
     def deserialize_message(self, payload: dict) -> Tuple[str, str, str]:
         """Deserialize a chat message"""
@@ -202,4 +220,4 @@ class ClientJsonProtocol(ClientSerializationInterface):
                 "receiver": receiver
             }
         }
-        return json.dumps(data).encode('utf-8')
\ No newline at end of file
+        return self.encode(data)
\ No newline at end of file
@@ -29,11 +29,13 @@ sys.modules['interfaces.client_communication_interface'] = MagicMock()
 protocol_mock = MagicMock()
 sys.modules['protocol'] = protocol_mock
 sys.modules['protocol.client_json_protocol'] = MagicMock()
+sys.modules['protocol.client_binary_protocol'] = MagicMock()
 
 # Mock the client protocol module
 client_protocol_mock = MagicMock()
 sys.modules['client.protocol'] = client_protocol_mock
 sys.modules['client.protocol.client_json_protocol'] = MagicMock()
+sys.modules['client.protocol.client_binary_protocol'] = MagicMock()
 
 # Mock the client network module
 client_network_mock = MagicMock()
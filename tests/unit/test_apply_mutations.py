@@ -0,0 +1,73 @@
+"""
+Unit tests for recording and applying storage mutations.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.database.file_operations import FileOperation
+from backend.replication.mutation_log import (RecordingStorage, build_mutation_operation,
+                                               mutations_from_operation, apply_mutations)
+
+class TestMutationLog(unittest.TestCase):
+    """Unit tests for RecordingStorage and apply_mutations."""
+
+    def setUp(self):
+        """Create a primary and a backup storage in temporary directories."""
+        self.primary_dir = tempfile.mkdtemp()
+        self.backup_dir = tempfile.mkdtemp()
+        self.primary = RecordingStorage(FileOperation(self.primary_dir))
+        self.backup = FileOperation(self.backup_dir)
+
+    def tearDown(self):
+        """Remove the temporary directories."""
+        shutil.rmtree(self.primary_dir, ignore_errors=True)
+        shutil.rmtree(self.backup_dir, ignore_errors=True)
+
+    def _replay(self, mutations):
+        """Send mutations through the log format and apply them on the backup."""
+        apply_mutations(self.backup, mutations_from_operation(build_mutation_operation(mutations)))
+
+    def test_backup_files_are_identical(self):
+        """Test that applied mutations leave the backup byte-identical, including bytes, timestamps and IDs."""
+        with self.primary.record_mutations() as mutations:
+            self.primary.insert("users", {"user_name": "alice", "user_password": b"$2b$12$hash", "view_count": 5})
+            self.primary.insert("messages", {"sender": "alice", "receiver": "bob", "message": "hi",
+                                             "timestamp": datetime.now()})
+            self.primary.update("users", {"user_name": "alice"}, {"log_off_time": datetime.now()})
+        self._replay(mutations)
+
+        self.assertEqual(len(mutations), 3)
+        self.assertIn("_id", mutations[0]["document"])
+        for name in ["users.json", "messages.json"]:
+            with open(os.path.join(self.primary_dir, name)) as a, open(os.path.join(self.backup_dir, name)) as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(self.backup.read("users", {"user_name": "alice"})[0]["user_password"], b"$2b$12$hash")
+
+    def test_only_changes_on_the_recording_thread_are_recorded(self):
+        """Test that reads, failed writes and other threads' writes are not recorded."""
+        with self.primary.record_mutations() as mutations:
+            self.primary.read("users", {})
+            self.primary.delete("users", {"user_name": "nobody"})
+            other = threading.Thread(target=self.primary.insert, args=("users", {"user_name": "bob"}))
+            other.start()
+            other.join()
+        self.assertEqual(mutations, [])
+
+    def test_other_operations_are_not_mutation_entries(self):
+        """Test that client operations and configuration entries are told apart from mutation entries."""
+        self.assertIsNone(mutations_from_operation(json.dumps({"type": "M", "payload": {"message": "MUTATIONS"}})))
+        self.assertIsNone(mutations_from_operation(json.dumps({"type": "CONFIG", "members": {}})))
+        self.assertEqual(mutations_from_operation(build_mutation_operation([])), [])
+
+if __name__ == '__main__':
+    unittest.main()
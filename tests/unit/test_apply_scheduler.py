@@ -0,0 +1,102 @@
+"""
+Unit tests for the ApplyScheduler class.
+"""
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.database.file_operations import FileOperation
+from backend.replication.apply_scheduler import ApplyScheduler
+from backend.replication.mutation_log import apply_mutations
+
+class TestApplyScheduler(unittest.TestCase):
+    """Unit tests for the ApplyScheduler class."""
+
+    def setUp(self):
+        """Create a scheduler whose entries sleep for a given time and record their order."""
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.logged = []
+        self.scheduler = ApplyScheduler(self._apply, lambda entry: entry["keys"], max_workers=4)
+
+    def tearDown(self):
+        """Stop the worker threads."""
+        self.scheduler.stop()
+
+    def _apply(self, entry):
+        with self.lock:
+            self.started.append(entry["index"])
+        time.sleep(entry.get("delay", 0))
+        if entry.get("fail"):
+            raise ValueError("cannot apply")
+        with self.lock:
+            self.finished.append(entry["index"])
+
+    def _entries(self, *specs):
+        return [dict(spec, index=index) for index, spec in enumerate(specs, start=1)]
+
+    def test_independent_entries_run_in_parallel_and_log_in_order(self):
+        """Test that entries on different keys overlap while the log stays in index order."""
+        entries = self._entries(*[{"keys": [f"user:{n}"], "delay": 0.1} for n in range(4)])
+        start = time.time()
+        self.assertTrue(self.scheduler.run(entries, lambda entry: self.logged.append(entry["index"])))
+        self.assertLess(time.time() - start, 0.3)
+        self.assertEqual(self.logged, [1, 2, 3, 4])
+
+    def test_same_key_keeps_log_order(self):
+        """Test that a later entry on the same key waits even when the earlier one is slow."""
+        entries = self._entries({"keys": ["conversation:a|b"], "delay": 0.1},
+                                {"keys": ["user:c"]},
+                                {"keys": ["conversation:a|b"]})
+        self.assertTrue(self.scheduler.run(entries, lambda entry: self.logged.append(entry["index"])))
+        self.assertLess(self.finished.index(2), self.finished.index(1))
+        self.assertLess(self.finished.index(1), self.finished.index(3))
+        self.assertEqual(self.logged, [1, 2, 3])
+
+    def test_entry_without_keys_is_a_barrier(self):
+        """Test that an entry that may touch anything runs alone."""
+        entries = self._entries({"keys": ["user:a"], "delay": 0.05}, {"keys": None}, {"keys": ["user:b"]})
+        self.assertTrue(self.scheduler.run(entries, lambda entry: None))
+        self.assertEqual(self.finished, [1, 2, 3])
+
+    def test_failure_stops_the_log(self):
+        """Test that entries after a failed one are not logged."""
+        entries = self._entries({"keys": ["user:a"]}, {"keys": ["user:a"], "fail": True}, {"keys": ["user:a"]})
+        self.assertFalse(self.scheduler.run(entries, lambda entry: self.logged.append(entry["index"])))
+        self.assertEqual(self.logged, [1])
+        self.assertNotIn(3, self.started)
+
+    def test_retry_after_failure_does_not_duplicate(self):
+        """Test that entries applied alongside a failed one are not inserted twice when it is retried."""
+        storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_dir)
+        storage = FileOperation(storage_dir)
+        failures = [2]
+        def apply(entry):
+            if entry["index"] in failures:
+                time.sleep(0.1)
+                failures.remove(entry["index"])
+                raise ValueError("cannot apply")
+            apply_mutations(storage, entry["mutations"])
+        scheduler = ApplyScheduler(apply, lambda entry: entry["keys"], max_workers=4)
+        self.addCleanup(scheduler.stop)
+        entries = self._entries(*[{"keys": [f"conversation:a|{n}"], "mutations": [
+            {"op": "insert", "collection": "messages", "document": {"_id": f"m{n}", "sender": "a", "receiver": n}}]}
+            for n in "bcd"])
+
+        self.assertFalse(scheduler.run(entries, lambda entry: self.logged.append(entry["index"])))
+        self.assertEqual(self.logged, [1])
+        self.assertTrue(scheduler.run(entries[1:], lambda entry: self.logged.append(entry["index"])))
+        self.assertEqual(self.logged, [1, 2, 3])
+        self.assertEqual(sorted(doc["_id"] for doc in storage.read("messages", {})), ["mb", "mc", "md"])
+
+if __name__ == '__main__':
+    unittest.main()
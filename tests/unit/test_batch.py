@@ -0,0 +1,97 @@
+"""
+Unit tests for batch requests and the storage read pass that serves them.
+"""
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.batch import (MAX_BATCH_OPERATIONS, batch_request, batch_response, parse_batch, runs,
+                                    split_batch_response)
+from backend.database.file_operations import FileOperation
+from backend.socket.request_scheduler import RequestScheduler
+
+class TestBatch(unittest.TestCase):
+    """Unit tests for the batch module."""
+
+    def test_parse_batch(self):
+        """Test that only well formed batches are accepted."""
+        operations = [{"type": "GS", "payload": ["alice"]}, {"type": "G", "payload": None}]
+        self.assertEqual(parse_batch(batch_request(operations)), operations)
+        self.assertIsNone(parse_batch(b'{"type": "G", "payload": null}'))
+        for payload in [{"type": "G"}, [{"type": "G"}] * (MAX_BATCH_OPERATIONS + 1), [{"type": "BATCH", "payload": []}]]:
+            with self.assertRaises(ValueError):
+                parse_batch(json.dumps({"type": "BATCH", "payload": payload}).encode('utf-8'))
+
+    def test_consecutive_reads_form_one_run(self):
+        """Test that reads are grouped between logins and writes, keeping the order."""
+        types = ['L', 'G', 'GS', 'GM', 'M', 'GM', 'W']
+        self.assertEqual([[op["type"] for op in run] for run in runs([{"type": t} for t in types])],
+                         [['L'], ['G', 'GS', 'GM'], ['M'], ['GM'], ['W']])
+
+    def test_responses_round_trip(self):
+        """Test that responses are combined and split again, with plain text turned into errors."""
+        response = batch_response([b'{"type": "S", "payload": "ok"}', b'No primary available', None])
+        self.assertEqual(split_batch_response(response, 3), [
+            b'{"type": "S", "payload": "ok"}',
+            b'{"type": "E", "payload": "No primary available"}',
+            b'{"type": "E", "payload": "No response"}',
+        ])
+
+    def test_failed_batch_answers_every_operation(self):
+        """Test that an error for the whole batch becomes each operation's response."""
+        error = b'[{"type": "E", "payload": "No primary server available"}]'
+        self.assertEqual(split_batch_response(error, 2), [error, error])
+        self.assertEqual(split_batch_response(batch_response([error]), 2), [batch_response([error])] * 2)
+
+    def test_batch_is_scheduled_by_its_most_expensive_operation(self):
+        """Test that a batch holding a login waits for an auth worker."""
+        scheduler = RequestScheduler(lambda data, client_socket=None: b'')
+        self.assertEqual(scheduler.classify(batch_request([{"type": "L"}, {"type": "G"}])), 'auth')
+        self.assertEqual(scheduler.classify(batch_request([{"type": "G"}, {"type": "M"}])), 'write')
+        self.assertEqual(scheduler.classify(batch_request([{"type": "G"}, {"type": "GM"}])), 'read')
+
+class TestReadPass(unittest.TestCase):
+    """Unit tests for FileOperation.read_pass."""
+
+    def setUp(self):
+        """Create storage in a temporary directory."""
+        self.dir = tempfile.mkdtemp()
+        self.storage = FileOperation(self.dir)
+        self.storage.insert("users", {"user_name": "alice"})
+        self.storage.insert("messages", {"sender": "alice", "receiver": "bob", "message": "hi"})
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.dir)
+
+    def _reads(self):
+        self.storage.read("users", {"user_name": "alice"})
+        self.storage.read("users", {})
+        self.storage.read("messages", {"sender": "alice"})
+        return self.storage.read("messages", {"receiver": "alice"})
+
+    def test_collections_load_once_per_pass(self):
+        """Test that each collection file is parsed once inside a read pass and on every read outside it."""
+        with patch.object(self.storage, '_load_collection', wraps=self.storage._load_collection) as load:
+            with self.storage.read_pass():
+                self._reads()
+            self.assertEqual(load.call_count, 2)
+            self._reads()
+            self.assertEqual(load.call_count, 6)
+
+    def test_writes_are_not_served_from_the_pass(self):
+        """Test that writes inside a read pass see and keep the current file contents."""
+        with self.storage.read_pass():
+            self.storage.read("users", {})
+            self.storage.insert("users", {"user_name": "bob"})
+        self.assertEqual([doc["user_name"] for doc in self.storage.read("users", {})], ["alice", "bob"])
+
+if __name__ == '__main__':
+    unittest.main()
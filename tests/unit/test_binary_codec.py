@@ -0,0 +1,131 @@
+"""
+Unit tests for the binary message encoding and the handshake that selects it.
+"""
+import json
+import socket
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol import binary_codec
+from backend.protocol.framing import encode_frame, recv_frame
+from backend.protocol.handshake import hello_request
+from backend.socket.socket_handler import SocketHandler
+from backend.socket.event_socket_handler import EventSocketHandler
+
+class TestBinaryCodec(unittest.TestCase):
+    """Unit tests for the binary_codec module."""
+
+    def test_round_trip(self):
+        """Test that messages decode to exactly what was encoded."""
+        messages = [
+            {"type": "M", "payload": {"sender": "alice", "recipient": "bob", "message": "héllo"}},
+            {"type": "BM", "payload": {"bob": [{"sender": "bob", "receiver": "alice", "message": "x" * 300,
+                                                "timestamp": "2024-01-01T00:00:00", "_id": ""}]}},
+            {"type": "V", "payload": {"log_off_time": None, "view_count": 5}},
+            {"type": "NEW", "payload": [0, -1, 2 ** 40, -(2 ** 40), 1.5, True, False, {"unknown key": []}]},
+            [{"type": "M", "payload": "a"}, {"type": "M", "payload": "b"}],
+            {"no type": 1},
+        ]
+        for message in messages:
+            self.assertEqual(binary_codec.decode(binary_codec.encode(message)), message)
+
+    def test_request_ids(self):
+        """Test that a request id travels in the header and can be read without decoding."""
+        data = binary_codec.encode({"id": 12, "type": "GM", "payload": ["alice"]})
+        self.assertEqual(binary_codec.peek_request_id(data), 12)
+        self.assertEqual(binary_codec.decode(data), {"id": 12, "type": "GM", "payload": ["alice"]})
+        tagged = binary_codec.with_request_id(binary_codec.encode({"type": "G", "payload": None}), 3)
+        self.assertEqual(binary_codec.decode(tagged), {"id": 3, "type": "G", "payload": None})
+        self.assertIsNone(binary_codec.peek_request_id(b'{"id": 3}'))
+        # Error paths answer with an array; its first message carries the id and the primary hint
+        errors = binary_codec.from_json(b'[{"id": 5, "primary": ["10.0.0.1", 8091], "type": "E", "payload": "x"}]')
+        self.assertEqual(binary_codec.peek_request_id(errors), 5)
+        self.assertEqual(binary_codec.peek_first_field(errors), ("primary", ["10.0.0.1", 8091]))
+        self.assertEqual(binary_codec.decode(errors)[0]["id"], 5)
+
+    def test_smaller_than_json(self):
+        """Test that a chat message takes far fewer bytes than in JSON."""
+        message = {"type": "M", "payload": {"sender": "alice", "recipient": "bob", "message": "hi"}}
+        self.assertLess(len(binary_codec.encode(message)), len(json.dumps(message)) / 2)
+
+    def test_json_conversion(self):
+        """Test conversion to and from JSON, including plain text error responses."""
+        data = b'{"primary": ["10.0.0.1", 8091], "type": "S", "payload": "ok"}'
+        self.assertEqual(json.loads(binary_codec.to_json(binary_codec.from_json(data))), json.loads(data))
+        self.assertEqual(binary_codec.peek_first_field(binary_codec.from_json(data)), ("primary", ["10.0.0.1", 8091]))
+        self.assertEqual(binary_codec.decode(binary_codec.from_json(b'No primary available')),
+                         {"type": "E", "payload": "No primary available"})
+        self.assertEqual(binary_codec.from_json(b''), b'')
+
+    def test_malformed_messages(self):
+        """Test that truncated or foreign data raises ValueError."""
+        data = binary_codec.encode({"type": "M", "payload": "hello"})
+        for bad in [data[:-1], data + b'\x00', b'{"type": "M"}', bytes([binary_codec.MAGIC, 0, 99])]:
+            with self.assertRaises(ValueError):
+                binary_codec.decode(bad)
+
+class EchoController:
+    """Answers with the request it was handed, so tests see what request handling got."""
+
+    def handle_incoming_message(self, data, client_socket=None):
+        request = json.loads(data.decode('utf-8'))
+        return json.dumps({"type": "S", "payload": request}).encode('utf-8')
+
+class HandshakeTests:
+    """Encoding negotiation of a client connection; mixed into a test case per handler."""
+
+    def create_handler(self, controller):
+        raise NotImplementedError
+
+    def setUp(self):
+        """Start a handler on a free port."""
+        self.handler = self.create_handler(EchoController())
+        self.assertTrue(self.handler.start_server())
+        self.sock = socket.create_connection(self.handler.socket.getsockname(), timeout=5)
+
+    def tearDown(self):
+        """Stop the handler."""
+        self.sock.close()
+        self.handler.stop_server()
+
+    def _call(self, data):
+        self.sock.sendall(encode_frame(data))
+        return recv_frame(self.sock)
+
+    def test_binary_after_hello(self):
+        """Test that binary requests reach request handling as JSON and are answered in binary."""
+        hello = json.loads(self._call(hello_request(["cbor", "binary", "json"])))
+        self.assertEqual((hello["type"], hello["payload"]["encoding"]), ("HELLO", "binary"))
+        request = {"type": "M", "payload": {"sender": "alice", "recipient": "bob", "message": "hi"}}
+        response = self._call(binary_codec.encode(request))
+        self.assertTrue(binary_codec.is_binary(response))
+        self.assertEqual(binary_codec.decode(response), {"type": "S", "payload": request})
+
+    def test_json_without_hello(self):
+        """Test that clients that never say hello are answered in JSON."""
+        self.assertEqual(json.loads(self._call(b'{"type": "G", "payload": null}')),
+                         {"type": "S", "payload": {"type": "G", "payload": None}})
+
+    def test_unknown_encoding_falls_back_to_json(self):
+        """Test that a hello offering nothing the server speaks leaves the connection on JSON."""
+        self.assertEqual(json.loads(self._call(hello_request(["cbor"])))["payload"]["encoding"], "json")
+        self.assertEqual(json.loads(self._call(b'{"type": "G", "payload": null}'))["type"], "S")
+
+class TestThreadHandlerHandshake(HandshakeTests, unittest.TestCase):
+    """Handshakes on the thread per client handler."""
+
+    def create_handler(self, controller):
+        return SocketHandler("127.0.0.1", 0, controller)
+
+class TestEventHandlerHandshake(HandshakeTests, unittest.TestCase):
+    """Handshakes on the event loop handler."""
+
+    def create_handler(self, controller):
+        return EventSocketHandler("127.0.0.1", 0, controller, workers=2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Unit tests for per-connection compression.
+"""
+import json
+import socket
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol import binary_codec
+from backend.protocol.compression import COMPRESSED, COMPRESSION_THRESHOLD, StreamCompressor, StreamDecompressor
+from backend.protocol.framing import encode_frame, recv_frame
+from backend.protocol.handshake import Capabilities, ConnectionOptions, hello_request
+from backend.socket.socket_handler import SocketHandler
+from backend.socket.event_socket_handler import EventSocketHandler
+
+def history(count):
+    """A BM response with count messages, as repetitive as real ones."""
+    messages = [{"sender": "alice", "receiver": "bob", "message": f"message number {n}",
+                 "timestamp": f"2024-01-01T00:{n // 60 % 60:02d}:{n % 60:02d}", "_id": f"1704067200.{n}_0"}
+                for n in range(count)]
+    return json.dumps({"type": "BM", "payload": {"bob": messages}}).encode('utf-8')
+
+class TestStreamCompression(unittest.TestCase):
+    """Unit tests for StreamCompressor and StreamDecompressor."""
+
+    def test_round_trip_above_threshold(self):
+        """Test that large messages are compressed and restored, and small ones left alone."""
+        compressor, decompressor = StreamCompressor(), StreamDecompressor()
+        small = b'{"type": "S", "payload": "ok"}'
+        self.assertEqual(compressor.compress(small), small)
+        for message in [history(200), small, history(10), binary_codec.from_json(history(50))]:
+            data = compressor.compress(message)
+            self.assertEqual(decompressor.decompress(data, 1 << 20), message)
+        self.assertEqual(compressor.compress(history(200))[0], COMPRESSED)
+
+    def test_history_shrinks(self):
+        """Test that a message history compresses to a fraction of its size."""
+        message = history(500)
+        self.assertLess(len(StreamCompressor().compress(message)), len(message) / 5)
+
+    def test_context_persists_across_messages(self):
+        """Test that a message repeating an earlier one costs far less than the first."""
+        compressor = StreamCompressor()
+        message = history(100)
+        first = compressor.compress(message)
+        second = compressor.compress(message)
+        self.assertLess(len(second), len(first) / 4)
+
+    def test_limits(self):
+        """Test that oversized and corrupt messages are rejected."""
+        data = StreamCompressor().compress(b'x' * (COMPRESSION_THRESHOLD * 10))
+        with self.assertRaises(ValueError):
+            StreamDecompressor().decompress(data, COMPRESSION_THRESHOLD)
+        with self.assertRaises(ValueError):
+            StreamDecompressor().decompress(bytes([COMPRESSED]) + b'not zlib', 1 << 20)
+
+    def test_negotiation(self):
+        """Test that compression is only used when both sides offer it."""
+        options = ConnectionOptions(Capabilities(compressions=[]))
+        options.answer_hello(hello_request(["json"], ["zlib"]))
+        self.assertIsNone(options.compression)
+        self.assertEqual(options.compress(history(100)), history(100))
+        with self.assertRaises(ValueError):
+            options.decode_request(StreamCompressor().compress(history(100)))
+        options = ConnectionOptions()
+        answer = json.loads(options.answer_hello(hello_request(["json"], ["lz4", "zlib"])))
+        self.assertEqual(answer["payload"]["compression"], "zlib")
+
+class EchoController:
+    """Answers every request with a message history, and echoes the request's size."""
+
+    def handle_incoming_message(self, data, client_socket=None):
+        request = json.loads(data.decode('utf-8'))
+        response = json.loads(history(300))
+        response["size"] = len(json.dumps(request))
+        return json.dumps(response).encode('utf-8')
+
+class CompressionTests:
+    """Compressed connections; mixed into a test case per handler."""
+
+    def create_handler(self, controller):
+        raise NotImplementedError
+
+    def setUp(self):
+        """Start a handler on a free port."""
+        self.handler = self.create_handler(EchoController())
+        self.assertTrue(self.handler.start_server())
+        self.sock = socket.create_connection(self.handler.socket.getsockname(), timeout=5)
+
+    def tearDown(self):
+        """Stop the handler."""
+        self.sock.close()
+        self.handler.stop_server()
+
+    def test_compressed_both_ways(self):
+        """Test that large requests and responses are compressed once agreed, on one stream per direction."""
+        self.sock.sendall(encode_frame(hello_request(["json"], ["zlib"])))
+        self.assertEqual(json.loads(recv_frame(self.sock))["payload"]["compression"], "zlib")
+        compressor, decompressor = StreamCompressor(), StreamDecompressor()
+        request = json.dumps({"type": "M", "payload": "y" * 5000}).encode('utf-8')
+        for _ in range(3):
+            self.sock.sendall(encode_frame(compressor.compress(request)))
+            data = recv_frame(self.sock)
+            self.assertEqual(data[0], COMPRESSED)
+            response = json.loads(decompressor.decompress(data, 1 << 20))
+            self.assertEqual((response["type"], response["size"]), ("BM", len(request)))
+            self.assertLess(len(data), len(history(300)) / 5)
+
+    def test_uncompressed_without_agreement(self):
+        """Test that clients that did not ask for compression get plain responses."""
+        self.sock.sendall(encode_frame(b'{"type": "GM", "payload": ["alice"]}'))
+        self.assertEqual(json.loads(recv_frame(self.sock))["type"], "BM")
+
+class TestThreadHandlerCompression(CompressionTests, unittest.TestCase):
+    """Compression on the thread per client handler."""
+
+    def create_handler(self, controller):
+        return SocketHandler("127.0.0.1", 0, controller)
+
+class TestEventHandlerCompression(CompressionTests, unittest.TestCase):
+    """Compression on the event loop handler."""
+
+    def create_handler(self, controller):
+        return EventSocketHandler("127.0.0.1", 0, controller, workers=2)
+
+if __name__ == '__main__':
+    unittest.main()
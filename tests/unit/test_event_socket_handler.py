@@ -0,0 +1,91 @@
+"""
+Unit tests for the EventSocketHandler class.
+"""
+import json
+import socket
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.framing import FrameDecoder, encode_frame
+from backend.socket.event_socket_handler import EventSocketHandler
+
+class EchoController:
+    """Answers each request with its payload; requests asking for it are slow."""
+
+    def __init__(self):
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    def handle_incoming_message(self, data, client_socket):
+        request = json.loads(data.decode('utf-8'))
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(request.get("delay", 0))
+        with self.lock:
+            self.active -= 1
+        return json.dumps({"type": "S", "payload": request["payload"]}).encode('utf-8')
+
+def request(payload, **options):
+    return json.dumps(dict(options, payload=payload)).encode('utf-8')
+
+class TestEventSocketHandler(unittest.TestCase):
+    """Unit tests for the EventSocketHandler class."""
+
+    def setUp(self):
+        """Start a handler on a free port."""
+        self.controller = EchoController()
+        self.handler = EventSocketHandler("127.0.0.1", 0, self.controller, workers=4)
+        self.assertTrue(self.handler.start_server())
+        self.address = self.handler.socket.getsockname()
+        self.sockets = []
+
+    def tearDown(self):
+        """Close the clients and stop the handler."""
+        for sock in self.sockets:
+            sock.close()
+        self.handler.stop_server()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        self.sockets.append(sock)
+        return sock
+
+    def _read_frames(self, sock, count):
+        decoder, frames = FrameDecoder(), []
+        while len(frames) < count:
+            frames.extend(decoder.feed(sock.recv(65536)))
+        return [json.loads(frame)["payload"] for frame in frames]
+
+    def test_pipelined_requests_answered_in_order(self):
+        """Test that requests sent back to back get their responses in request order."""
+        sock = self._connect()
+        sock.sendall(encode_frame(request("first", delay=0.1)) + encode_frame(request("second"))
+                     + encode_frame(request("x" * 200000)))
+        self.assertEqual(self._read_frames(sock, 3), ["first", "second", "x" * 200000])
+
+    def test_connections_share_the_worker_pool(self):
+        """Test that many connections are served at once, by no more than the configured workers."""
+        clients = [self._connect() for _ in range(50)]
+        start = time.time()
+        for n, sock in enumerate(clients):
+            sock.sendall(encode_frame(request(n, delay=0.05)))
+        self.assertEqual([self._read_frames(sock, 1)[0] for sock in clients], list(range(50)))
+        self.assertLessEqual(self.controller.most_active, 4)
+        self.assertLess(time.time() - start, 2)
+
+    def test_unframed_client_still_served(self):
+        """Test that a client sending bare JSON gets a bare JSON response."""
+        sock = self._connect()
+        sock.sendall(request("plain"))
+        self.assertEqual(json.loads(sock.recv(65536))["payload"], "plain")
+
+if __name__ == '__main__':
+    unittest.main()
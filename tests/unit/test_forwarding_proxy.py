@@ -0,0 +1,160 @@
+"""
+Unit tests for the ForwardingProxy class.
+"""
+import json
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.replication.forwarding_proxy import ForwardingProxy, REQUEST_ID
+from backend.protocol.framing import send_frame, recv_frame
+from backend.replication.replication_manager import ReplicationManager
+
+class FakePrimary:
+    """Minimal primary: answers each request with its payload repeated, slow requests last."""
+
+    def __init__(self, streams=True):
+        self.streams = streams
+        self.connections = 0
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.address = self.server.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _answer(self, data):
+        request = json.loads(data.decode('utf-8'))
+        if request.get("slow"):
+            time.sleep(0.3)
+        return json.dumps({"payload": request["payload"] * request.get("repeat", 1)}).encode('utf-8')
+
+    def _serve(self, sock):
+        hello = sock.recv(4096)
+        if not self.streams or json.loads(hello.decode('utf-8')).get("type") != "FORWARD_STREAM":
+            # An older primary: treats the data as a single request, then closes
+            sock.sendall(self._answer(hello) if not self.streams and b"payload" in hello else b"")
+            sock.close()
+            return
+        send_lock = threading.Lock()
+        send_frame(sock, b'{"type": "FORWARD_STREAM_ACCEPT"}')
+
+        def run(frame):
+            response = frame[:REQUEST_ID.size] + self._answer(frame[REQUEST_ID.size:])
+            with send_lock:
+                send_frame(sock, response)
+
+        while True:
+            frame = recv_frame(sock)
+            if frame is None:
+                break
+            threading.Thread(target=run, args=(frame,), daemon=True).start()
+        sock.close()
+
+    def close(self):
+        self.server.close()
+
+def request(payload, **options):
+    return json.dumps(dict(options, payload=payload)).encode('utf-8')
+
+class TestForwardingProxy(unittest.TestCase):
+    """Unit tests for the ForwardingProxy class."""
+
+    def tearDown(self):
+        """Close the proxy and the fake primary."""
+        self.proxy.close()
+        self.primary.close()
+
+    def test_large_responses_arrive_whole(self):
+        """Test that responses far larger than a single recv are not truncated."""
+        self.primary = FakePrimary()
+        self.proxy = ForwardingProxy("backup1", pool_size=1)
+        response = json.loads(self.proxy.forward(self.primary.address, request("x", repeat=200000)))
+        self.assertEqual(len(response["payload"]), 200000)
+
+    def test_requests_share_pooled_connections(self):
+        """Test that concurrent requests are multiplexed over at most pool_size connections."""
+        self.primary = FakePrimary()
+        self.proxy = ForwardingProxy("backup1", pool_size=2)
+        results = {}
+
+        def forward(n):
+            results[n] = json.loads(self.proxy.forward(self.primary.address, request(str(n), slow=(n == 0))))
+
+        threads = [threading.Thread(target=forward, args=(n,)) for n in range(20)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({n: results[n]["payload"] for n in range(20)}, {n: str(n) for n in range(20)})
+        self.assertLessEqual(self.primary.connections, 2)
+        # The slow request did not hold up the others
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_falls_back_for_primary_without_streams(self):
+        """Test that an older primary gets one request per connection."""
+        self.primary = FakePrimary(streams=False)
+        self.proxy = ForwardingProxy("backup1")
+        response = json.loads(self.proxy.forward(self.primary.address, request("ab", repeat=3)))
+        self.assertEqual(response["payload"], "ababab")
+        self.assertEqual(self.proxy.connections, [])
+
+class TestForwardStream(unittest.TestCase):
+    """Unit tests for the primary's side of a forwarding stream."""
+
+    def setUp(self):
+        """Create a manager that is not started, serving a stream over a socket pair."""
+        self.data_dir = tempfile.mkdtemp()
+        address = ("127.0.0.1", 18181)
+        self.manager = ReplicationManager("primary", self.data_dir, [address], address, lambda *args, **kwargs: b"")
+        self.manager.MAX_FORWARD_IN_FLIGHT = 4
+        self.manager.running = True
+        self.backup, primary_end = socket.socketpair()
+        self.backup.settimeout(5)
+        threading.Thread(target=self.manager._serve_forward_stream, args=({"type": "FORWARD_STREAM"}, primary_end),
+                         daemon=True).start()
+        recv_frame(self.backup)
+
+    def tearDown(self):
+        """Close the stream and remove the data directory."""
+        self.backup.close()
+        self.manager.stop()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_requests_in_flight_are_bounded(self):
+        """Test that a burst of forwarded requests runs at most MAX_FORWARD_IN_FLIGHT at a time and all are answered."""
+        release = threading.Event()
+        started = []
+        def handle(data, client_socket=None):
+            started.append(data)
+            release.wait(5)
+            return data
+        self.manager.handle_client_operation = handle
+        for n in range(20):
+            send_frame(self.backup, REQUEST_ID.pack(n) + request(str(n)))
+        time.sleep(0.2)
+        self.assertEqual(len(started), 4)
+        release.set()
+        answered = {REQUEST_ID.unpack(frame[:REQUEST_ID.size])[0] for frame in
+                    (recv_frame(self.backup) for _ in range(20))}
+        self.assertEqual(answered, set(range(20)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Unit tests for the length-prefixed message framing.
+"""
+import json
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.framing import FrameDecoder, encode_frame, is_framed
+
+class TestFrameDecoder(unittest.TestCase):
+    """Unit tests for the FrameDecoder class."""
+
+    def setUp(self):
+        """Create a decoder with a small size limit."""
+        self.decoder = FrameDecoder(max_frame_size=1024 * 1024)
+
+    def test_frames_split_across_reads(self):
+        """Test that a frame arriving a few bytes at a time comes out whole, once."""
+        message = json.dumps({"type": "M", "payload": "x" * 10000}).encode('utf-8')
+        frame = encode_frame(message)
+        frames = []
+        for offset in range(0, len(frame), 7):
+            frames.extend(self.decoder.feed(frame[offset:offset + 7]))
+        self.assertEqual(frames, [message])
+        self.assertEqual(self.decoder.pending, 0)
+
+    def test_several_frames_in_one_read(self):
+        """Test that coalesced frames are split apart and a trailing partial one is kept."""
+        data = encode_frame(b'{"type": "G"}') + encode_frame(b'') + encode_frame(b'{"type": "GM"}')
+        self.assertEqual(self.decoder.feed(data + encode_frame(b'{"a": 1}')[:6]),
+                         [b'{"type": "G"}', b'', b'{"type": "GM"}'])
+        self.assertEqual(self.decoder.feed(encode_frame(b'{"a": 1}')[6:]), [b'{"a": 1}'])
+
+    def test_oversized_frame_is_rejected(self):
+        """Test that a header announcing more than the limit is an error instead of a huge buffer."""
+        with self.assertRaises(ValueError):
+            self.decoder.feed(encode_frame(b'x' * (1024 * 1024 + 1)))
+
+    def test_framed_connections_are_told_from_bare_json(self):
+        """Test that the first bytes of a connection show whether the client frames its messages."""
+        self.assertTrue(is_framed(encode_frame(b'{"type": "G"}')))
+        self.assertFalse(is_framed(b'{"type": "G"}'))
+        self.assertFalse(is_framed(b'  [{"type": "G"}]'))
+        self.assertFalse(is_framed(b''))
+
+if __name__ == '__main__':
+    unittest.main()
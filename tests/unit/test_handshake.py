@@ -0,0 +1,100 @@
+"""
+Unit tests for the connection handshake.
+"""
+import json
+import socket
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol import binary_codec
+from backend.protocol.framing import encode_frame, recv_frame
+from backend.protocol.handshake import Capabilities, ConnectionOptions, PROTOCOL_VERSION, hello_request
+from backend.socket.event_socket_handler import EventSocketHandler
+
+class TestConnectionOptions(unittest.TestCase):
+    """Unit tests for ConnectionOptions.answer_hello and encode."""
+
+    def _answer(self, options, data):
+        return json.loads(options.answer_hello(data))
+
+    def test_agrees_on_clients_preference_within_server_capabilities(self):
+        """Test that each option is the client's first choice the server offers."""
+        options = ConnectionOptions(Capabilities(max_frame_size=1 << 20))
+        answer = self._answer(options, hello_request(["cbor", "binary"], ["lz4"], max_frame_size=1 << 30, version=99))
+        self.assertEqual(answer, {"type": "HELLO", "payload": {
+            "version": PROTOCOL_VERSION, "encoding": "binary", "compression": None, "max_frame_size": 1 << 20}})
+        self.assertEqual((options.encoding, options.max_frame_size), ("binary", 1 << 20))
+
+    def test_server_can_hold_back_an_encoding(self):
+        """Test that a server configured for JSON only agrees on JSON with binary capable clients."""
+        options = ConnectionOptions(Capabilities(encodings=["json"]))
+        self.assertEqual(self._answer(options, hello_request(["binary", "json"]))["payload"]["encoding"], "json")
+        self.assertEqual(options.encode(b'{"type": "S"}'), b'{"type": "S"}')
+
+    def test_hello_of_an_older_client(self):
+        """Test that a hello without the newer fields still gets an answer."""
+        options = ConnectionOptions()
+        answer = self._answer(options, b'{"type": "HELLO", "payload": {"encodings": ["binary"]}}')
+        self.assertEqual(answer["payload"]["encoding"], "binary")
+        self.assertEqual(self._answer(ConnectionOptions(), b'{"type": "HELLO", "payload": 5}')["type"], "E")
+
+    def test_oversized_response_becomes_error(self):
+        """Test that a response over the agreed frame size is replaced by an error that keeps its id."""
+        options = ConnectionOptions()
+        options.answer_hello(hello_request(["json"], max_frame_size=2048))
+        response = json.loads(options.encode(json.dumps({"id": 4, "type": "BM", "payload": "x" * 5000}).encode('utf-8')))
+        self.assertEqual((response["id"], response["type"]), (4, "E"))
+        self.assertEqual(options.encode(b'{"type": "S"}'), b'{"type": "S"}')
+
+    def test_hello_only_as_first_request(self):
+        """Test that only a first request of type HELLO is a hello, and a later one is refused."""
+        options = ConnectionOptions()
+        login = b'{"type":"L","payload":["HELLO","secret"]}'
+        self.assertIsNone(options.take_hello(login))
+        with self.assertRaises(ValueError):
+            options.take_hello(hello_request(["binary"], ["zlib"]))
+        self.assertEqual((options.encoding, options.compressor), ("json", None))
+        options = ConnectionOptions()
+        self.assertEqual(json.loads(options.take_hello(hello_request(["binary"])))["type"], "HELLO")
+        self.assertIsNone(options.take_hello(login))
+
+class TestHandlerHandshake(unittest.TestCase):
+    """Handshake limits enforced by a socket handler."""
+
+    def setUp(self):
+        """Start a handler that offers at most 4 KB frames."""
+        controller = type("Controller", (), {"handle_incoming_message":
+                                             lambda self, data, client_socket=None: b'{"type": "S", "payload": "ok"}'})()
+        self.handler = EventSocketHandler("127.0.0.1", 0, controller, workers=1,
+                                          capabilities=Capabilities(encodings=["json"], max_frame_size=4096))
+        self.assertTrue(self.handler.start_server())
+        self.sock = socket.create_connection(self.handler.socket.getsockname(), timeout=5)
+
+    def tearDown(self):
+        """Stop the handler."""
+        self.sock.close()
+        self.handler.stop_server()
+
+    def test_agreed_limits_are_enforced(self):
+        """Test that the server answers in the agreed encoding and drops a client that sends too large a frame."""
+        self.sock.sendall(encode_frame(hello_request(["binary", "json"])))
+        self.assertEqual(json.loads(recv_frame(self.sock))["payload"],
+                         {"version": PROTOCOL_VERSION, "encoding": "json", "compression": None, "max_frame_size": 4096})
+        self.sock.sendall(encode_frame(binary_codec.encode({"type": "G", "payload": None})))
+        self.assertEqual(json.loads(recv_frame(self.sock)), {"type": "S", "payload": "ok"})
+        self.sock.sendall(encode_frame(b'{"type": "M", "payload": "' + b'x' * 5000 + b'"}'))
+        self.assertIsNone(recv_frame(self.sock))
+
+    def test_second_hello_drops_the_client(self):
+        """Test that a hello after the first request closes the connection instead of changing its options."""
+        self.sock.sendall(encode_frame(b'{"type": "G", "payload": null}'))
+        self.assertEqual(json.loads(recv_frame(self.sock)), {"type": "S", "payload": "ok"})
+        self.sock.sendall(encode_frame(hello_request(["json"])))
+        self.assertIsNone(recv_frame(self.sock))
+
+if __name__ == '__main__':
+    unittest.main()
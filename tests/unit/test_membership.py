@@ -0,0 +1,69 @@
+"""
+Unit tests for the ClusterMembership class.
+"""
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.replication.membership import ClusterMembership
+
+class TestClusterMembership(unittest.TestCase):
+    """Unit tests for the ClusterMembership class."""
+
+    def setUp(self):
+        """Create a registry for a server with two seed addresses."""
+        self.membership = ClusterMembership("a", ("localhost", 9001),
+                                            [("localhost", 9001), ("localhost", 9002), ("localhost", 9003)])
+
+    def test_seeds_are_pending_until_registered(self):
+        """Test that seeds count as addresses but have no ID until they answer."""
+        self.assertEqual(len(self.membership.addresses()), 3)
+        self.assertIsNone(self.membership.server_id_of(("localhost", 9002)))
+
+        self.membership.register("b", ("localhost", 9002))
+        self.assertEqual(self.membership.server_id_of(("localhost", 9002)), "b")
+        self.assertEqual(self.membership.address_of("b"), ("localhost", 9002))
+        self.assertEqual(len(self.membership.addresses()), 3)
+
+    def test_pending_seeds_count_as_voters(self):
+        """Test that a server cannot win alone while its seeds have not answered."""
+        self.assertFalse(self.membership.has_quorum({"a"}))
+        self.membership.register("b", ("localhost", 9002))
+        self.assertTrue(self.membership.has_quorum({"a", "b"}))
+
+    def test_pending_seeds_only_count_while_bootstrapping(self):
+        """Test that once a configuration is applied only its members decide the quorum."""
+        self.membership.register("b", ("localhost", 9002))
+        self.membership.apply_config({"members": {"a": ["localhost", 9001], "b": ["localhost", 9002]}})
+        # Seeds that answer late are not members of the configuration
+        self.membership.pending_seeds.extend([("localhost", 9004), ("localhost", 9005)])
+        self.assertTrue(self.membership.has_quorum({"a", "b"}))
+
+    def test_joint_configuration_needs_both_majorities(self):
+        """Test that during a change a majority of the old and the new members is needed."""
+        self.membership.apply_config({"members": {"a": ["localhost", 9001], "b": ["localhost", 9002],
+                                                  "c": ["localhost", 9003]}})
+        new_members = {"a": ("localhost", 9001), "d": ("localhost", 9004), "e": ("localhost", 9005)}
+        self.membership.apply_config(self.membership.joint_config(new_members))
+
+        self.assertTrue(self.membership.is_changing())
+        self.assertFalse(self.membership.has_quorum({"a", "b"}))
+        self.assertFalse(self.membership.has_quorum({"a", "d"}))
+        self.assertTrue(self.membership.has_quorum({"a", "b", "d"}))
+        # Old members keep receiving messages until the change completes
+        self.assertEqual(len(self.membership.addresses()), 5)
+
+    def test_removed_member_can_register_again(self):
+        """Test that a server dropped from the view is added back when it answers again."""
+        self.membership.register("b", ("localhost", 9002))
+        self.assertTrue(self.membership.remove("b"))
+        self.assertIsNone(self.membership.address_of("b"))
+
+        self.membership.register("b", ("localhost", 9002))
+        self.assertTrue(self.membership.is_member("b"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Unit tests for per-connection outbound queues of pushed messages.
+"""
+import json
+import socket
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.framing import encode_frame, recv_frame
+from backend.socket.outbound import OutboundQueue
+from backend.socket.socket_handler import SocketHandler
+from backend.socket.event_socket_handler import EventSocketHandler
+
+class TestOutboundQueue(unittest.TestCase):
+    """Unit tests for the OutboundQueue class."""
+
+    def test_waiting_messages_are_merged(self):
+        """Test that queued messages come out as one JSON array, in order."""
+        queue = OutboundQueue(max_batch=3)
+        for n in range(4):
+            self.assertTrue(queue.push(json.dumps({"type": "M", "payload": n}).encode('utf-8')))
+        self.assertTrue(queue.start_draining())
+        self.assertFalse(queue.start_draining())
+        self.assertEqual([m["payload"] for m in json.loads(queue.next_batch())], [0, 1, 2])
+        self.assertEqual(json.loads(queue.next_batch()), {"type": "M", "payload": 3})
+        self.assertIsNone(queue.next_batch())
+        self.assertEqual(queue.pending_bytes, 0)
+
+    def test_batches_fit_the_frame_size(self):
+        """Test that merged messages stay within the frame size and only a single oversized one exceeds it."""
+        queue = OutboundQueue(max_batch_bytes=1024)
+        messages = [json.dumps({"type": "M", "payload": "x" * size}).encode('utf-8') for size in [400, 400, 400, 2000, 10]]
+        for message in messages:
+            self.assertTrue(queue.push(message))
+        batches = [queue.next_batch() for _ in range(4)]
+        self.assertEqual([len(json.loads(batch)) if batch.startswith(b'[') else 1 for batch in batches], [2, 1, 1, 1])
+        self.assertTrue(all(len(batch) <= 1024 for batch in batches[:2]))
+        self.assertEqual(batches[2], messages[3])
+        self.assertIsNone(queue.next_batch())
+
+    def test_client_past_high_water_is_refused(self):
+        """Test that a queue over its limit refuses every further message."""
+        queue = OutboundQueue(high_water=100)
+        self.assertTrue(queue.push(b'x' * 60))
+        self.assertFalse(queue.push(b'x' * 60))
+        self.assertFalse(queue.push(b'x'))
+        self.assertIsNone(queue.next_batch())
+
+class PushController:
+    """Logs users in and pushes a large notification to the user a request names."""
+
+    def __init__(self):
+        self.online_users = {}
+
+    def handle_incoming_message(self, data, client_socket):
+        request = json.loads(data.decode('utf-8'))
+        if request["type"] == "L":
+            self.online_users[request["payload"]] = client_socket
+        else:
+            notification = {"type": "M", "payload": "x" * request["payload"]["size"]}
+            self.online_users[request["payload"]["to"]].sendall(json.dumps(notification).encode('utf-8'))
+        return b'{"type": "S", "payload": "ok"}'
+
+class SlowConsumerTests:
+    """A client that stops reading must not slow down the others; mixed into a test case per handler."""
+
+    def create_handler(self, controller):
+        raise NotImplementedError
+
+    def setUp(self):
+        """Start a handler on a free port."""
+        self.controller = PushController()
+        self.handler = self.create_handler(self.controller)
+        self.assertTrue(self.handler.start_server())
+        self.address = self.handler.socket.getsockname()
+
+    def tearDown(self):
+        """Stop the handler."""
+        self.handler.stop_server()
+
+    def _call(self, sock, request):
+        sock.sendall(encode_frame(json.dumps(request).encode('utf-8')))
+        return recv_frame(sock)
+
+    def test_stalled_receiver_does_not_delay_sender(self):
+        """Test that pushes to a client that does not read neither block the sender nor pile up forever."""
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.settimeout(5)
+        slow.connect(self.address)
+        sender = socket.create_connection(self.address, timeout=5)
+        try:
+            self._call(slow, {"type": "L", "payload": "slow"})
+            slowest = 0
+            for _ in range(60):
+                started = time.time()
+                self.assertIsNotNone(self._call(sender, {"type": "M", "payload": {"to": "slow", "size": 200000}}))
+                slowest = max(slowest, time.time() - started)
+            self.assertLess(slowest, 0.5)
+
+            # The slow client was cut off long before it got everything
+            received = 0
+            try:
+                while True:
+                    chunk = slow.recv(65536)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+            except (ConnectionResetError, socket.timeout):
+                pass
+            self.assertLess(received, 60 * 200000)
+        finally:
+            slow.close()
+            sender.close()
+
+class TestThreadHandlerSlowConsumer(SlowConsumerTests, unittest.TestCase):
+    """Slow consumers of the thread per client handler."""
+
+    def create_handler(self, controller):
+        return SocketHandler("127.0.0.1", 0, controller)
+
+class TestEventHandlerSlowConsumer(SlowConsumerTests, unittest.TestCase):
+    """Slow consumers of the event loop handler."""
+
+    def create_handler(self, controller):
+        return EventSocketHandler("127.0.0.1", 0, controller, workers=2)
+
+if __name__ == '__main__':
+    unittest.main()
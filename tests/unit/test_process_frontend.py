@@ -0,0 +1,142 @@
+"""
+Unit tests for the channel between front end processes and the replication process.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+# Mock bcrypt to avoid dependency issues
+if 'bcrypt' not in sys.modules:
+    sys.modules['bcrypt'] = MagicMock()
+
+from backend.socket.process_frontend import (FrontendChannel, FrontendOwner, FrontendWorker,
+                                             create_ipc_listener)
+
+class FakeController:
+    """Controller stand-in that echoes requests and records the client it was given."""
+
+    def __init__(self):
+        self.online_users = {}
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def handle_incoming_message(self, data, client_socket=None):
+        self.requests.append((json.loads(data.decode('utf-8'))["type"], client_socket))
+        return json.dumps({"type": "S", "payload": "handled by owner"}).encode('utf-8')
+
+class FakeProtocol:
+    """The parts of JsonProtocol the front end uses."""
+
+    def deserialize_login(self, payload):
+        return payload[0], payload[1]
+
+    def serialize_success(self, message):
+        return json.dumps({"type": "S", "payload": message}).encode('utf-8')
+
+    def serialize_error(self, message):
+        return json.dumps({"type": "E", "payload": message}).encode('utf-8')
+
+class FakeClient:
+    """ClientHandle stand-in that records what is pushed to it."""
+
+    def __init__(self):
+        self.pushed = []
+
+    def sendall(self, data):
+        self.pushed.append(data)
+
+class TestProcessFrontend(unittest.TestCase):
+    """Unit tests for FrontendOwner, FrontendChannel and FrontendWorker."""
+
+    def setUp(self):
+        """Connect a channel to an owner over a Unix domain socket."""
+        self.dir = tempfile.mkdtemp()
+        self.controller = FakeController()
+        self.hashes = {"alice": b"alice-hash"}
+        self.owner = FrontendOwner(create_ipc_listener(os.path.join(self.dir, "frontend.sock")), self.controller,
+                                   lambda username: self.hashes.get(username, b''))
+        self.owner.start()
+        self.channel = FrontendChannel(os.path.join(self.dir, "frontend.sock"))
+        self.channel.connect()
+        self.worker = FrontendWorker(self.channel, FakeProtocol())
+
+    def tearDown(self):
+        """Stop the owner and remove the socket."""
+        self.owner.stop()
+        shutil.rmtree(self.dir)
+
+    def _login(self, username, password, client=None):
+        data = json.dumps({"type": "L", "payload": [username, password]}).encode('utf-8')
+        return json.loads(self.worker.handle(data, client))
+
+    def test_requests_are_answered_by_the_owner(self):
+        """Test that concurrent requests each get their own reply."""
+        results = []
+
+        def send(n):
+            data = json.dumps({"type": "G", "payload": [str(n)]}).encode('utf-8')
+            results.append(json.loads(self.worker.handle(data)))
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result["payload"] == "handled by owner" for result in results))
+
+    @patch('backend.socket.process_frontend.bcrypt')
+    def test_login_is_checked_in_the_front_end(self, mock_bcrypt):
+        """Test that the password is checked against the owner's hash without the owner's controller."""
+        mock_bcrypt.checkpw.return_value = False
+        self.assertEqual(self._login("alice", "wrong")["type"], "E")
+        mock_bcrypt.checkpw.return_value = True
+        client = FakeClient()
+        self.assertEqual(self._login("alice", "secret", client), {"type": "S", "payload": "Login successful"})
+        mock_bcrypt.checkpw.assert_called_with(b"secret", b"alice-hash")
+        self.assertEqual(self._login("nobody", "secret")["type"], "E")
+        self.assertEqual(self.controller.requests, [])
+
+        # The owner pushes notifications for alice back to this front end's socket
+        self.controller.online_users["alice"].sendall(b'{"type": "M"}')
+        deadline = time.time() + 2
+        while not client.pushed and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(client.pushed, [b'{"type": "M"}'])
+
+    @patch('backend.socket.process_frontend.bcrypt')
+    def test_batch_login_is_checked_in_the_front_end(self, mock_bcrypt):
+        """Test that a batch's login is checked here and its other requests reach the owner as one batch."""
+        operations = [{"type": "L", "payload": ["alice", "secret"]}, {"type": "GS", "payload": ["alice"]},
+                      {"type": "GM", "payload": ["alice"]}]
+        data = json.dumps({"type": "BATCH", "payload": operations}).encode('utf-8')
+        self.controller.handle_incoming_message = lambda data, client_socket=None: json.dumps(
+            {"primary": ["10.0.0.1", 8091], "type": "BATCH", "payload": [{"type": "V"}, {"type": "BM"}]}).encode('utf-8')
+        mock_bcrypt.checkpw.return_value = True
+        response = json.loads(self.worker.handle(data))
+        self.assertEqual([item["type"] for item in response["payload"]], ["S", "V", "BM"])
+        # The hint of a backup's owner is passed on to the client
+        self.assertEqual(response["primary"], ["10.0.0.1", 8091])
+
+        mock_bcrypt.checkpw.return_value = False
+        response = json.loads(self.worker.handle(data))
+        self.assertEqual([item["type"] for item in response["payload"]], ["E", "E", "E"])
+
+    def test_login_goes_to_owner_when_reads_must_be_forwarded(self):
+        """Test that a login is handed to the owner when it cannot serve the hash locally."""
+        self.owner.password_lookup = lambda username: None
+        self.assertEqual(self._login("alice", "secret")["payload"], "handled by owner")
+        self.assertEqual([request[0] for request in self.controller.requests], ["L"])
+
+if __name__ == '__main__':
+    unittest.main()
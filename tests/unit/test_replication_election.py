@@ -0,0 +1,255 @@
+"""
+Unit tests for the pre-vote and election timing logic of the ReplicationManager.
+"""
+import json
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.replication.peer_replicator import PeerReplicator
+from backend.replication.replication_manager import ReplicationManager, RoleSnapshot, ServerRole
+
+class TestReplicationElection(unittest.TestCase):
+    """Unit tests for pre-vote handling and election timeouts."""
+
+    def setUp(self):
+        """Create a manager that is not started, so no sockets are opened."""
+        self.data_dir = tempfile.mkdtemp()
+        addresses = [("127.0.0.1", 18081), ("127.0.0.1", 18082), ("127.0.0.1", 18083)]
+        self.manager = ReplicationManager("replica1", self.data_dir, addresses, addresses[0],
+                                          client_handler=lambda *args, **kwargs: b"",
+                                          heartbeat_interval=0.1, election_timeout_min=0.5,
+                                          election_timeout_max=1.0)
+        self.manager.role = ServerRole.BACKUP
+        self.manager.current_term = 3
+
+    def tearDown(self):
+        """Remove the data directory."""
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def _pre_vote(self, **overrides):
+        message = {"type": "PRE_VOTE", "term": 4, "server_id": "replica2",
+                   "last_log_index": 0, "last_log_term": 0, "suspected_primary": None}
+        message.update(overrides)
+        return self.manager._handle_pre_vote(message)
+
+    def test_pre_vote_refused_while_primary_is_alive(self):
+        """Test that a pre-vote is refused while heartbeats still arrive."""
+        self.manager.primary_id = "replica3"
+        self.manager.last_heartbeat_time = time.time()
+        self.assertFalse(self._pre_vote()["vote_granted"])
+
+    def test_pre_vote_granted_without_primary(self):
+        """Test that a pre-vote is granted when no primary is known and leaves the term alone."""
+        self.manager.primary_id = None
+        self.assertTrue(self._pre_vote()["vote_granted"])
+        self.assertEqual(self.manager.current_term, 3)
+        self.assertIsNone(self.manager.voted_for)
+
+    def test_pre_vote_granted_for_suspected_primary(self):
+        """Test that a missed couple of heartbeats is enough when the candidate suspects the same primary."""
+        self.manager.primary_id = "replica3"
+        self.manager.last_heartbeat_time = time.time() - 0.3
+        self.assertFalse(self._pre_vote()["vote_granted"])
+        self.assertTrue(self._pre_vote(suspected_primary="replica3")["vote_granted"])
+
+    def test_pre_vote_refused_for_stale_log(self):
+        """Test that a candidate missing entries we have is refused."""
+        self.manager.primary_id = None
+        self.manager.replication_log.append(3, "op")
+        self.assertFalse(self._pre_vote()["vote_granted"])
+        self.assertTrue(self._pre_vote(last_log_index=1, last_log_term=3)["vote_granted"])
+
+    def test_election_timeout_uses_configured_range(self):
+        """Test that election timeouts are drawn from the configured range."""
+        for _ in range(20):
+            timeout = self.manager._random_election_timeout()
+            self.assertGreaterEqual(timeout, 0.5)
+            self.assertLessEqual(timeout, 1.0)
+
+    def test_stuck_candidate_does_not_promote_itself(self):
+        """Test that an undecided election is retried instead of taking over as primary."""
+        self.manager.role = ServerRole.CANDIDATE
+        self.manager.election_started_at = time.time() - 2
+        self.assertTrue(self.manager._check_election_timeout(1.0))
+        self.assertEqual(self.manager.role, ServerRole.BACKUP)
+        self.assertIsNone(self.manager.primary_id)
+
+    def test_heartbeat_renews_lease_and_commit_index(self):
+        """Test that a heartbeat from the primary renews the read lease and advances the commit index."""
+        self.manager.primary_id = "replica3"
+        for _ in range(3):
+            self.manager.replication_log.append(3, "op")
+        self.manager._handle_heartbeat({"type": "HEARTBEAT", "term": 3, "server_id": "replica3",
+                                        "last_log_index": 5, "commit_index": 5, "lease": 0.5},
+                                       check_progress=False)
+        self.manager._check_leader_progress("replica3", 3, 5)
+        self.assertGreater(self.manager.read_lease_expires_at, time.time())
+        self.assertLessEqual(self.manager.read_lease_expires_at, time.time() + 0.5)
+        # Never beyond what we have stored ourselves
+        self.assertEqual(self.manager.commit_index, 3)
+
+    def test_diverged_log_is_repaired_by_catch_up(self):
+        """Test that entries whose terms differ from ours at the same index are not applied on top of our log."""
+        applied, catch_ups = [], []
+        self.manager.client_handler = lambda data, client_socket=None, **kwargs: applied.append(data) or b""
+        self.manager._request_catch_up = lambda: catch_ups.append(self.manager.replication_log.last_index)
+        self.manager.primary_id = "replica3"
+        # Entry 2 was written by a deposed primary in term 2, the new primary holds a different one from term 3
+        self.manager.replication_log.append_entry({"index": 1, "term": 2, "operation": "a"})
+        self.manager.replication_log.append_entry({"index": 2, "term": 2, "operation": "uncommitted"})
+        entries = [{"index": 2, "term": 3, "operation": "b"}, {"index": 3, "term": 3, "operation": "c"}]
+        self.assertFalse(self.manager._handle_replicated_entries("replica3", 3, entries, prev_log_term=2))
+        self.assertFalse(self.manager._handle_replicated_entries("replica3", 3, entries[1:], prev_log_term=3))
+        self.assertEqual((applied, catch_ups), ([], [2, 2]))
+        self.assertEqual(self.manager.replication_log.get_last(), (2, 2))
+
+        self.assertTrue(self.manager._handle_replicated_entries(
+            "replica3", 3, [{"index": 3, "term": 3, "operation": "c"}], prev_log_term=2))
+        self.assertEqual(self.manager.replication_log.get_last(), (3, 3))
+
+    def test_login_is_not_served_by_a_backup(self):
+        """Test that reads within the lease are served locally but logins go to the primary, where sessions live."""
+        self.manager.primary_id = "replica3"
+        self.manager.read_lease_expires_at = time.time() + 5
+        self.assertTrue(self.manager._can_serve_read_locally(b'{"type": "GM", "payload": ["alice"]}'))
+        self.assertFalse(self.manager._can_serve_read_locally(b'{"type": "L", "payload": ["alice", "secret"]}'))
+
+    def test_responses_carry_primary_hint(self):
+        """Test that a backup tells clients the client address the primary advertised."""
+        self.assertEqual(self.manager.add_primary_hint(b'{"type": "S"}'), b'{"type": "S"}')
+        self.manager.primary_id = "replica3"
+        self.manager._handle_heartbeat({"type": "HEARTBEAT", "term": 3, "server_id": "replica3",
+                                        "client_address": ["127.0.0.1", 8093]})
+        for response in [b'{"type": "S", "payload": "ok"}', b'[{"type": "E", "payload": "x"}]', b'{}']:
+            decoded = json.loads(self.manager.add_primary_hint(response))
+            first = decoded[0] if isinstance(decoded, list) else decoded
+            self.assertEqual(first["primary"], ["127.0.0.1", 8093])
+        # A hint from a previous primary is not passed on
+        self.manager.primary_id = "replica2"
+        self.assertEqual(self.manager.add_primary_hint(b'{}'), b'{}')
+
+    def test_commit_index_follows_majority_of_acks(self):
+        """Test that the primary commits an entry once a majority of servers stored it."""
+        self.manager.role = ServerRole.PRIMARY
+        self.manager.membership.register("replica2", ("127.0.0.1", 18082))
+        self.manager.membership.register("replica3", ("127.0.0.1", 18083))
+        for _ in range(4):
+            self.manager.replication_log.append(3, "op")
+        self.manager.peer_replicators = {
+            ("127.0.0.1", 18082): type("Replicator", (), {"match_index": 2})(),
+            ("127.0.0.1", 18083): type("Replicator", (), {"match_index": 1})()
+        }
+        self.manager._update_commit_index()
+        self.assertEqual(self.manager.commit_index, 2)
+
+    def test_timeout_now_starts_election_only_when_up_to_date(self):
+        """Test that a backup takes over when its primary asks, but not with a shorter log or from anyone else."""
+        vote_requests = []
+        self.manager._request_votes = vote_requests.append
+        self.manager.primary_id = "replica3"
+        self.manager.replication_log.append(3, "op")
+        timeout_now = {"type": "TIMEOUT_NOW", "term": 3, "server_id": "replica3", "last_log_index": 2}
+        self.assertFalse(self.manager._handle_timeout_now(timeout_now)["accepted"])
+        self.assertFalse(self.manager._handle_timeout_now(dict(timeout_now, server_id="replica2",
+                                                                last_log_index=1))["accepted"])
+        self.assertEqual(self.manager.current_term, 3)
+
+        self.assertTrue(self.manager._handle_timeout_now(dict(timeout_now, last_log_index=1))["accepted"])
+        time.sleep(0.1)
+        self.assertEqual(self.manager.role, ServerRole.CANDIDATE)
+        self.assertEqual(self.manager.current_term, 4)
+        self.assertEqual([request["term"] for request in vote_requests], [4])
+
+    def test_transfer_target_is_most_up_to_date_backup(self):
+        """Test that leadership goes to the voting backup that has stored the most of the log."""
+        self.manager.membership.register("replica2", ("127.0.0.1", 18082))
+        self.manager.membership.register("replica3", ("127.0.0.1", 18083))
+        self.manager.peer_replicators = {
+            ("127.0.0.1", 18082): type("Replicator", (), {"match_index": 4})(),
+            ("127.0.0.1", 18083): type("Replicator", (), {"match_index": 7})()
+        }
+        self.assertEqual(self.manager._choose_transfer_target(), "replica3")
+        # Not the primary, nothing to hand over
+        self.assertFalse(self.manager.transfer_leadership())
+
+    def test_vote_during_transfer_keeps_the_primary(self):
+        """Test that a vote request only drops the primary from membership once its heartbeats stopped."""
+        self.manager.membership.register("replica3", ("127.0.0.1", 18083))
+        self.manager.primary_id = "replica3"
+        self.manager.last_heartbeat_time = time.time()
+        vote = {"type": "REQUEST_VOTE", "term": 4, "server_id": "replica2", "last_log_index": 0, "last_log_term": 0}
+        self.manager._dispatch_replication_message(vote, None)
+        self.assertTrue(self.manager.membership.is_member("replica3"))
+
+        self.manager.primary_id = "replica3"
+        self.manager.last_heartbeat_time = time.time() - 1.0
+        self.manager._dispatch_replication_message(dict(vote, term=5), None)
+        self.assertFalse(self.manager.membership.is_member("replica3"))
+
+    def test_write_is_fenced_before_it_runs(self):
+        """Test that a write started for a term we no longer lead is refused without touching storage."""
+        calls = []
+        self.manager.client_handler = lambda data, client_socket=None: calls.append(data) or b'{"type": "S"}'
+        self.manager.role = ServerRole.PRIMARY
+        write = json.dumps({"type": "W", "payload": ["alice"]}).encode('utf-8')
+        response = self.manager._execute_as_primary(write, None, RoleSnapshot(ServerRole.PRIMARY, 2, "replica1"))
+        self.assertEqual(json.loads(response)[0]["type"], "E")
+        self.assertEqual((calls, self.manager.replication_log.last_index), ([], 0))
+
+    def test_step_down_waits_for_running_writes(self):
+        """Test that a write running when a higher term arrives is still logged and answered."""
+        started, release = threading.Event(), threading.Event()
+        def handler(data, client_socket=None):
+            started.set()
+            release.wait(5)
+            return b'{"type": "S", "payload": "ok"}'
+        self.manager.client_handler = handler
+        self.manager.role = ServerRole.PRIMARY
+        write = json.dumps({"type": "W", "payload": ["alice"]}).encode('utf-8')
+        responses = []
+        writer = threading.Thread(target=lambda: responses.append(self.manager._execute_as_primary(
+            write, None, RoleSnapshot(ServerRole.PRIMARY, 3, "replica1"))))
+        writer.start()
+        self.assertTrue(started.wait(5))
+        voter = threading.Thread(target=self.manager._handle_vote_request,
+                                 args=({"type": "REQUEST_VOTE", "term": 4, "server_id": "replica2",
+                                        "last_log_index": 5, "last_log_term": 3},))
+        voter.start()
+        time.sleep(0.1)
+        self.assertEqual(self.manager.current_term, 3)
+        release.set()
+        writer.join(5)
+        voter.join(5)
+        self.assertEqual(json.loads(responses[0])["type"], "S")
+        self.assertEqual(self.manager.replication_log.get_last(), (1, 3))
+        self.assertEqual((self.manager.role, self.manager.current_term), (ServerRole.BACKUP, 4))
+
+    def test_replication_stats_report_follower_lag(self):
+        """Test that the primary reports how far each backup is behind, and a backup its own lag."""
+        self.manager.leader_last_index = 4
+        self.assertEqual(self.manager.get_replication_stats()["lag_entries"], 4)
+
+        self.manager.role = ServerRole.PRIMARY
+        self.manager.membership.register("replica2", ("127.0.0.1", 18082))
+        for _ in range(5):
+            self.manager.replication_log.append(3, "op")
+        replicator = PeerReplicator(self.manager, ("127.0.0.1", 18082), ["none"])
+        replicator.match_index = 3
+        replicator.caught_up_at = time.time() - 2
+        replicator.enqueue({"index": 4})
+        replicator.enqueue({"index": 5})
+        self.manager.peer_replicators = {("127.0.0.1", 18082): replicator}
+        follower = json.loads(json.dumps(self.manager.get_replication_stats()))["followers"]["replica2"]
+        self.assertEqual((follower["acked_index"], follower["lag_entries"], follower["queue_depth"]), (3, 2, 2))
+        self.assertGreaterEqual(follower["lag_seconds"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
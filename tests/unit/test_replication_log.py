@@ -0,0 +1,75 @@
+"""
+Unit tests for the ReplicationLog class.
+"""
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.replication.replication_log import ReplicationLog
+
+class TestReplicationLog(unittest.TestCase):
+    """Unit tests for the ReplicationLog class."""
+    
+    def setUp(self):
+        """Create a fresh data directory for each test."""
+        self.data_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Remove the data directory."""
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+    
+    def test_append_assigns_increasing_indices(self):
+        """Test that entries get consecutive indices and the term they were appended in."""
+        log = ReplicationLog(self.data_dir)
+        first = log.append(1, "op1")
+        second = log.append(2, "op2")
+        
+        self.assertEqual(first["index"], 1)
+        self.assertEqual(second["index"], 2)
+        self.assertEqual(log.get_last(), (2, 2))
+        self.assertEqual(log.term_at(1), 1)
+    
+    def test_compaction_drops_old_entries(self):
+        """Test that compacted entries can no longer be streamed."""
+        log = ReplicationLog(self.data_dir, max_entries=3)
+        for i in range(5):
+            log.append(1, f"op{i}")
+        
+        self.assertIsNone(log.entries_from(2))
+        self.assertEqual([e["index"] for e in log.entries_from(3)], [3, 4, 5])
+        self.assertEqual(log.entries_from(6), [])
+    
+    def test_append_entry_rejects_gaps(self):
+        """Test that a follower only appends the entry directly after its last one."""
+        log = ReplicationLog(self.data_dir)
+        self.assertFalse(log.append_entry({"index": 2, "term": 1, "operation": "op"}))
+        self.assertTrue(log.append_entry({"index": 1, "term": 1, "operation": "op"}))
+        self.assertEqual(log.last_index, 1)
+    
+    def test_last_index_survives_restart(self):
+        """Test that a restarted replica reports how far it got."""
+        log = ReplicationLog(self.data_dir)
+        log.append(3, "op1")
+        log.append(3, "op2")
+        
+        restarted = ReplicationLog(self.data_dir)
+        self.assertEqual(restarted.get_last(), (2, 3))
+        # Entries from before the restart are treated as compacted
+        self.assertIsNone(restarted.entries_from(1))
+    
+    def test_reset_to_snapshot(self):
+        """Test that installing a snapshot moves the log to the snapshot position."""
+        log = ReplicationLog(self.data_dir)
+        log.append(1, "op1")
+        log.reset_to_snapshot(10, 4)
+        
+        self.assertEqual(log.get_last(), (10, 4))
+        self.assertTrue(log.append_entry({"index": 11, "term": 4, "operation": "op"}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Unit tests for requests tagged with ids and answered out of order.
+"""
+import json
+import socket
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.framing import encode_frame, recv_frame
+from backend.protocol.request_ids import request_id_of, tag_response
+from backend.socket.request_scheduler import RequestScheduler
+from backend.socket.socket_handler import SocketHandler
+from backend.socket.event_socket_handler import EventSocketHandler
+
+class TestRequestIds(unittest.TestCase):
+    """Unit tests for request_id_of and tag_response."""
+
+    def test_request_id_of(self):
+        """Test that only a top level id counts."""
+        self.assertEqual(request_id_of(b'{"id": 7, "type": "G", "payload": []}'), 7)
+        self.assertIsNone(request_id_of(b'{"type": "G", "payload": [{"id": 7}]}'))
+        self.assertIsNone(request_id_of(b'{"type": "M", "payload": ["say \\"id\\""]}'))
+        self.assertIsNone(request_id_of(b'not json "id"'))
+
+    def test_tag_response(self):
+        """Test that the id is added to objects and that anything else becomes an error carrying it."""
+        self.assertEqual(json.loads(tag_response(b'{"type": "S", "payload": "ok"}', 3)),
+                         {"id": 3, "type": "S", "payload": "ok"})
+        self.assertEqual(json.loads(tag_response(b'{}', "a")), {"id": "a"})
+        self.assertEqual(json.loads(tag_response(b'Unknown message type', 4)),
+                         {"id": 4, "type": "E", "payload": "Unknown message type"})
+        self.assertEqual(json.loads(tag_response(b'', 5))["type"], "E")
+
+    def test_array_responses(self):
+        """Test that an array response is tagged in its first message and its id is found there."""
+        for response in [b'[{"type": "E", "payload": "retry"}]', b' [ {"type": "E"}, {"type": "E"}]']:
+            tagged = tag_response(response, 6)
+            self.assertEqual(json.loads(tagged)[0]["id"], 6)
+            self.assertEqual(request_id_of(tagged), 6)
+        self.assertIsNone(request_id_of(b'[{"type": "S"}, {"id": 2}]'))
+
+class DelayController:
+    """Answers each request after the delay it asks for, echoing its payload."""
+
+    def handle_incoming_message(self, data, client_socket=None):
+        request = json.loads(data.decode('utf-8'))
+        time.sleep(request["payload"]["delay"])
+        return json.dumps({"type": "S", "payload": request["payload"]["n"]}).encode('utf-8')
+
+class PipeliningTests:
+    """Pipelined requests of one connection; mixed into a test case per handler."""
+
+    def create_handler(self, controller, scheduler):
+        raise NotImplementedError
+
+    def setUp(self):
+        """Start a handler on a free port with a scheduler for its requests."""
+        controller = DelayController()
+        self.scheduler = RequestScheduler(controller.handle_incoming_message, workers={"auth": 1, "write": 1, "read": 8})
+        self.scheduler.start()
+        self.handler = self.create_handler(controller, self.scheduler)
+        self.assertTrue(self.handler.start_server(message_handler=self.scheduler.handle))
+        self.sock = socket.create_connection(self.handler.socket.getsockname(), timeout=5)
+
+    def tearDown(self):
+        """Stop the handler and the scheduler."""
+        self.sock.close()
+        self.handler.stop_server()
+        self.scheduler.stop()
+
+    def _send(self, n, delay, request_id=None):
+        request = {"type": "G", "payload": {"n": n, "delay": delay}}
+        if request_id is not None:
+            request["id"] = request_id
+        self.sock.sendall(encode_frame(json.dumps(request).encode('utf-8')))
+
+    def test_tagged_requests_are_answered_as_they_finish(self):
+        """Test that a slow request does not hold up the ones sent after it."""
+        started = time.time()
+        self._send("slow", 0.5, request_id=1)
+        for n in range(2, 6):
+            self._send(n, 0.05, request_id=n)
+        responses = [json.loads(recv_frame(self.sock)) for _ in range(5)]
+        self.assertLess(time.time() - started, 0.9)
+        self.assertEqual(responses[-1], {"id": 1, "type": "S", "payload": "slow"})
+        self.assertEqual(sorted(response["id"] for response in responses[:-1]), [2, 3, 4, 5])
+        self.assertTrue(all(response["payload"] == response["id"] for response in responses[:-1]))
+
+    def test_untagged_requests_keep_their_order(self):
+        """Test that a request without an id is answered after everything sent before it."""
+        self._send("tagged", 0.3, request_id=1)
+        self._send("first", 0.1)
+        self._send("second", 0)
+        responses = [json.loads(recv_frame(self.sock)) for _ in range(3)]
+        self.assertEqual([response["payload"] for response in responses], ["tagged", "first", "second"])
+        self.assertNotIn("id", responses[1])
+
+class TestThreadHandlerPipelining(PipeliningTests, unittest.TestCase):
+    """Pipelining on the thread per client handler."""
+
+    def create_handler(self, controller, scheduler):
+        return SocketHandler("127.0.0.1", 0, controller, scheduler=scheduler)
+
+class TestEventHandlerPipelining(PipeliningTests, unittest.TestCase):
+    """Pipelining on the event loop handler."""
+
+    def create_handler(self, controller, scheduler):
+        return EventSocketHandler("127.0.0.1", 0, controller, scheduler=scheduler)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Unit tests for the RequestScheduler class.
+"""
+import json
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.socket.request_scheduler import RequestScheduler
+
+def request(msg_type, payload=None):
+    return json.dumps({"type": msg_type, "payload": payload or []}).encode('utf-8')
+
+class TestRequestScheduler(unittest.TestCase):
+    """Unit tests for the RequestScheduler class."""
+
+    def setUp(self):
+        """Create a scheduler whose logins wait until the test releases them."""
+        self.release = threading.Event()
+        self.handled = []
+
+        def handler(data, client_socket):
+            msg_type = json.loads(data.decode('utf-8'))["type"]
+            if msg_type == 'L':
+                self.release.wait(5)
+            self.handled.append(msg_type)
+            return json.dumps({"type": "S", "payload": msg_type}).encode('utf-8')
+
+        self.scheduler = RequestScheduler(handler, workers={'auth': 1, 'write': 1, 'read': 1},
+                                          max_depth=2, max_queue_wait=5)
+        self.scheduler.start()
+
+    def tearDown(self):
+        """Release blocked requests and stop the workers."""
+        self.release.set()
+        self.scheduler.stop()
+
+    def test_slow_logins_do_not_delay_messages(self):
+        """Test that writes and reads are answered while every auth worker is busy."""
+        self.scheduler.submit(request('L'), None, lambda response: None)
+        started = time.time()
+        self.assertEqual(json.loads(self.scheduler.handle(request('M', {"sender": "a"}))), {"type": "S", "payload": "M"})
+        self.assertEqual(json.loads(self.scheduler.handle(request('G'))), {"type": "S", "payload": "G"})
+        self.assertLess(time.time() - started, 1)
+        self.assertNotIn('L', self.handled)
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        """Test that a request beyond the queue limit gets an immediate busy error."""
+        responses = []
+        self.scheduler.submit(request('L'), None, responses.append)
+        while self.scheduler.stats()["auth"]["running"] == 0:
+            time.sleep(0.01)
+        # One login is with the worker, two wait, the fourth does not fit
+        accepted = [self.scheduler.submit(request('L'), None, responses.append) for _ in range(3)]
+        self.assertEqual(accepted, [True, True, False])
+        rejection = json.loads(responses[0])
+        self.assertEqual(rejection["type"], "E")
+        self.assertGreaterEqual(rejection["retry_after"], RequestScheduler.MIN_RETRY_AFTER)
+        self.assertEqual(self.scheduler.stats()["auth"]["rejected"], 1)
+
+        self.release.set()
+        deadline = time.time() + 5
+        while len(responses) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([json.loads(r)["type"] for r in responses[1:]], ["S", "S", "S"])
+
+    def test_requests_that_waited_too_long_are_rejected(self):
+        """Test that a request whose client waited past the limit is not processed anymore."""
+        self.scheduler.max_queue_wait = 0.05
+        responses = []
+        self.scheduler.submit(request('L'), None, responses.append)
+        self.scheduler.submit(request('L'), None, responses.append)
+        time.sleep(0.1)
+        self.release.set()
+        deadline = time.time() + 5
+        while len(responses) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([json.loads(r)["type"] for r in responses], ["S", "E"])
+        self.assertEqual(self.handled, ['L'])
+        self.assertEqual(self.scheduler.stats()["auth"]["expired"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Unit tests for the ShardRouter class.
+"""
+import json
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.batch import batch_request
+from backend.replication.sharding import ShardRouter, shard_of
+
+class FakeShard:
+    """Replication group stand-in that records requests and answers from a table."""
+
+    def __init__(self, responses=None, primary=True, primary_address=None):
+        self.requests = []
+        self.responses = responses or {}
+        self.primary = primary
+        self.primary_address = primary_address
+        self.notifications = []
+
+    def is_primary(self):
+        return self.primary
+
+    def notify_primary(self, username, notification):
+        self.notifications.append((username, notification))
+        return True
+
+    def add_primary_hint(self, response):
+        if self.primary or not self.primary_address:
+            return response
+        decoded = json.loads(response.decode('utf-8'))
+        decoded["primary"] = self.primary_address
+        return json.dumps(decoded).encode('utf-8')
+
+    def handle_client_operation(self, data, client_socket):
+        request = json.loads(data.decode('utf-8'))
+        self.requests.append(request)
+        response = self.responses.get(request["type"], {"type": "S", "payload": "ok"})
+        return json.dumps(response).encode('utf-8')
+
+def request(msg_type, payload):
+    return json.dumps({"type": msg_type, "payload": payload}).encode('utf-8')
+
+class TestShardRouter(unittest.TestCase):
+    """Unit tests for the ShardRouter class."""
+
+    def setUp(self):
+        """Create a router over two fake shards."""
+        self.shards = [FakeShard(), FakeShard()]
+        self.router = ShardRouter(self.shards)
+
+    def tearDown(self):
+        """Stop the router's worker threads."""
+        self.router.stop()
+
+    def _user_on(self, shard):
+        return next(f"user{n}" for n in range(100) if shard_of(f"user{n}", 2) == shard)
+
+    def test_shard_of_is_stable_and_spread(self):
+        """Test that a username always maps to the same shard and users spread over all shards."""
+        self.assertEqual(shard_of("alice", 4), shard_of("alice", 4))
+        counts = [0] * 4
+        for n in range(1000):
+            counts[shard_of(f"user{n}", 4)] += 1
+        self.assertTrue(all(150 < count < 350 for count in counts))
+        self.assertEqual({shard_of(f"user{n}", 1) for n in range(50)}, {0})
+
+    def test_requests_go_to_owner_shard(self):
+        """Test that logins go to the user's shard and messages to the sender's shard."""
+        user = self._user_on(1)
+        self.router.dispatch(request("L", [user, "pw"]))
+        self.router.dispatch(request("M", {"sender": user, "recipient": self._user_on(0), "message": "hi"}))
+        self.assertEqual([r["type"] for r in self.shards[1].requests], ["L", "M"])
+        self.assertEqual(self.shards[0].requests, [])
+
+    def test_messages_are_merged_from_all_shards(self):
+        """Test that GM combines the conversations of every shard in timestamp order."""
+        self.shards[0].responses["GM"] = {"type": "S", "payload": {"bob": [{"message": "b", "timestamp": "2"}]}}
+        self.shards[1].responses["GM"] = {"type": "S", "payload": {"bob": [{"message": "a", "timestamp": "1"}],
+                                                                   "carol": [{"message": "c", "timestamp": "3"}]}}
+        response = json.loads(self.router.dispatch(request("GM", ["alice"])))
+        self.assertEqual({user: [m["message"] for m in messages] for user, messages in response["payload"].items()},
+                         {"bob": ["a", "b"], "carol": ["c"]})
+
+    def test_errors_from_a_shard_are_returned(self):
+        """Test that a shard without a primary makes the whole scatter-gather fail."""
+        self.shards[1].responses["G"] = {"type": "E", "payload": "No primary available"}
+        response = json.loads(self.router.dispatch(request("G", [])))
+        self.assertEqual(response["type"], "E")
+
+    def test_delete_cleans_up_other_shards(self):
+        """Test that deleting a user also reaches the shards holding messages sent to them."""
+        user = self._user_on(0)
+        self.router.dispatch(request("U", {"username": user}))
+        self.assertEqual([r["type"] for r in self.shards[0].requests], ["U"])
+        self.assertEqual([r["type"] for r in self.shards[1].requests], ["U"])
+
+    def test_live_messages_reach_the_receivers_shard_primary(self):
+        """Test that a message between users on shards with different primaries is pushed from the receiver's."""
+        sender, receiver = self._user_on(0), self._user_on(1)
+        self.shards[1].primary = False
+        self.router.notify(sender, receiver, b'{"type": "M"}')
+        # Only the primary that stored the message passes it on, and none is needed within one server
+        self.router.notify(receiver, sender, b'{"type": "M"}')
+        self.router.notify(sender, sender, b'{"type": "M"}')
+        time.sleep(0.1)
+        self.assertEqual(self.shards[1].notifications, [(receiver, b'{"type": "M"}')])
+        self.assertEqual(self.shards[0].notifications, [])
+
+    def test_clients_are_pointed_at_their_own_shards_primary(self):
+        """Test that the primary hint names the primary of the user a request acts for, where pushes happen."""
+        user = self._user_on(1)
+        self.shards[1] = FakeShard(primary=False, primary_address=["10.0.0.2", 8001])
+        self.router.managers = self.shards
+        login = batch_request([{"type": "L", "payload": [user, "pw"]}, {"type": "GM", "payload": [user]}])
+        response = self.router.add_primary_hint(login, b'{"type": "BATCH", "payload": []}')
+        self.assertEqual(json.loads(response)["primary"], ["10.0.0.2", 8001])
+        for data in [request("G", []), request("M", {"sender": self._user_on(0), "recipient": user})]:
+            self.assertNotIn(b"primary", self.router.add_primary_hint(data, b'{"type": "S", "payload": "ok"}'))
+
+if __name__ == '__main__':
+    unittest.main()
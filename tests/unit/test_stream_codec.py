@@ -0,0 +1,84 @@
+"""
+Unit tests for the replication stream codec.
+"""
+import json
+import socket
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import the application modules
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.protocol.framing import send_frame, recv_frame
+from backend.replication.mutation_log import build_mutation_operation
+from backend.replication.stream_codec import COMPRESSION_METHODS, ReplicationStreamCodec
+
+def make_entries(start, count):
+    """Build log entries holding chat message operations."""
+    return [{
+        "index": index,
+        "term": 2,
+        "operation": json.dumps({"type": "M", "payload": {"sender": "alice", "recipient": "bob",
+                                                          "message": f"message \"{index}\" é"}})
+    } for index in range(start, start + count)]
+
+class TestReplicationStreamCodec(unittest.TestCase):
+    """Unit tests for the ReplicationStreamCodec class."""
+
+    def test_round_trip_for_every_method(self):
+        """Test that batches decode to the entries that were encoded, in order, across a stream."""
+        for method in COMPRESSION_METHODS:
+            sender = ReplicationStreamCodec(method)
+            receiver = ReplicationStreamCodec(method)
+            for start in [1, 11]:
+                entries = make_entries(start, 10)
+                payload, _ = sender.encode_batch(2, "replica1", entries)
+                header, decoded = receiver.decode_batch(payload)
+                self.assertEqual(header["server_id"], "replica1")
+                self.assertEqual(decoded, entries)
+
+    def test_operations_are_not_escaped_twice(self):
+        """Test that operations are carried as raw bytes rather than JSON strings."""
+        entries = make_entries(1, 1)
+        payload, raw_size = ReplicationStreamCodec("none").encode_batch(2, "replica1", entries)
+        self.assertIn(entries[0]["operation"].encode('utf-8'), payload)
+        self.assertEqual(raw_size, len(payload))
+
+    def test_dictionary_helps_small_batches(self):
+        """Test that the preset dictionary compresses a single operation better than plain zlib."""
+        entries = make_entries(1, 1)
+        with_dictionary, _ = ReplicationStreamCodec("zlib-dict-v1").encode_batch(2, "replica1", entries)
+        without_dictionary, _ = ReplicationStreamCodec("zlib").encode_batch(2, "replica1", entries)
+        self.assertLess(len(with_dictionary), len(without_dictionary))
+
+    def test_dictionary_matches_mutation_entries(self):
+        """Test that the current dictionary, built from mutation entries, beats the one built from client operations."""
+        operation = build_mutation_operation([{"op": "insert", "collection": "messages", "document": {
+            "sender": "alice", "receiver": "bob", "message": "hi", "timestamp": "2024-01-01T00:00:00.000001",
+            "_id": "1704067200.000001_0"}}])
+        entries = [{"index": 1, "term": 2, "operation": operation}]
+        v2, _ = ReplicationStreamCodec("zlib-dict-v2").encode_batch(2, "replica1", entries)
+        v1, _ = ReplicationStreamCodec("zlib-dict-v1").encode_batch(2, "replica1", entries)
+        self.assertLess(len(v2), len(v1) * 0.8)
+
+    def test_negotiation_falls_back(self):
+        """Test that the first supported offered method is chosen."""
+        self.assertEqual(ReplicationStreamCodec.choose(["zlib-dict-v9", "zlib", "none"]), "zlib")
+        self.assertEqual(ReplicationStreamCodec.choose(["lz4"]), "none")
+
+    def test_frames(self):
+        """Test that frames of any size arrive whole."""
+        left, right = socket.socketpair()
+        try:
+            send_frame(left, b"x" * 200000)
+            send_frame(left, b"")
+            self.assertEqual(len(recv_frame(right)), 200000)
+            self.assertEqual(recv_frame(right), b"")
+            left.close()
+            self.assertIsNone(recv_frame(right))
+        finally:
+            right.close()
+
+if __name__ == '__main__':
+    unittest.main()